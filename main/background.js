@@ -59,6 +59,40 @@ async function startFlask(port) {
   }
 }
 
+/**
+ * Function to wait until the Flask backend answers its readiness endpoint
+ * @param {number} port - The port number Flask is running on
+ * @param {number} timeoutMs - How long to keep polling before giving up
+ * @returns {Promise<boolean>} Whether the backend became ready in time
+ */
+function waitForBackend(port, timeoutMs = 15000) {
+  const http = require('http');
+  const deadline = Date.now() + timeoutMs;
+
+  return new Promise((resolve) => {
+    const poll = () => {
+      const req = http.get({ host: '127.0.0.1', port, path: '/healthz', timeout: 500 }, (res) => {
+        res.resume();
+        if (res.statusCode === 200) {
+          resolve(true);
+        } else {
+          retry();
+        }
+      });
+      req.on('timeout', () => req.destroy());
+      req.on('error', retry);
+    };
+    const retry = () => {
+      if (Date.now() >= deadline) {
+        resolve(false);
+      } else {
+        setTimeout(poll, 100);
+      }
+    };
+    poll();
+  });
+}
+
 /**
  * Function to terminate the Flask process gracefully
  */
@@ -147,6 +181,10 @@ if (!gotTheLock) {
         throw new Error('Failed to start Flask backend.');
       }
 
+      // Wait for the backend to report readiness before the UI starts calling it
+      const backendReady = await waitForBackend(port);
+      console.log(backendReady ? 'Flask backend is ready.' : 'Flask backend readiness check timed out.');
+
       // Store the apiEndpoint for frontend use
       const apiEndpoint = `http://localhost:${port}`;
       store.set('apiEndpoint', apiEndpoint);
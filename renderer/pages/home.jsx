@@ -99,40 +99,51 @@ export default function EnhancedForm() {
     }
   };
 
-  // **Fetch Stored Emails from the API on Component Mount**
+  // **Subscribe to Email List Changes from the API on Component Mount**
+  // The backend sends a full snapshot first and then only the rows that changed,
+  // so the list stays current without refetching it after every process and send.
   useEffect(() => {
-    const fetchStoredEmails = async () => {
-      try {
-        const response = await fetch(`${apiEndpoint}/get-emails`, {
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          method: 'GET',
-        });
-
-        const result = await response.json();
+    const recipients = new Map();
+    const eventSource = new EventSource(`${apiEndpoint}/emails/stream`);
+
+    const publishUnsentEmails = () => {
+      // Filter to get only 'unsent' emails
+      const unsentEmails = Array.from(recipients.values())
+        .filter((emailObj) => emailObj.status === 'unsent')
+        .sort((a, b) => a.id - b.id)
+        .map((emailObj) => emailObj.email);
+      setStoredEmails(unsentEmails);
+    };
 
-        if (response.ok && result.status === 'success') {
-          // Filter to get only 'unsent' emails
-          const unsentEmails = result.emails
-            .filter((emailObj) => emailObj.status === 'unsent')
-            .map((emailObj) => emailObj.email);
-          setStoredEmails(unsentEmails);
-        } else {
-          setLocalSnackbar({
-            open: true,
-            message: result.message || 'Failed to fetch emails.',
-            type: 'error',
-          });
-        }
-      } catch (error) {
-        console.error('Error fetching emails:', error);
-      }
+    eventSource.addEventListener('snapshot', (event) => {
+      const { emails } = JSON.parse(event.data);
+      recipients.clear();
+      emails.forEach((emailObj) => recipients.set(emailObj.email, emailObj));
+      publishUnsentEmails();
+    });
+
+    eventSource.addEventListener('change', (event) => {
+      const { removed, upserted } = JSON.parse(event.data);
+      removed.forEach((email) => recipients.delete(email));
+      upserted.forEach((emailObj) => recipients.set(emailObj.email, emailObj));
+      publishUnsentEmails();
+    });
+
+    eventSource.onerror = (error) => {
+      // EventSource reconnects on its own and resumes from the last event it received
+      console.error('Email change stream error:', error);
     };
 
-    fetchStoredEmails();
+    return () => eventSource.close();
   }, [apiEndpoint]);
 
+  // **Keep the Send Total in Step with the Unsent List While Idle**
+  useEffect(() => {
+    if (!isSendingEmail) {
+      setTotalEmailsToSend(storedEmails.length);
+    }
+  }, [storedEmails, isSendingEmail]);
+
   // **Handle Form Submission**
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -193,8 +204,8 @@ export default function EnhancedForm() {
           setImagePreview(null); // Ensure "No Preview" is shown
         };
 
-        // After processing sites, fetch the updated list of unsent emails
-        await fetchStoredEmails();
+        // The unsent list itself arrives through the email change stream
+        resetSendProgress();
       } else {
         const errorData = await response.json();
         console.error('Error:', errorData.message || response.statusText);
@@ -236,51 +247,65 @@ export default function EnhancedForm() {
     setSendProgress(0);
 
     try {
-      for (let i = 0; i < storedEmails.length; i++) {
-        const recipientEmail = storedEmails[i];
-
-        // **Prepare Payload for Single Email**
-        const payload = {
-          email: email, // Sender's email
-          password: password, // Sender's password
-          receiver: recipientEmail, // Single recipient
-        };
+      // **Queue Every Recipient in One Request; the Backend's Outbox Delivers Them**
+      const payload = {
+        email: email, // Sender's email
+        password: password, // Sender's password
+        receiver: storedEmails, // All recipients
+      };
+
+      const response = await fetch(`${apiEndpoint}/send-email`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(payload),
+      });
+      const result = await response.json();
 
-        const response = await fetch(`${apiEndpoint}/send-email`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify(payload),
+      if (!response.ok) {
+        console.error('Error queueing emails:', result.message || response.statusText);
+        setLocalSnackbar({
+          open: true,
+          message: `Failed to send emails: ${result.message || 'Unknown error.'}`,
+          type: 'error',
         });
+        return;
+      }
 
-        if (response.ok) {
-          const result = await response.json();
-          console.log(`Email sent to ${recipientEmail}:`, result);
-
-          setEmailsSent((prev) => prev + 1);
-          setSendProgress(Math.round(((i + 1) / storedEmails.length) * 100));
-
-          // Update the list of storedEmails by removing the sent email
-          setStoredEmails((prev) => prev.filter((email) => email !== recipientEmail));
-        } else {
-          const errorData = await response.json();
-          console.error(`Error sending email to ${recipientEmail}:`, errorData.message || response.statusText);
-          setLocalSnackbar({
-            open: true,
-            message: `Failed to send email to ${recipientEmail}: ${errorData.message || 'Unknown error.'}`,
-            type: 'error',
-          });
+      // **Poll the Batch Until Every Message Is Sent or Dead-Lettered**
+      const skipped = result.skipped_emails.length;
+      let failed = [];
+      if (result.queued_emails.length > 0) {
+        for (;;) {
+          await delay(1000);
+          const statusResponse = await fetch(`${apiEndpoint}/outbox/${result.batch_id}`);
+          if (!statusResponse.ok) {
+            throw new Error(`Batch status request failed with HTTP ${statusResponse.status}.`);
+          }
+          const status = await statusResponse.json();
+          const processed = skipped + status.sent_emails.length + status.failed_emails.length;
+          setEmailsSent(skipped + status.sent_emails.length);
+          setSendProgress(Math.round((processed / storedEmails.length) * 100));
+          if (status.done) {
+            failed = status.failed_emails;
+            break;
+          }
         }
-
-        // **Optional Delay Between Sends to Avoid Overloading SMTP Server**
-        await delay(1000); // 1 second delay
       }
 
-      setLocalSnackbar({ open: true, message: 'All emails processed.', type: 'success' });
+      if (failed.length > 0) {
+        setLocalSnackbar({
+          open: true,
+          message: `Failed to send email to: ${failed.join(', ')}`,
+          type: 'error',
+        });
+      } else {
+        setLocalSnackbar({ open: true, message: 'All emails processed.', type: 'success' });
+      }
 
-      // **Refresh the Unsent Emails List**
-      await fetchStoredEmails();
+      // **Reset Progress; the Unsent Emails List Is Kept Current by the Change Stream**
+      resetSendProgress();
     } catch (error) {
       console.error('Error during email sending process:', error);
     } finally {
@@ -309,37 +334,10 @@ export default function EnhancedForm() {
     };
   }, [imagePreview, setImagePreview, setImageDimensions, apiEndpoint]);
 
-  // **Utility Function to Fetch Unsent Emails**
-  const fetchStoredEmails = async () => {
-    try {
-      const response = await fetch(`${apiEndpoint}/get-emails`, {
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        method: 'GET',
-      });
-
-      const result = await response.json();
-
-      if (response.ok && result.status === 'success') {
-        // Filter to get only 'unsent' emails
-        const unsentEmails = result.emails
-          .filter((emailObj) => emailObj.status === 'unsent')
-          .map((emailObj) => emailObj.email);
-        setStoredEmails(unsentEmails);
-        setTotalEmailsToSend(unsentEmails.length);
-        setEmailsSent(0);
-        setSendProgress(0);
-      } else {
-        setLocalSnackbar({
-          open: true,
-          message: result.message || 'Failed to fetch emails.',
-          type: 'error',
-        });
-      }
-    } catch (error) {
-      console.error('Error fetching emails:', error);
-    }
+  // **Utility Function to Reset Send Progress**
+  const resetSendProgress = () => {
+    setEmailsSent(0);
+    setSendProgress(0);
   };
 
   return (
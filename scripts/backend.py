@@ -1,32 +1,259 @@
+import time
+
+_PROCESS_START = time.perf_counter()
+
+import abc
+import asyncio
+import atexit
 import base64
+import binascii
+import bisect
+import gzip
+import hashlib
+import hmac
+import html
+import importlib
+import math
+import secrets
+import shutil
+import signal
+import random
+import threading
+import uuid
+import zlib
+import os
 import sys
 import logging
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import time
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from flask import Flask, request, jsonify, send_file, abort, g
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Optional
+from flask import Flask, Response, request, jsonify, send_file, abort, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime
+from datetime import date, datetime
 from colorsys import hsv_to_rgb
-from PIL import Image
 import json
 import sqlite3
 import re
 from io import BytesIO
+from urllib.parse import unquote, urlencode, urljoin, urlparse
+
+from emails import normalize_email, partition_emails
+
+if TYPE_CHECKING:
+    # Real imports for type checkers and PyInstaller's dependency analysis; at runtime
+    # these modules are loaded lazily through LazyModule below.
+    import aiohttp
+    import cProfile
+    import requests
+    from multiprocessing import shared_memory
+    import smtplib
+    import undetected_chromedriver as uc
+    from email.generator import BytesGenerator
+    from email.mime.application import MIMEApplication
+    from email.mime.image import MIMEImage
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from PIL import Image, ImageDraw, ImageFilter, ImageFont
+    from playwright.async_api import async_playwright
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+# Milliseconds spent importing each lazily loaded module, in load order
+IMPORT_PROFILE = {}
+
+# Milliseconds since process start at which each startup phase completed
+STARTUP_TIMINGS = {}
+
+
+class LazyModule:
+    """
+    Proxy for a module (or one attribute of a module) that is imported on first use.
+
+    Keeps the browser automation, imaging and mail stacks out of process startup;
+    the time spent importing each one is recorded in IMPORT_PROFILE.
+    """
+
+    def __init__(self, module_name, attribute=None):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._module_name)
+            if self._module_name not in IMPORT_PROFILE:
+                IMPORT_PROFILE[self._module_name] = round((time.perf_counter() - start) * 1000, 2)
+            self._target = getattr(module, self._attribute) if self._attribute else module
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+
+if not TYPE_CHECKING:
+    uc = LazyModule('undetected_chromedriver')
+    cProfile = LazyModule('cProfile')
+    By = LazyModule('selenium.webdriver.common.by', 'By')
+    WebDriverWait = LazyModule('selenium.webdriver.support.ui', 'WebDriverWait')
+    EC = LazyModule('selenium.webdriver.support.expected_conditions')
+    smtplib = LazyModule('smtplib')
+    requests = LazyModule('requests')
+    aiohttp = LazyModule('aiohttp')
+    MIMEText = LazyModule('email.mime.text', 'MIMEText')
+    MIMEImage = LazyModule('email.mime.image', 'MIMEImage')
+    MIMEApplication = LazyModule('email.mime.application', 'MIMEApplication')
+    MIMEMultipart = LazyModule('email.mime.multipart', 'MIMEMultipart')
+    BytesGenerator = LazyModule('email.generator', 'BytesGenerator')
+    Image = LazyModule('PIL.Image')
+    ImageDraw = LazyModule('PIL.ImageDraw')
+    ImageFilter = LazyModule('PIL.ImageFilter')
+    ImageFont = LazyModule('PIL.ImageFont')
+    shared_memory = LazyModule('multiprocessing.shared_memory')
+    async_playwright = LazyModule('playwright.async_api', 'async_playwright')
+
+
+def mark_startup(phase):
+    """Record how long after process start the given startup phase completed."""
+    STARTUP_TIMINGS[phase] = round((time.perf_counter() - _PROCESS_START) * 1000, 2)
+
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 
+# Response negotiation: alternative encodings of jsonify output, compression and summary-only bulk responses
+COMPRESSION_MIN_BYTES = 1024  # Smaller bodies are sent as they are
+COMPRESSION_LEVELS = {'br': 5, 'gzip': 6}
+MSGPACK_MIMETYPE = 'application/msgpack'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+RESPONSE_MIMETYPES = ('application/json', MSGPACK_MIMETYPE, 'application/x-msgpack', NDJSON_MIMETYPE)
+
+_optional_modules = {}
+
+
+def get_optional_module(name):
+    """Return an optional module such as msgpack or brotli, or None when it is not installed."""
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            logger.info(f"{name} is not installed; responses will not use it.")
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+def ndjson_lines(provider, obj):
+    """
+    Yield an object as NDJSON: first the object without its list fields, then one line per list
+    element, wrapped as {"<field>": element}. Anything else is a single line.
+    """
+    if not isinstance(obj, dict):
+        yield provider.dumps(obj) + '\n'
+        return
+    yield provider.dumps({key: value for key, value in obj.items() if not isinstance(value, list)}) + '\n'
+    for key, value in obj.items():
+        if isinstance(value, list):
+            for item in value:
+                yield provider.dumps({key: item}) + '\n'
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider whose jsonify responses follow the request's Accept header: MessagePack
+    (when msgpack is installed) or NDJSON on request, JSON otherwise. Keys are not sorted.
+    """
+    sort_keys = False
+
+    def response(self, *args, **kwargs):
+        if not has_request_context():
+            return super().response(*args, **kwargs)
+        mimetype = request.accept_mimetypes.best_match(RESPONSE_MIMETYPES, default='application/json')
+        msgpack = get_optional_module('msgpack') if mimetype in (MSGPACK_MIMETYPE, 'application/x-msgpack') else None
+        if msgpack is not None:
+            data = msgpack.packb(self._prepare_response_obj(args, kwargs), default=self.default)
+            response = self._app.response_class(data, mimetype=MSGPACK_MIMETYPE)
+        elif mimetype == NDJSON_MIMETYPE:
+            body = ''.join(ndjson_lines(self, self._prepare_response_obj(args, kwargs)))
+            response = self._app.response_class(body, mimetype=NDJSON_MIMETYPE)
+        else:
+            response = super().response(*args, **kwargs)
+        response.vary.add('Accept')
+        return response
+
+
+app.json = NegotiatingJSONProvider(app)
+
+
+def wants_summary():
+    """True when the client asked for counts instead of address lists (?summary=1 or Prefer: return=minimal)."""
+    if request.args.get('summary', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'return=minimal' in request.headers.get('Prefer', '').replace(' ', '').split(',')
+
+
+def bulk_result(response, **lists):
+    """
+    Add a bulk mutation's per-address lists and their counts ('added_emails' -> 'added_count')
+    to its response. In summary mode only the counts are added.
+    """
+    summary = wants_summary()
+    for name, values in lists.items():
+        count_name = name[:-len('_emails')] if name.endswith('_emails') else name
+        response[f"{count_name}_count"] = len(values)
+        if not summary:
+            response[name] = values
+    if summary:
+        g.preference_applied = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress response bodies of at least COMPRESSION_MIN_BYTES with brotli (when installed) or gzip,
+    following Accept-Encoding. Streams and files (already compressed images) are left alone.
+    """
+    try:
+        if g.pop('preference_applied', False):
+            response.headers['Preference-Applied'] = 'return=minimal'
+        if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers \
+                or response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_BYTES:
+            return response
+
+        accepted = request.accept_encodings
+        brotli = get_optional_module('brotli') if accepted['br'] else None
+        if brotli is not None:
+            encoding = 'br'
+            compressed = brotli.compress(data, quality=COMPRESSION_LEVELS['br'])
+        elif accepted['gzip']:
+            encoding = 'gzip'
+            compressed = gzip.compress(data, compresslevel=COMPRESSION_LEVELS['gzip'], mtime=0)
+        else:
+            return response
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        logger.debug(f"Compressed {request.path} response with {encoding}: {len(data)} -> {len(compressed)} bytes")
+    except Exception as e:
+        logger.exception("Failed to compress the response.")
+    return response
+
+
 # Define a JSON formatter for structured logging
 class JSONFormatter(logging.Formatter):
     def format(self, record):
@@ -62,15 +289,28 @@ console_handler.setFormatter(JSONFormatter())
 logger.addHandler(console_handler)
 
 
+# Bump when the schema below changes; startup skips all DDL when the database is current.
+SCHEMA_VERSION = 3
+
+
 def init_db():
     """
-    Initialize the SQLite3 database and create the 'emails' table if it doesn't exist.
+    Initialize the SQLite3 database and create the 'emails', 'outbox' and 'table_versions' tables if they don't exist.
+    A current database is detected with a single PRAGMA user_version read.
     """
+    db = None
     try:
         db_path = BASE_DIR / 'wing-master-db.db'
         log_path("Database path", db_path)
         db = sqlite3.connect(db_path)
         cursor = db.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            logger.info(f"Database schema is current (version {version}).")
+            return
+
+        # WAL lets outbox workers write while request handlers read
+        cursor.execute("PRAGMA journal_mode=WAL")
         # Create the 'emails' table with the 'status' column
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS emails (
@@ -80,12 +320,78 @@ def init_db():
                 date_added TEXT NOT NULL
             )
         ''')
+        # Create the 'outbox' table used by the durable mail queue
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT NOT NULL,
+                sender_email TEXT NOT NULL,
+                recipient_email TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                UNIQUE (batch_id, recipient_email)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (state, next_attempt_at)")
+        # Per-table change counters, bumped for every changed row so in-process caches can detect other writers
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('emails', 0)")
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS emails_version_{operation.lower()} AFTER {operation} ON emails
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = 'emails';
+                END
+            ''')
+        collisions = canonicalize_stored_emails(cursor) if version < 3 else []
+        if collisions:
+            # Stay below version 3 so the check runs again at every startup until the rows are resolved
+            db.commit()
+            logger.warning(f"Database left at schema version {version}: {len(collisions)} groups of stored emails "
+                           f"differ only in case or domain encoding and were not merged: {collisions}")
+            return
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         db.commit()
-        logger.info("Database initialized and 'emails' table ensured.")
+        logger.info(f"Database initialized at schema version {SCHEMA_VERSION}.")
     except Exception as e:
         logger.exception("Failed to initialize the database.")
     finally:
-        db.close()
+        if db is not None:
+            db.close()
+
+
+def canonicalize_stored_emails(cursor):
+    """
+    Rewrite stored addresses into their canonical form (see normalize_email).
+    Rows that would collapse onto the same address are left untouched, since merging them would lose
+    a status or date_added; they are returned as a list of address groups for someone to resolve.
+    Invalid rows are left as they are.
+    """
+    groups = {}
+    for row_id, email in cursor.execute("SELECT id, email FROM emails ORDER BY id").fetchall():
+        groups.setdefault(normalize_email(email) or email, []).append((row_id, email))
+
+    renames = []
+    collisions = []
+    for canonical, rows in groups.items():
+        if len(rows) > 1:
+            collisions.append([email for _, email in rows])
+        elif rows[0][1] != canonical:
+            renames.append((canonical, rows[0][0]))
+    cursor.executemany("UPDATE emails SET email = ? WHERE id = ?", renames)
+    if renames:
+        logger.info(f"Canonicalized {len(renames)} stored emails.")
+    return collisions
 
 
 def log_path(name, path_obj):
@@ -105,18 +411,69 @@ else:
     current_dir = Path(__file__).resolve().parent
     log_path("current_dir (script)", current_dir)
 
-# Set BASE_DIR to the parent directory of current_dir
-BASE_DIR = current_dir.parent
+# Set BASE_DIR to the parent directory of current_dir; WINGSTAR_BASE_DIR points it elsewhere (e.g. load tests)
+BASE_DIR = Path(os.environ['WINGSTAR_BASE_DIR']) if os.environ.get('WINGSTAR_BASE_DIR') else current_dir.parent
 log_path("BASE_DIR", BASE_DIR)
 
 
+def record_server_timing(name, duration_ms):
+    """Add a duration to the current request's Server-Timing entry for name; a no-op outside requests."""
+    if not has_request_context():
+        return
+    timings = g.setdefault('server_timings', {})
+    total, count = timings.get(name, (0.0, 0))
+    timings[name] = (total + duration_ms, count + 1)
+
+
+@contextmanager
+def server_timing(name):
+    """Time the enclosed block into the current request's Server-Timing entry for name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_server_timing(name, (time.perf_counter() - start) * 1000)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds the time spent executing statements to the request's 'db' Server-Timing entry."""
+
+    def execute(self, *args):
+        with server_timing('db'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with server_timing('db'):
+            return super().executemany(*args)
+
+    def executescript(self, *args):
+        with server_timing('db'):
+            return super().executescript(*args)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind its execute shortcuts, are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
 def get_db():
     """
     Opens a new database connection if there is none yet for the current application context.
     """
     if 'db' not in g:
         db_path = BASE_DIR / 'wing-master-db.db'
-        g.db = sqlite3.connect(str(db_path))
+        g.db = sqlite3.connect(str(db_path), factory=TimedConnection)
         g.db.row_factory = sqlite3.Row  # Enables name-based access to columns
         logger.debug("Database connection established.")
     return g.db
@@ -134,40 +491,26 @@ def close_db(error):
         logger.debug("Database connection closed.")
 
 
-def is_valid_email(email):
-    """
-    Validate the email address using a regex pattern.
-    Returns True if valid, False otherwise.
-    """
-    regex = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(regex, email) is not None
-
-
-def percentage_to_color(percentage):
+def _red_yellow_green(percentage):
     """
-    Converts a percentage to a HEX color code, transitioning from red (0%)
-    through yellow (50%) to green (100%).
+    Default palette: transitions from red (0%) through yellow (50%) to green (100%).
+    Returns an (r, g, b) tuple of floats in the range [0, 1].
     """
-    # Ensure percentage is between 0 and 100
-    percentage = max(0, min(100, percentage))
-
     # Map percentage to hue (0° to 120°)
     hue = (percentage * 1.2) / 360  # Adjust hue for hsv_to_rgb (range 0 to 1)
 
     # Full saturation and brightness
-    saturation = 1.0
-    brightness = 1.0
+    return hsv_to_rgb(hue, 1.0, 1.0)
+
 
-    # Get RGB values from HSV
-    r, g, b = hsv_to_rgb(hue, saturation, brightness)
+def _green_yellow_red(percentage):
+    """Reversed palette for metrics where a high percentage is bad."""
+    return _red_yellow_green(100 - percentage)
 
-    # Convert RGB values to integers in the range [0,255]
-    r = int(r * 255)
-    g = int(g * 255)
-    b = int(b * 255)
 
-    # Return color in HEX format
-    return f'#{r:02X}{g:02X}{b:02X}'
+def _blue_scale(percentage):
+    """Single-hue palette from light to dark blue, for heatmaps without good/bad semantics."""
+    return hsv_to_rgb(0.6, 0.1 + 0.9 * percentage / 100, 1.0 - 0.6 * percentage / 100)
 
 
 def get_text_color(hex_color):
@@ -184,7 +527,326 @@ def get_text_color(hex_color):
     return '#000000' if brightness > 125 else '#FFFFFF'
 
 
-def crop_image_with_percentage(image_path, crop_percentages, output_files):
+# Lookup table resolution: entries per percentage point (10 gives 0.1% steps)
+COLOR_LUT_STEPS = 10
+
+
+class ColorScale:
+    """
+    Precomputed percentage-to-color lookup table for one palette.
+
+    Background and contrasting text colors are computed once for every step between
+    0% and 100%, so mapping a tile is a clamp, a multiply and a list index.
+    """
+
+    def __init__(self, palette, steps=COLOR_LUT_STEPS):
+        self.steps = steps
+        self.colors = []
+        self.text_colors = []
+        for index in range(100 * steps + 1):
+            r, g, b = palette(index / steps)
+            # Convert RGB values to integers in the range [0,255]
+            color = f'#{int(r * 255):02X}{int(g * 255):02X}{int(b * 255):02X}'
+            self.colors.append(color)
+            self.text_colors.append(get_text_color(color))
+        self._last_index = len(self.colors) - 1
+
+    def index(self, percentage):
+        """Return the lookup table index for a percentage, clamped to 0-100."""
+        index = int(percentage * self.steps + 0.5)
+        return 0 if index < 0 else self._last_index if index > self._last_index else index
+
+    def color(self, percentage):
+        return self.colors[self.index(percentage)]
+
+    def text_color(self, percentage):
+        return self.text_colors[self.index(percentage)]
+
+    def map(self, percentages):
+        """
+        Map a sequence of percentages to a list of (background, text) color pairs.
+        NumPy arrays are mapped with a single vectorized gather.
+        """
+        if hasattr(percentages, '__array__') and not isinstance(percentages, (list, tuple)):
+            import numpy as np
+            indices = np.clip(np.floor(np.asarray(percentages, dtype=float) * self.steps + 0.5), 0, self._last_index)
+            indices = indices.astype(np.intp)
+            colors = np.asarray(self.colors)[indices]
+            text_colors = np.asarray(self.text_colors)[indices]
+            return list(zip(colors.tolist(), text_colors.tolist()))
+
+        colors, text_colors, index = self.colors, self.text_colors, self.index
+        return [(colors[i], text_colors[i]) for i in map(index, percentages)]
+
+
+PALETTES = {
+    'red-green': _red_yellow_green,
+    'green-red': _green_yellow_red,
+    'blue': _blue_scale,
+}
+DEFAULT_PALETTE = 'red-green'
+
+_color_scales = {}
+
+
+def register_palette(name, palette):
+    """
+    Register a palette: a function taking a percentage (0-100) and returning (r, g, b) floats in [0, 1].
+    """
+    PALETTES[name] = palette
+    _color_scales.pop(name, None)
+
+
+def get_color_scale(palette=DEFAULT_PALETTE):
+    """Return the lookup table for a palette, building it on first use."""
+    scale = _color_scales.get(palette)
+    if scale is None:
+        if palette not in PALETTES:
+            raise ValueError(f"Unknown palette: {palette}")
+        scale = _color_scales[palette] = ColorScale(PALETTES[palette])
+        logger.debug(f"Color lookup table built for palette '{palette}'.")
+    return scale
+
+
+def percentage_to_color(percentage, palette=DEFAULT_PALETTE):
+    """
+    Converts a percentage to a HEX color code, transitioning from red (0%)
+    through yellow (50%) to green (100%) with the default palette.
+    """
+    return get_color_scale(palette).color(percentage)
+
+
+def percentage_to_text_color(percentage, palette=DEFAULT_PALETTE):
+    """Returns the readable text color (black or white) for the percentage's background color."""
+    return get_color_scale(palette).text_color(percentage)
+
+
+def percentages_to_colors(percentages, palette=DEFAULT_PALETTE):
+    """Batch API: maps many percentages to (background, text) color pairs at once."""
+    return get_color_scale(palette).map(percentages)
+
+
+# Decoded images shared between pipeline stages. An image is decoded once into a raw RGBA buffer in
+# shared memory; crop, resize, composite and encode stages read it through zero-copy PIL views instead
+# of decoding the PNG on disk again, and worker processes can attach to the buffer by name.
+FRAME_STORE_MAX_BYTES = 128 * 1024 * 1024
+FRAME_SHARED_MODES = ('RGB', 'L')  # Source modes restored when a stage writes pixels back out
+
+
+class SharedFrame:
+    """
+    A decoded image held as raw RGBA pixels in a shared memory block, with a reference count.
+
+    The creating process owns the block and unlinks it when the last reference is released;
+    handle() names the block so another process can attach() to it, and an attached frame only
+    closes its own mapping. Views from image() must not be used after the reference is released.
+    When shared memory is unavailable the pixels stay in process memory and handle() is None.
+    """
+
+    def __init__(self, size, source_mode, shm=None, buffer=None, owner=True):
+        self.size = size
+        self.source_mode = source_mode
+        self.nbytes = size[0] * size[1] * 4
+        self._shm = shm
+        self._buffer = shm.buf if shm is not None else buffer
+        self._owner = owner
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_image(cls, image):
+        rgba = image if image.mode == 'RGBA' else image.convert('RGBA')
+        pixels = rgba.tobytes()
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, len(pixels)))
+        except OSError as e:
+            logger.debug(f"Shared memory unavailable; keeping the frame in process memory: {e}")
+            return cls(rgba.size, image.mode, buffer=bytearray(pixels))
+        shm.buf[:len(pixels)] = pixels
+        return cls(rgba.size, image.mode, shm=shm)
+
+    @classmethod
+    def attach(cls, handle):
+        """Map a frame another process published, given its handle(). Release it when done."""
+        name, width, height, source_mode = handle
+        # Workers started by this process share its resource tracker; where Python allows it, attach
+        # untracked so only the owner's unlink ends the block's life
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls((width, height), source_mode, shm=shm, owner=False)
+
+    def handle(self):
+        if self._shm is None:
+            return None
+        return self._shm.name, self.size[0], self.size[1], self.source_mode
+
+    def image(self):
+        """Return a read-only RGBA image over the shared pixels, without copying them."""
+        return Image.frombuffer('RGBA', self.size, memoryview(self._buffer)[:self.nbytes], 'raw', 'RGBA', 0, 1)
+
+    def restore_mode(self, image):
+        """Convert pixels taken from this frame back to the source image's mode, e.g. before saving a crop."""
+        return image.convert(self.source_mode) if self.source_mode in FRAME_SHARED_MODES else image
+
+    def acquire(self):
+        with self._lock:
+            if self._refs <= 0:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self._buffer = None
+        if self._shm is not None:
+            if self._owner:
+                self._shm.unlink()
+            try:
+                self._shm.close()
+            except BufferError:
+                # A view is still alive; the mapping is closed when it is garbage collected
+                logger.debug(f"Shared frame {self._shm.name} still has views; deferring close.")
+
+
+class FrameStore:
+    """
+    Latest decoded frame per image file, shared by every stage that reads the file.
+
+    Frames are keyed by the file's resolved path, so writing a file again replaces its frame, and
+    stored with the file's identity (device, inode, mtime and size) so a frame is never served for a
+    file that has changed since. move() carries a frame along with its file from a staging directory.
+    The store holds one reference per frame and drops it when the file gets a new frame or the store
+    grows past max_bytes; stages hold their own references while they use a frame.
+    """
+
+    def __init__(self, max_bytes=FRAME_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()  # resolved path -> (file identity, frame)
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+    @staticmethod
+    def _key(path):
+        return os.path.realpath(path)
+
+    @staticmethod
+    def _identity(path):
+        stat = os.stat(path)
+        return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _pop(self, key):
+        """Remove the entry at key and return its frame for the caller to release. Call with the lock held."""
+        entry = self._frames.pop(key, None)
+        if entry is None:
+            return None
+        self._bytes -= entry[1].nbytes
+        return entry[1]
+
+    def _put(self, key, identity, frame):
+        """Store a frame, returning the frames it displaces for the caller to release. Call with the lock held."""
+        evicted = [self._pop(key)]
+        self._frames[key] = (identity, frame)
+        self._bytes += frame.nbytes
+        while self._bytes > self.max_bytes and len(self._frames) > 1:
+            evicted.append(self._pop(next(iter(self._frames))))
+        return [old for old in evicted if old is not None]
+
+    def publish(self, path, image):
+        """Share the decoded image of the file just written at path. Returns the frame, acquired for the caller."""
+        frame = SharedFrame.from_image(image)
+        frame.acquire()
+        identity = self._identity(path)
+        with self._lock:
+            evicted = self._put(self._key(path), identity, frame)
+        for old in evicted:
+            old.release()
+        return frame
+
+    def acquire(self, path):
+        """Return the current frame of the file at path with a reference taken, or None."""
+        key = self._key(path)
+        try:
+            identity = self._identity(path)
+        except OSError:
+            identity = None
+        stale = None
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                return None
+            if entry[0] != identity:
+                stale = self._pop(key)
+            elif entry[1].acquire():
+                self._frames.move_to_end(key)
+                return entry[1]
+        if stale is not None:
+            stale.release()
+        return None
+
+    def move(self, source, destination):
+        """Carry the frame of a file just moved from source to destination with os.replace."""
+        try:
+            identity = self._identity(destination)
+        except OSError:
+            identity = None
+        with self._lock:
+            frame = self._pop(self._key(source))
+            evicted = [self._pop(self._key(destination))]
+            if frame is not None and identity is not None:
+                evicted.extend(self._put(self._key(destination), identity, frame))
+            else:
+                evicted.append(frame)
+        for old in evicted:
+            if old is not None:
+                old.release()
+
+    def discard(self, path):
+        """Drop the frame of the file at path, e.g. once the file is deleted."""
+        with self._lock:
+            frame = self._pop(self._key(path))
+        if frame is not None:
+            frame.release()
+
+    def stats(self):
+        with self._lock:
+            return {"frames": len(self._frames), "bytes": self._bytes}
+
+    def clear(self):
+        with self._lock:
+            frames = [frame for _, frame in self._frames.values()]
+            self._frames.clear()
+            self._bytes = 0
+        for frame in frames:
+            frame.release()
+
+
+frame_store = FrameStore()
+atexit.register(frame_store.clear)
+
+
+@contextmanager
+def open_frame(path):
+    """
+    Yield the shared frame of the image at path, decoding the file only if no stage has yet.
+    The frame is published for the stages that read the file after this one.
+    """
+    frame = frame_store.acquire(path)
+    if frame is None:
+        with Image.open(path) as img:
+            img.load()
+            frame = frame_store.publish(path, img)
+    try:
+        yield frame
+    finally:
+        frame.release()
+
+
+def crop_image_with_percentage(image_path, crop_percentages, output_files, validated=False):
     """
     Crop an image based on percentage values.
 
@@ -192,6 +854,7 @@ def crop_image_with_percentage(image_path, crop_percentages, output_files):
     - image_path: Path to the image to crop.
     - crop_percentages: List of (left, top, right, bottom) percentages for cropping.
     - output_files: List of file paths for saving cropped images.
+    - validated: True when the regions were already checked by compile_site.
     """
     logger.info("Starting cropping process...")
     try:
@@ -211,8 +874,9 @@ def crop_image_with_percentage(image_path, crop_percentages, output_files):
             logger.error("Mismatch between crop_percentages and output_files.")
             return
 
-        # Open the image
-        with Image.open(image_path) as img:
+        # Open the image, reusing the frame an earlier stage decoded
+        with open_frame(image_path) as frame:
+            img = frame.image()
             width, height = img.size
             logger.info(f"Original image dimensions: width={width}, height={height}")
 
@@ -223,11 +887,13 @@ def crop_image_with_percentage(image_path, crop_percentages, output_files):
                     f"Crop {i + 1} percentages: left={left_pct}, top={top_pct}, right={right_pct}, bottom={bottom_pct}")
 
                 # Validate percentages
-                if not all(0.0 <= pct <= 1.0 for pct in (left_pct, top_pct, right_pct, bottom_pct)):
+                if validated:
+                    pass
+                elif not all(0.0 <= pct <= 1.0 for pct in (left_pct, top_pct, right_pct, bottom_pct)):
                     logger.warning(
                         f"Invalid crop percentages for crop {i + 1}: {left_pct}, {top_pct}, {right_pct}, {bottom_pct}")
                     continue
-                if left_pct >= right_pct or top_pct >= bottom_pct:
+                elif left_pct >= right_pct or top_pct >= bottom_pct:
                     logger.warning(f"Invalid crop bounds for crop {i + 1}: left >= right or top >= bottom")
                     continue
 
@@ -241,7 +907,7 @@ def crop_image_with_percentage(image_path, crop_percentages, output_files):
                 logger.debug(f"Cropping {i + 1}: left={left}, top={top}, right={right}, bottom={bottom}")
 
                 # Perform the crop
-                cropped_img = img.crop((left, top, right, bottom))
+                cropped_img = frame.restore_mode(img.crop((left, top, right, bottom)))
 
                 # Save the cropped image
                 output_path = Path(output_files[i])
@@ -254,13 +920,32 @@ def crop_image_with_percentage(image_path, crop_percentages, output_files):
                     logger.debug(f"Old file removed: {output_path}")
 
                 cropped_img.save(output_path)
+                frame_store.publish(output_path, cropped_img).release()
                 logger.info(f"Cropped image saved to: {output_path}")
 
     except Exception as e:
         logger.exception("Error cropping image.")
 
 
-def generate_html_file(template_path, output_path, boxes, comments):
+# HTML templates keyed by path, reloaded only when the file's mtime changes
+_html_template_cache = {}
+
+
+def load_html_template(template_path):
+    """
+    Return the contents of an HTML template, reading it from disk only when it has changed.
+    """
+    template_path = Path(template_path)
+    mtime = template_path.stat().st_mtime_ns
+    cached = _html_template_cache.get(template_path)
+    if cached is None or cached[0] != mtime:
+        with open(template_path, 'r', encoding='utf-8') as file:
+            cached = _html_template_cache[template_path] = (mtime, file.read())
+        logger.info(f"HTML template loaded from: {template_path}")
+    return cached[1]
+
+
+def generate_html_file(template_path, output_path, boxes, comments, palette=DEFAULT_PALETTE):
     """
     Generates an HTML file by replacing placeholders with actual data.
 
@@ -269,6 +954,7 @@ def generate_html_file(template_path, output_path, boxes, comments):
     - output_path: Path where the generated HTML file will be saved.
     - boxes: List of dictionaries containing 'title' and 'percentage'.
     - comments: List of comment strings.
+    - palette: Name of the palette used to color the boxes.
     """
     # Log template_path and output_path
     log_path("template_path", template_path)
@@ -276,9 +962,7 @@ def generate_html_file(template_path, output_path, boxes, comments):
 
     # Read the HTML template
     try:
-        with open(template_path, 'r', encoding='utf-8') as file:
-            html_template = file.read()
-        logger.info(f"HTML template loaded from: {template_path}")
+        html_template = load_html_template(template_path)
     except FileNotFoundError:
         logger.error(f"HTML template not found at {template_path}")
         return False
@@ -302,10 +986,11 @@ def generate_html_file(template_path, output_path, boxes, comments):
     html_content = html_content.replace("{{comments}}", comments_html)
 
     # Calculate colors and replace placeholders
-    for i, box in enumerate(boxes, start=1):
-        color = percentage_to_color(box['percentage'])  # Convert percentage to color
+    box_colors = percentages_to_colors([box['percentage'] for box in boxes], palette)
+    for i, (box, (color, text_color)) in enumerate(zip(boxes, box_colors), start=1):
         html_content = html_content.replace(f'{{{{percent{i}}}}}', str(box['percentage']))
         html_content = html_content.replace(f'{{{{color{i}}}}}', color)
+        html_content = html_content.replace(f'{{{{text_color{i}}}}}', text_color)
         html_content = html_content.replace(f'{{{{title{i}}}}}', box['title'])
 
     # Save the generated HTML to the output path
@@ -319,56 +1004,1076 @@ def generate_html_file(template_path, output_path, boxes, comments):
         return False
 
 
-def capture_full_page(driver, output_path):
+# Derivative image cache used by the email pipeline
+IMAGE_CACHE_DIR = Path(BASE_DIR, 'images', 'cache')
+IMAGE_CACHE_MAX_ENTRIES = 64
+
+# Named email image variants: the (width, height) box an image is fitted into, keeping its aspect ratio;
+# a dimension of None leaves that side unbounded.
+EMAIL_IMAGE_VARIANTS = {
+    'email': (870, 490),
+    'retina': (1740, 980),
+    'mobile': (480, None),
+}
+
+# Default byte budget for email attachments and the encodings tried to meet it, in order of preference.
+# WebP is the smallest but is tried last, as some desktop mail clients (e.g. Outlook) cannot display it.
+EMAIL_IMAGE_MAX_BYTES = 600 * 1024
+EMAIL_IMAGE_FORMATS = ('png', 'jpeg', 'webp')
+
+IMAGE_FORMAT_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+
+# Native report compositor: lays out the final report with PIL instead of screenshotting template.html.
+# The default layout mirrors template.html; a JSON file with the same structure can replace it per site.
+REPORT_LAYOUT = {
+    "width": 1920,
+    "min_height": 1080,
+    "padding": 40,  # Page margin plus container padding
+    "gap": 20,
+    "background": {
+        "image": "background-logo.png",
+        "image_width": 0.5,  # Fraction of the page width, centered
+        "gradient": [[255, 255, 255, 204], [192, 192, 192, 204]],
+    },
+    "columns": [
+        {"justify": "space-between", "align": "stretch", "items": [
+            {"type": "image", "file": "summary-cropped.png"},
+            {"type": "image", "file": "upcoming-days-cropped.png"},
+            {"type": "image", "file": "multi-location-cropped.png"},
+        ]},
+        {"justify": "space-between", "align": "center", "items": [
+            {"type": "group", "gap": 5, "items": [
+                {"type": "heading", "text": "Departures"},
+                {"type": "image", "file": "cropped_flight_departure_table.png", "fit": "natural"},
+            ]},
+            {"type": "group", "gap": 5, "items": [
+                {"type": "heading", "text": "Arrivals"},
+                {"type": "image", "file": "cropped_flight_status_table.png", "fit": "natural"},
+            ]},
+            {"type": "boxes", "columns": 2, "max_width": 500},
+            {"type": "comments", "title": "Comment", "max_width": 500},
+        ]},
+        {"justify": "end", "align": "stretch", "items": [
+            {"type": "image", "file": "site1_screenshot_area1.png"},
+            {"type": "image", "file": "site1_screenshot_area2.png"},
+            {"type": "image", "file": "site1_screenshot_area3.png"},
+        ]},
+    ],
+    "footer": {"logo": "wingstar-logo.png", "logo_width": 450, "margin": 20, "timestamp": True},
+}
+
+# Font files tried in order for each weight; Pillow's built-in font is the last resort
+REPORT_FONTS = {
+    "regular": ("arial.ttf", "Arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf"),
+    "bold": ("arialbd.ttf", "Arial Bold.ttf", "DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf"),
+}
+REPORT_TEXT_COLOR = '#333333'
+REPORT_ACCENT_COLOR = '#1d3361'
+
+_report_fonts = {}
+
+
+def get_report_font(weight, size):
+    """Load (once) the first available font file for the weight at the given pixel size."""
+    key = (weight, size)
+    font = _report_fonts.get(key)
+    if font is None:
+        for name in REPORT_FONTS[weight]:
+            try:
+                font = ImageFont.truetype(name, size)
+                break
+            except OSError:
+                continue
+        else:
+            font = ImageFont.load_default(size)
+        _report_fonts[key] = font
+    return font
+
+
+def load_report_layout(name=None):
+    """Return REPORT_LAYOUT, or the JSON layout spec with the given file name from the template directory."""
+    if name is None:
+        return REPORT_LAYOUT
+    layout_path = Path(BASE_DIR, "template", Path(name).name)
+    with open(layout_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def _wrap_text(draw, text, font, width):
+    """Greedy word wrap; words longer than the width are broken anywhere, like overflow-wrap: anywhere."""
+    lines = []
+    line = ''
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if draw.textlength(candidate, font=font) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = ''
+        for char in word:
+            if line and draw.textlength(line + char, font=font) > width:
+                lines.append(line)
+                line = ''
+            line += char
+    if line:
+        lines.append(line)
+    return lines or ['']
+
+
+class ReportCompositor:
+    """
+    Renders a report layout spec straight to a PIL image.
+
+    Layout items are measured for the width they are given, then drawn; crops are decoded once per
+    render. Supported item types: image, heading, group, boxes (the colored percentage batteries)
+    and comments.
+    """
+
+    def __init__(self, layout, boxes, comments, palette=DEFAULT_PALETTE, assets_dir=None):
+        self.layout = layout
+        self.boxes = boxes
+        self.comments = comments
+        self.box_colors = percentages_to_colors([box['percentage'] for box in boxes], palette)
+        self.assets_dir = Path(assets_dir or Path(BASE_DIR, "template"))
+        self._images = {}
+        self._frames = []
+        self._measure_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+    def _image(self, file):
+        if file not in self._images:
+            path = self.assets_dir / file
+            # Crops published by the capture stages are read in place for the length of the render
+            frame = frame_store.acquire(path)
+            if frame is not None:
+                self._frames.append(frame)
+                self._images[file] = frame.image()
+                return self._images[file]
+            try:
+                with Image.open(path) as img:
+                    self._images[file] = img.convert('RGBA')
+            except FileNotFoundError:
+                logger.warning(f"Report image not found, leaving its slot empty: {path}")
+                self._images[file] = None
+        return self._images[file]
+
+    # Measuring
+
+    def measure(self, item, width):
+        """Return the (width, height) the item occupies when given `width` pixels."""
+        kind = item["type"]
+        if kind == "image":
+            img = self._image(item["file"])
+            if img is None:
+                return 0, 0
+            target_width = width if item.get("fit", "width") == "width" else min(img.width, width)
+            return int(target_width), round(img.height * target_width / img.width)
+        if kind == "heading":
+            font = get_report_font("bold", item.get("size", 16))
+            left, top, right, bottom = font.getbbox(item["text"])
+            return min(width, int(right)), int(font.size * 1.2)
+        if kind == "group":
+            sizes = [self.measure(child, width) for child in item["items"]]
+            gap = item.get("gap", 0) * (len(sizes) - 1)
+            return max((w for w, _ in sizes), default=0), sum(h for _, h in sizes) + gap
+        if kind == "boxes":
+            grid_width, cell_height, rows = self._box_grid(item, width)
+            gap = item.get("gap", 20)
+            return grid_width, 2 * gap + rows * cell_height + (rows - 1) * gap
+        if kind == "comments":
+            box_width = min(width, item.get("max_width", width))
+            return box_width, self._comment_layout(item, box_width)[0]
+        raise ValueError(f"Unknown report layout item type: {kind}")
+
+    def _box_grid(self, item, width):
+        columns = item.get("columns", 2)
+        rows = max(1, math.ceil(len(self.boxes) / columns))
+        padding = item.get("padding", 20)
+        title_height = int(get_report_font("bold", item.get("size", 16)).size * 1.2)
+        cell_height = padding + title_height + 10 + 44 + padding
+        return min(width, item.get("max_width", width)), cell_height, rows
+
+    def _comment_layout(self, item, box_width):
+        size = item.get("size", 16)
+        padding = item.get("padding", 20)
+        line_height = round(size * item.get("line_height", 1.5))
+        font = get_report_font("regular", size)
+        title_font = get_report_font("regular", size)
+        inner_width = box_width - 2 * padding - 4
+        paragraphs = [_wrap_text(self._measure_draw, f"- {comment}", font, inner_width) for comment in self.comments]
+        body_height = sum(len(lines) * line_height for lines in paragraphs) + size * max(0, len(paragraphs) - 1)
+        height = 4 + 2 * padding + int(title_font.size * 1.2) + 10 + body_height
+        return height, paragraphs, line_height, font, title_font
+
+    # Drawing
+
+    def draw(self, canvas, item, x, y, width, height):
+        kind = item["type"]
+        if kind == "image":
+            img = self._image(item["file"])
+            if img is None:
+                return
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.Resampling.LANCZOS)
+            radius = item.get("radius", 10)
+            mask = Image.new('L', (width, height), 0)
+            ImageDraw.Draw(mask).rounded_rectangle((0, 0, width - 1, height - 1), radius, fill=255)
+            if item.get("shadow", True) and x >= 8 and y >= 8:
+                shadow = Image.new('RGBA', (width + 16, height + 16), (0, 0, 0, 0))
+                ImageDraw.Draw(shadow).rounded_rectangle((8, 12, width + 7, height + 11), radius, fill=(0, 0, 0, 26))
+                canvas.alpha_composite(shadow.filter(ImageFilter.GaussianBlur(4)), (x - 8, y - 8))
+            canvas.paste(img, (x, y), Image.composite(img.getchannel('A'), mask, mask))
+        elif kind == "heading":
+            font = get_report_font("bold", item.get("size", 16))
+            ImageDraw.Draw(canvas).text((x, y), item["text"], font=font, fill=item.get("color", REPORT_ACCENT_COLOR))
+        elif kind == "group":
+            for child in item["items"]:
+                child_width, child_height = self.measure(child, width)
+                self.draw(canvas, child, x, y, child_width, child_height)
+                y += child_height + item.get("gap", 0)
+        elif kind == "boxes":
+            self._draw_boxes(canvas, item, x, y, width)
+        elif kind == "comments":
+            self._draw_comments(canvas, item, x, y, width)
+
+    def _draw_boxes(self, canvas, item, x, y, width):
+        draw = ImageDraw.Draw(canvas)
+        columns = item.get("columns", 2)
+        gap = item.get("gap", 20)
+        padding = item.get("padding", 20)
+        font = get_report_font("bold", item.get("size", 16))
+        _, cell_height, _ = self._box_grid(item, width)
+        cell_width = (width - gap * (columns - 1)) / columns
+        y += gap
+
+        for index, (box, (color, text_color)) in enumerate(zip(self.boxes, self.box_colors)):
+            cell_x = x + (index % columns) * (cell_width + gap)
+            cell_y = y + (index // columns) * (cell_height + gap)
+            center = cell_x + cell_width / 2
+
+            title = str(box['title'])
+            draw.text((center, cell_y + padding), title, font=font, fill=REPORT_TEXT_COLOR, anchor='ma')
+
+            # Battery: 100x40 body with a 2px border, a nub on the right and the percentage beside it
+            percentage = max(0.0, min(100.0, float(box['percentage'])))
+            label = f"{box['percentage']}%"
+            label_width = draw.textlength(label, font=font)
+            row_width = 104 + 8 + 10 + label_width
+            left = round(center - row_width / 2)
+            top = round(cell_y + padding + font.size * 1.2 + 10)
+            fill_width = round(100 * percentage / 100)
+            if fill_width:
+                draw.rectangle((left + 2, top + 2, left + 1 + fill_width, top + 41), fill=color)
+            draw.rounded_rectangle((left, top, left + 103, top + 43), 5, outline='#000000', width=2)
+            draw.rounded_rectangle((left + 102, top + 12, left + 111, top + 31), 2, fill='#000000')
+            if item.get("label") == "inside":
+                draw.text((left + 52, top + 22), label, font=font, fill=text_color, anchor='mm')
+            else:
+                draw.text((left + 122, top + 22), label, font=font, fill=REPORT_TEXT_COLOR, anchor='lm')
+
+    def _draw_comments(self, canvas, item, x, y, width):
+        draw = ImageDraw.Draw(canvas)
+        height, paragraphs, line_height, font, title_font = self._comment_layout(item, width)
+        padding = item.get("padding", 20)
+        border = item.get("border", REPORT_ACCENT_COLOR)
+        draw.rounded_rectangle((x, y, x + width - 1, y + height - 1), 8, outline=border, width=2)
+
+        text_x = x + 2 + padding
+        text_y = y + 2 + padding
+        draw.text((text_x, text_y), item.get("title", "Comment").upper(), font=title_font, fill=border)
+        text_y += int(title_font.size * 1.2) + 10
+        for lines in paragraphs:
+            for line in lines:
+                draw.text((text_x, text_y + (line_height - font.size) // 2), line, font=font, fill=REPORT_TEXT_COLOR)
+                text_y += line_height
+            text_y += font.size  # Paragraph spacing
+
+    def _draw_background(self, canvas):
+        background = self.layout.get("background") or {}
+        logo = self._image(background["image"]) if background.get("image") else None
+        if logo is not None:
+            logo_width = round(canvas.width * background.get("image_width", 0.5))
+            logo = logo.resize((logo_width, round(logo.height * logo_width / logo.width)), Image.Resampling.LANCZOS)
+            canvas.alpha_composite(logo, ((canvas.width - logo.width) // 2, (canvas.height - logo.height) // 2))
+        if background.get("gradient"):
+            (r1, g1, b1, a1), (r2, g2, b2, a2) = background["gradient"]
+            # Build a 1px-wide vertical ramp and stretch it across the page
+            ramp = Image.new('RGBA', (1, canvas.height))
+            steps = max(1, canvas.height - 1)
+            ramp.putdata([
+                (r1 + (r2 - r1) * i // steps, g1 + (g2 - g1) * i // steps, b1 + (b2 - b1) * i // steps,
+                 a1 + (a2 - a1) * i // steps)
+                for i in range(canvas.height)
+            ])
+            canvas.alpha_composite(ramp.resize(canvas.size))
+
+    def render(self):
+        """Lay out every column, then draw background, columns and footer onto one RGB image."""
+        layout = self.layout
+        padding = layout.get("padding", 40)
+        gap = layout.get("gap", 20)
+        columns = layout["columns"]
+        content_width = layout["width"] - 2 * padding
+        column_width = (content_width - gap * (len(columns) - 1)) // len(columns)
+
+        try:
+            measured = []
+            for column in columns:
+                sizes = [self.measure(item, column_width) for item in column["items"]]
+                measured.append(sizes)
+            row_height = max(sum(h for _, h in sizes) + gap * (len(sizes) - 1) for sizes in measured)
+            height = max(layout.get("min_height", 0), row_height + 2 * padding)
+
+            canvas = Image.new('RGBA', (layout["width"], height), (255, 255, 255, 255))
+            self._draw_background(canvas)
+            self._draw_columns(canvas, columns, measured, column_width, row_height)
+            footer = layout.get("footer")
+            if footer:
+                self._draw_footer(canvas, footer)
+            return canvas.convert('RGB')
+        finally:
+            # Views of shared frames must not outlive the references held for this render
+            self._images.clear()
+            for frame in self._frames:
+                frame.release()
+            self._frames.clear()
+
+    def _draw_columns(self, canvas, columns, measured, column_width, row_height):
+        padding = self.layout.get("padding", 40)
+        gap = self.layout.get("gap", 20)
+
+        for index, (column, sizes) in enumerate(zip(columns, measured)):
+            column_x = padding + index * (column_width + gap)
+            used = sum(h for _, h in sizes)
+            spacing = gap
+            y = padding
+            if column.get("justify") == "end":
+                y = padding + row_height - used - gap * (len(sizes) - 1)
+            elif column.get("justify") == "space-between" and len(sizes) > 1:
+                spacing = (row_height - used) / (len(sizes) - 1)
+            for item, (item_width, item_height) in zip(column["items"], sizes):
+                item_x = column_x
+                if column.get("align") == "center":
+                    item_x = column_x + (column_width - item_width) // 2
+                elif column.get("align") == "end":
+                    item_x = column_x + column_width - item_width
+                self.draw(canvas, item, round(item_x), round(y), item_width, item_height)
+                y += item_height + spacing
+
+    def _draw_footer(self, canvas, footer):
+        margin = footer.get("margin", 20)
+        right = canvas.width - margin
+        bottom = canvas.height - margin
+        if footer.get("timestamp"):
+            font = get_report_font("regular", 14)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ImageDraw.Draw(canvas).text((right, bottom), timestamp, font=font, fill=REPORT_TEXT_COLOR, anchor='rd')
+            bottom -= int(font.size * 1.2) + 10
+        logo = self._image(footer["logo"]) if footer.get("logo") else None
+        if logo is not None:
+            logo_width = footer.get("logo_width", logo.width)
+            logo = logo.resize((logo_width, round(logo.height * logo_width / logo.width)), Image.Resampling.LANCZOS)
+            canvas.alpha_composite(logo, (right - logo.width, bottom - logo.height))
+
+
+def compose_report(output_path, boxes, comments, palette=DEFAULT_PALETTE, layout=None, email_variants=('email',),
+                   assets_dir=None):
+    """
+    Render the report with ReportCompositor and write the full-size PNG plus the email-size variants
+    from the same decoded canvas, so sending later hits the image cache instead of decoding the PNG.
+    Crops and logos are read from assets_dir, by default the template directory.
+    Returns a dictionary of output name ('full' or a variant name) to path.
+    """
+    start = time.perf_counter()
+    canvas = ReportCompositor(layout or REPORT_LAYOUT, boxes, comments, palette, assets_dir).render()
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    canvas.save(tmp_path, format='PNG')
+    os.replace(tmp_path, output_path)
+    frame_store.publish(output_path, canvas).release()
+
+    outputs = {"full": output_path}
+    for name in email_variants:
+        outputs[name] = get_image_variant(output_path, EMAIL_IMAGE_VARIANTS[name],
+                                          max_bytes=EMAIL_IMAGE_MAX_BYTES, source_image=canvas)
+    logger.info(f"Composed report {canvas.size} in {(time.perf_counter() - start) * 1000:.0f} ms: {outputs}")
+    return outputs
+
+
+# Forecast widgets drawn from data. The html/*.html pages embed Tomorrow.io widgets that used to be
+# loaded in a full browser just to be screenshotted; a WidgetSpec names the panel and locations, a
+# ForecastProvider supplies the data and WidgetRenderer draws the panel with PIL.
+WIDGET_TYPES = ('summary', 'current6', 'upcoming')
+WIDGET_TYPE_ALIASES = {'multi-location': 'current6', 'upcoming-days': 'upcoming'}
+WIDGET_RENDERERS = ('auto', 'browser', 'native')
+WIDGET_UNITS = ('imperial', 'metric')
+WIDGET_UNIT_LABELS = {'imperial': ('°F', 'mph'), 'metric': ('°C', 'm/s')}
+WIDGET_MUTED_COLOR = '#6b7280'
+WIDGET_CARD_COLOR = '#f5f7fa'
+WIDGET_BORDER_COLOR = '#e3e8ef'
+WIDGET_PRECIPITATION_COLOR = '#2563eb'
+FORECAST_DAYS = 6
+FORECAST_CACHE_TTL = 10 * 60  # Seconds a location's forecast is reused across widgets and runs
+FIXTURE_FORECAST_DIR = Path(BASE_DIR, 'fixtures', 'forecast')
+# The numeric location IDs of the html/*.html embeds belong to the widget service; this maps them to
+# {"name", "location"} entries whose 'location' ('lat,lon' or a place name) the forecast API can look up
+WIDGET_LOCATIONS_PATH = Path(BASE_DIR, 'html', 'widget-locations.json')
+TOMORROW_FORECAST_URL = 'https://api.tomorrow.io/v4/weather/forecast'
+
+# Tomorrow.io weather codes: label and the icon drawn for them
+WEATHER_CODES = {
+    1000: ('Clear', 'clear'), 1100: ('Mostly Clear', 'partly'), 1101: ('Partly Cloudy', 'partly'),
+    1102: ('Mostly Cloudy', 'cloudy'), 1001: ('Cloudy', 'cloudy'), 2000: ('Fog', 'fog'), 2100: ('Light Fog', 'fog'),
+    4000: ('Drizzle', 'rain'), 4001: ('Rain', 'rain'), 4200: ('Light Rain', 'rain'), 4201: ('Heavy Rain', 'rain'),
+    5000: ('Snow', 'snow'), 5001: ('Flurries', 'snow'), 5100: ('Light Snow', 'snow'), 5101: ('Heavy Snow', 'snow'),
+    6000: ('Freezing Drizzle', 'ice'), 6001: ('Freezing Rain', 'ice'), 6200: ('Light Freezing Rain', 'ice'),
+    6201: ('Heavy Freezing Rain', 'ice'), 7000: ('Ice Pellets', 'ice'), 7101: ('Heavy Ice Pellets', 'ice'),
+    7102: ('Light Ice Pellets', 'ice'), 8000: ('Thunderstorm', 'storm'),
+}
+
+# The Tomorrow.io embed as it appears in html/*.html
+_WIDGET_EMBED_PATTERN = re.compile(r'<div\s+class="tomorrow"([^>]*)>', re.IGNORECASE)
+_WIDGET_ATTRIBUTE_PATTERN = re.compile(r'data-([a-z-]+)="([^"]*)"', re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class WidgetSpec:
+    """A forecast panel to draw: its type, the location IDs it shows and the unit system."""
+    type: str
+    locations: tuple
+    units: str = 'imperial'
+
+
+def compile_widget(widget):
+    """
+    Validate a 'widget' site setting such as {"type": "summary", "locations": ["112589"], "units": "imperial"}.
+    Raises SiteConfigError.
+    """
+    if not isinstance(widget, dict):
+        raise SiteConfigError("'widget' must be an object.")
+    widget_type = WIDGET_TYPE_ALIASES.get(widget.get("type"), widget.get("type"))
+    if widget_type not in WIDGET_TYPES:
+        raise SiteConfigError(f"Invalid widget 'type'. Must be one of: {', '.join(WIDGET_TYPES)}.")
+    locations = widget.get("locations")
+    if isinstance(locations, str):
+        locations = [location.strip() for location in locations.split(',') if location.strip()]
+    if not isinstance(locations, list) or not locations or not all(isinstance(loc, str) and loc for loc in locations):
+        raise SiteConfigError("Widget 'locations' must be a non-empty list of location IDs.")
+    if widget_type != 'current6' and len(locations) != 1:
+        raise SiteConfigError(f"A '{widget_type}' widget shows exactly one location.")
+    units = str(widget.get("units", "imperial")).lower()
+    if units not in WIDGET_UNITS:
+        raise SiteConfigError(f"Invalid widget 'units'. Must be one of: {', '.join(WIDGET_UNITS)}.")
+    return WidgetSpec(widget_type, tuple(locations), units)
+
+
+def parse_widget_embed(html_path):
+    """Read the widget settings from a page embedding a Tomorrow.io widget. Returns a WidgetSpec or None."""
+    try:
+        match = _WIDGET_EMBED_PATTERN.search(Path(html_path).read_text(encoding='utf-8'))
+    except (OSError, UnicodeDecodeError):
+        return None
+    if match is None:
+        return None
+    attributes = {name.lower(): value for name, value in _WIDGET_ATTRIBUTE_PATTERN.findall(match.group(1))}
+    try:
+        return compile_widget({
+            "type": attributes.get("widget-type"),
+            "locations": attributes.get("location-id", ""),
+            "units": attributes.get("unit-system", "imperial"),
+        })
+    except SiteConfigError as e:
+        logger.warning(f"Unsupported widget embed in {html_path}: {e}")
+        return None
+
+
+class ForecastProvider(abc.ABC):
+    """
+    Source of forecast data for widgets.
+
+    Subclasses implement fetch_location, returning one location as
+    {'id', 'name', 'current': {'temperature', 'feels_like', 'humidity', 'wind_speed', 'code'},
+     'daily': [{'date', 'high', 'low', 'code', 'precipitation'}, ...]}.
+    forecast() fetches the locations it has not seen within FORECAST_CACHE_TTL concurrently.
+    """
+
+    attribution = None
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def fetch_location(self, location_id, units):
+        """Return the forecast of one location, raising if it cannot be had."""
+
+    def accepts(self, location_id):
+        """Return False for location IDs this provider cannot look up, so their widgets stay in the browser."""
+        return True
+
+    def forecast(self, location_ids, units):
+        now = time.monotonic()
+        cached = {}
+        with self._lock:
+            for location_id in location_ids:
+                entry = self._cache.get((location_id, units))
+                if entry is not None and now - entry[0] < FORECAST_CACHE_TTL:
+                    cached[location_id] = entry[1]
+        missing = [location_id for location_id in dict.fromkeys(location_ids) if location_id not in cached]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(len(missing), 6)) as executor:
+                fetched = dict(zip(missing, executor.map(lambda loc: self.fetch_location(loc, units), missing)))
+            with self._lock:
+                for location_id, forecast in fetched.items():
+                    self._cache[(location_id, units)] = (now, forecast)
+            cached.update(fetched)
+        return [cached[location_id] for location_id in location_ids]
+
+
+class FixtureForecastProvider(ForecastProvider):
+    """
+    Offline provider for tests and demos. Reads <location_id>.json from the fixture directory;
+    a location without a fixture file is an error, so no made-up weather reaches a report.
+    """
+
+    def __init__(self, root=FIXTURE_FORECAST_DIR):
+        super().__init__()
+        self.root = Path(root)
+
+    def accepts(self, location_id):
+        return (self.root / f"{location_id}.json").is_file()
+
+    def fetch_location(self, location_id, units):
+        path = self.root / f"{location_id}.json"
+        if not path.is_file():
+            raise FileNotFoundError(f"No forecast fixture for location {location_id} at {path}.")
+        return json.loads(path.read_text(encoding='utf-8'))
+
+
+class TomorrowForecastProvider(ForecastProvider):
+    """
+    Fetches forecasts from the Tomorrow.io API. Widget location IDs are looked up in the widget locations
+    mapping (see WIDGET_LOCATIONS_PATH); other locations ('lat,lon' or a place name) are passed through
+    as the API's 'location'. Numeric IDs missing from the mapping are not accepted, since the API does
+    not know the widget service's IDs.
+    """
+
+    attribution = "Powered by Tomorrow.io"
+
+    def __init__(self, api_key, locations=None):
+        super().__init__()
+        self.api_key = api_key
+        self.locations = load_widget_locations() if locations is None else locations
+
+    def accepts(self, location_id):
+        return location_id in self.locations or not location_id.isdigit()
+
+    def fetch_location(self, location_id, units):
+        mapped = self.locations.get(location_id, {})
+        response = requests.get(TOMORROW_FORECAST_URL, params={
+            "location": mapped.get("location", location_id), "units": units, "timesteps": "1h,1d",
+            "apikey": self.api_key,
+        }, timeout=15)
+        response.raise_for_status()
+        body = response.json()
+        current = body["timelines"]["hourly"][0]["values"]
+        name = mapped.get("name") or (body.get("location") or {}).get("name") or location_id
+        return {
+            "id": location_id,
+            "name": ', '.join(name.split(', ')[:2]),
+            "current": {
+                "temperature": current.get("temperature"),
+                "feels_like": current.get("temperatureApparent"),
+                "humidity": current.get("humidity"),
+                "wind_speed": current.get("windSpeed"),
+                "code": current.get("weatherCode"),
+            },
+            "daily": [{
+                "date": day["time"][:10],
+                "high": day["values"].get("temperatureMax"),
+                "low": day["values"].get("temperatureMin"),
+                "code": day["values"].get("weatherCodeMax"),
+                "precipitation": day["values"].get("precipitationProbabilityMax"),
+            } for day in body["timelines"]["daily"][:FORECAST_DAYS]],
+        }
+
+
+def load_widget_locations(path=WIDGET_LOCATIONS_PATH):
+    """Return the widget location ID -> {'name', 'location'} mapping, or {} when the file is missing or invalid."""
+    try:
+        locations = json.loads(Path(path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read the widget locations in {path}: {e}")
+        return {}
+    if not isinstance(locations, dict):
+        logger.warning(f"Ignoring the widget locations in {path}: expected an object.")
+        return {}
+    return {str(location_id): entry for location_id, entry in locations.items()
+            if isinstance(entry, dict) and isinstance(entry.get("location"), str)}
+
+
+_forecast_provider = None
+_forecast_provider_lock = threading.Lock()
+
+
+def get_forecast_provider():
+    """
+    Return the configured forecast provider, or None when there is none.
+    WINGSTAR_FORECAST_PROVIDER selects 'fixture' or 'tomorrow'; Tomorrow.io is used by default
+    whenever TOMORROW_API_KEY is set.
+    """
+    global _forecast_provider
+    with _forecast_provider_lock:
+        if _forecast_provider is None:
+            api_key = os.environ.get('TOMORROW_API_KEY')
+            name = os.environ.get('WINGSTAR_FORECAST_PROVIDER', 'tomorrow' if api_key else '')
+            if name == 'fixture':
+                _forecast_provider = FixtureForecastProvider()
+            elif name == 'tomorrow' and api_key:
+                _forecast_provider = TomorrowForecastProvider(api_key)
+            elif name:
+                logger.warning(f"Forecast provider '{name}' is unknown or not configured; widgets use the browser.")
+        return _forecast_provider
+
+
+def _fit_text(draw, text, font, width):
+    """Shorten text with an ellipsis until it fits the width."""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _format_reading(value, suffix='', digits=0):
+    if value is None:
+        return '–'
+    return f"{value:.{digits}f}{suffix}"
+
+
+class WidgetRenderer:
+    """
+    Draws forecast panels.
+
+    Everything in a panel that does not depend on the data (card, cell backgrounds, dividers, labels
+    and attribution) is drawn once per panel type, width and location count into a cached base image
+    together with the positions of the data slots; a render copies the base and fills in the slots.
+    Weather icons are drawn once per kind and size.
+    """
+
+    def __init__(self):
+        self._layouts = {}
+        self._icons = {}
+        self._lock = threading.Lock()
+
+    # Icons
+
+    def icon(self, kind, size):
+        key = (kind, size)
+        icon = self._icons.get(key)
+        if icon is None:
+            icon = self._draw_icon(kind, size)
+            with self._lock:
+                self._icons[key] = icon
+        return icon
+
+    @staticmethod
+    def _draw_icon(kind, size):
+        # Drawn at 4x and scaled down for smooth edges
+        scale = 4
+        s = size * scale
+        image = Image.new('RGBA', (s, s), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        sun = '#f5b301'
+        cloud = '#9aa5b1' if kind in ('rain', 'storm', 'ice') else '#c3cbd5'
+
+        if kind in ('clear', 'partly'):
+            center, radius = (s * 0.5, s * 0.5) if kind == 'clear' else (s * 0.38, s * 0.38), s * 0.18
+            for step in range(8):
+                angle = step * math.pi / 4
+                inner, outer = radius * 1.35, radius * 1.75
+                draw.line((center[0] + inner * math.cos(angle), center[1] + inner * math.sin(angle),
+                           center[0] + outer * math.cos(angle), center[1] + outer * math.sin(angle)),
+                          fill=sun, width=max(1, s // 24))
+            draw.ellipse((center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius), fill=sun)
+        if kind != 'clear':
+            top = s * (0.42 if kind == 'partly' else 0.28)
+            draw.ellipse((s * 0.12, top + s * 0.12, s * 0.48, top + s * 0.40), fill=cloud)
+            draw.ellipse((s * 0.30, top, s * 0.72, top + s * 0.38), fill=cloud)
+            draw.ellipse((s * 0.55, top + s * 0.12, s * 0.88, top + s * 0.40), fill=cloud)
+            draw.rectangle((s * 0.30, top + s * 0.22, s * 0.72, top + s * 0.40), fill=cloud)
+            below = top + s * 0.46
+            if kind == 'rain':
+                for x in (0.30, 0.50, 0.70):
+                    draw.line((s * x, below, s * (x - 0.06), below + s * 0.16), fill=WIDGET_PRECIPITATION_COLOR,
+                              width=max(1, s // 28))
+            elif kind == 'snow':
+                for x in (0.30, 0.50, 0.70):
+                    r = s * 0.035
+                    draw.ellipse((s * x - r, below + s * 0.06 - r, s * x + r, below + s * 0.06 + r), fill='#7fb3e6')
+            elif kind == 'ice':
+                for x in (0.30, 0.50, 0.70):
+                    cx, cy, r = s * x, below + s * 0.08, s * 0.045
+                    draw.polygon(((cx, cy - r), (cx + r, cy), (cx, cy + r), (cx - r, cy)), fill='#5fa8d3')
+            elif kind == 'storm':
+                draw.polygon(((s * 0.52, below - s * 0.04), (s * 0.38, below + s * 0.14), (s * 0.50, below + s * 0.14),
+                              (s * 0.42, below + s * 0.30), (s * 0.64, below + s * 0.08), (s * 0.52, below + s * 0.08)),
+                             fill=sun)
+            elif kind == 'fog':
+                for offset in (0.0, 0.09, 0.18):
+                    draw.line((s * 0.18, below + s * offset, s * 0.82, below + s * offset), fill='#aab4bf',
+                              width=max(1, s // 28))
+        return image.resize((size, size), Image.Resampling.LANCZOS)
+
+    # Layouts
+
+    def layout(self, widget_type, width, count, attribution=None):
+        """Return the cached (base image, slots) for a panel, building it on first use."""
+        key = (widget_type, width, count, attribution)
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = getattr(self, f"_layout_{widget_type}")(width, count)
+            base, slots = layout
+            if attribution:
+                ImageDraw.Draw(base).text((width // 2, base.height - 6), attribution,
+                                          font=get_report_font("regular", 11), fill=WIDGET_MUTED_COLOR, anchor='md')
+            with self._lock:
+                self._layouts[key] = layout
+        return layout
+
+    @staticmethod
+    def _card(width, height):
+        base = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+        ImageDraw.Draw(base).rounded_rectangle((0, 0, width - 1, height - 23), 12, fill='#ffffff',
+                                               outline=WIDGET_BORDER_COLOR, width=1)
+        return base
+
+    def _layout_summary(self, width, count):
+        base = self._card(width, 300)
+        draw = ImageDraw.Draw(base)
+        draw.line((24, 206, width - 24, 206), fill=WIDGET_BORDER_COLOR, width=1)
+        column_width = (width - 48) / 4
+        details = []
+        for index, label in enumerate(("Feels like", "Humidity", "Wind", "High / Low")):
+            x = round(24 + index * column_width)
+            draw.text((x, 220), label, font=get_report_font("regular", 13), fill=WIDGET_MUTED_COLOR)
+            details.append((x, 240, round(column_width) - 8))
+        return base, {"name": (24, 20, width - 48), "date": (24, 54), "icon": (24, 82, 110),
+                      "temperature": (152, 84), "condition": (152, 162, width - 176), "details": details}
+
+    def _layout_current6(self, width, count):
+        columns = min(3, count)
+        rows = math.ceil(count / columns)
+        cell_width = (width - 48 - 12 * (columns - 1)) // columns
+        cell_height = 150
+        base = self._card(width, 48 + rows * cell_height + (rows - 1) * 12 + 22)
+        draw = ImageDraw.Draw(base)
+        cells = []
+        for index in range(count):
+            x = 24 + (index % columns) * (cell_width + 12)
+            y = 24 + (index // columns) * (cell_height + 12)
+            draw.rounded_rectangle((x, y, x + cell_width - 1, y + cell_height - 1), 10, fill=WIDGET_CARD_COLOR)
+            cells.append({"name": (x + 12, y + 12, cell_width - 24), "icon": (x + 12, y + 44, 60),
+                          "temperature": (x + 84, y + 50), "condition": (x + 12, y + 118, cell_width - 24)})
+        return base, {"cells": cells}
+
+    def _layout_upcoming(self, width, count):
+        base = self._card(width, 300)
+        draw = ImageDraw.Draw(base)
+        column_width = (width - 48) / FORECAST_DAYS
+        days = []
+        for index in range(FORECAST_DAYS):
+            x = 24 + index * column_width
+            if index:
+                draw.line((round(x), 72, round(x), 262), fill=WIDGET_BORDER_COLOR, width=1)
+            center = round(x + column_width / 2)
+            days.append({"day": (center, 84), "icon": (center - 28, 112, 56), "high": (center, 178),
+                         "low": (center, 206), "precipitation": (center, 234)})
+        return base, {"name": (24, 20, width - 48), "days": days}
+
+    # Rendering
+
+    def render(self, spec, forecasts, width, attribution=None):
+        """Draw the panel for spec with one forecast per location. Returns an RGBA image."""
+        base, slots = self.layout(spec.type, width, len(forecasts), attribution)
+        image = base.copy()
+        draw = ImageDraw.Draw(image)
+        temperature_unit, wind_unit = WIDGET_UNIT_LABELS[spec.units]
+        getattr(self, f"_render_{spec.type}")(image, draw, slots, forecasts, temperature_unit, wind_unit)
+        return image
+
+    def _paste_icon(self, image, code, slot):
+        x, y, size = slot
+        icon = self.icon(WEATHER_CODES.get(code, ('', 'cloudy'))[1], size)
+        image.alpha_composite(icon, (x, y))
+
+    def _render_summary(self, image, draw, slots, forecasts, temperature_unit, wind_unit):
+        forecast = forecasts[0]
+        current = forecast["current"]
+        today = (forecast.get("daily") or [{}])[0]
+        x, y, width = slots["name"]
+        font = get_report_font("bold", 24)
+        draw.text((x, y), _fit_text(draw, forecast["name"], font, width), font=font, fill=REPORT_TEXT_COLOR)
+        draw.text(slots["date"], datetime.now().strftime("%A, %B %d"), font=get_report_font("regular", 14),
+                  fill=WIDGET_MUTED_COLOR)
+        self._paste_icon(image, current.get("code"), slots["icon"])
+        draw.text(slots["temperature"], _format_reading(current.get("temperature"), '°'),
+                  font=get_report_font("bold", 64), fill=REPORT_TEXT_COLOR)
+        x, y, width = slots["condition"]
+        font = get_report_font("regular", 20)
+        condition = WEATHER_CODES.get(current.get("code"), ('Unknown', ''))[0]
+        draw.text((x, y), _fit_text(draw, condition, font, width), font=font, fill=REPORT_TEXT_COLOR)
+
+        values = (
+            _format_reading(current.get("feels_like"), temperature_unit),
+            _format_reading(current.get("humidity"), '%'),
+            _format_reading(current.get("wind_speed"), f" {wind_unit}"),
+            f"{_format_reading(today.get('high'), '°')} / {_format_reading(today.get('low'), '°')}",
+        )
+        font = get_report_font("bold", 18)
+        for (x, y, width), value in zip(slots["details"], values):
+            draw.text((x, y), _fit_text(draw, value, font, width), font=font, fill=REPORT_TEXT_COLOR)
+
+    def _render_current6(self, image, draw, slots, forecasts, temperature_unit, wind_unit):
+        name_font = get_report_font("bold", 16)
+        condition_font = get_report_font("regular", 14)
+        for cell, forecast in zip(slots["cells"], forecasts):
+            current = forecast["current"]
+            x, y, width = cell["name"]
+            draw.text((x, y), _fit_text(draw, forecast["name"], name_font, width), font=name_font,
+                      fill=REPORT_TEXT_COLOR)
+            self._paste_icon(image, current.get("code"), cell["icon"])
+            draw.text(cell["temperature"], _format_reading(current.get("temperature"), temperature_unit),
+                      font=get_report_font("bold", 34), fill=REPORT_TEXT_COLOR)
+            x, y, width = cell["condition"]
+            condition = WEATHER_CODES.get(current.get("code"), ('Unknown', ''))[0]
+            draw.text((x, y), _fit_text(draw, condition, condition_font, width), font=condition_font,
+                      fill=WIDGET_MUTED_COLOR)
+
+    def _render_upcoming(self, image, draw, slots, forecasts, temperature_unit, wind_unit):
+        forecast = forecasts[0]
+        x, y, width = slots["name"]
+        font = get_report_font("bold", 22)
+        draw.text((x, y), _fit_text(draw, forecast["name"], font, width), font=font, fill=REPORT_TEXT_COLOR)
+        for index, (slot, day) in enumerate(zip(slots["days"], forecast.get("daily", []))):
+            label = "Today" if index == 0 else date.fromisoformat(day["date"]).strftime("%a")
+            draw.text(slot["day"], label, font=get_report_font("bold", 16), fill=REPORT_TEXT_COLOR, anchor='ma')
+            self._paste_icon(image, day.get("code"), slot["icon"])
+            draw.text(slot["high"], _format_reading(day.get("high"), '°'), font=get_report_font("bold", 20),
+                      fill=REPORT_TEXT_COLOR, anchor='ma')
+            draw.text(slot["low"], _format_reading(day.get("low"), '°'), font=get_report_font("regular", 16),
+                      fill=WIDGET_MUTED_COLOR, anchor='ma')
+            draw.text(slot["precipitation"], _format_reading(day.get("precipitation"), '%'),
+                      font=get_report_font("regular", 13), fill=WIDGET_PRECIPITATION_COLOR, anchor='ma')
+
+
+widget_renderer = WidgetRenderer()
+
+
+def render_widget(spec, width, provider=None):
+    """Fetch the forecasts for spec and draw its panel. Returns an RGB image."""
+    provider = provider or get_forecast_provider()
+    if provider is None:
+        raise RuntimeError("No forecast provider is configured.")
+    forecasts = provider.forecast(spec.locations, spec.units)
+    panel = widget_renderer.render(spec, forecasts, width, provider.attribution)
+    image = Image.new('RGB', panel.size, (255, 255, 255))
+    image.paste(panel, (0, 0), panel)
+    return image
+
+
+# Pages taller than this (CSS px) are captured in tiles of this height and stitched in memory
+FULL_PAGE_TILE_HEIGHT = 4096
+
+# Per-thread scratch buffers that screenshot data is decoded into, reused across captures
+_capture_buffers = threading.local()
+
+
+def decode_base64_into(encoded, buffer, chunk_size=64 * 1024):
+    """
+    Decode base64 text into a reusable bytearray in bounded chunks.
+    Returns a memoryview over the decoded bytes; release it (or use it as a context manager)
+    before decoding into the same buffer again.
+    """
+    needed = len(encoded) * 3 // 4
+    if len(buffer) < needed:
+        buffer.extend(bytes(needed - len(buffer)))
+    view = memoryview(buffer)
+    offset = 0
+    for start in range(0, len(encoded), chunk_size):  # chunk_size is a multiple of 4
+        decoded = binascii.a2b_base64(encoded[start:start + chunk_size])
+        view[offset:offset + len(decoded)] = decoded
+        offset += len(decoded)
+    decoded_view = view[:offset]
+    view.release()
+    return decoded_view
+
+
+def _get_capture_buffer():
+    buffer = getattr(_capture_buffers, 'data', None)
+    if buffer is None:
+        buffer = _capture_buffers.data = bytearray()
+    return buffer
+
+
+def _capture_clip(driver, x, y, width, height):
+    """Capture a region of the page in CSS pixels without resizing the viewport."""
+    return driver.execute_cdp_cmd('Page.captureScreenshot', {
+        'format': 'png',
+        'fromSurface': True,
+        'captureBeyondViewport': True,
+        'clip': {'x': x, 'y': y, 'width': width, 'height': height, 'scale': 1},
+    })['data']
+
+
+def capture_full_page(driver, output_path, tile_height=FULL_PAGE_TILE_HEIGHT):
     """
     Capture a full-page screenshot using Chrome DevTools Protocol (CDP).
+
+    The page size comes from Page.getLayoutMetrics and is captured through a clip rectangle
+    with captureBeyondViewport, so the viewport is never resized and the page is not relaid out.
+    Pages taller than tile_height are captured in tiles and stitched in memory, which keeps
+    the size of each base64 payload bounded.
     """
     try:
         # Log output_path
         log_path("capture_full_page output_path", output_path)
 
         # Get the total width and height of the page
-        total_width = driver.execute_script("return document.body.scrollWidth")
-        total_height = driver.execute_script("return document.body.scrollHeight")
+        metrics = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+        content_size = metrics.get('cssContentSize') or metrics['contentSize']
+        total_width = math.ceil(content_size['width'])
+        total_height = math.ceil(content_size['height'])
         logger.debug(f"Full page dimensions: width={total_width}, height={total_height}")
 
-        # Set device metrics to the full page dimensions
-        driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', {
-            "mobile": False,
-            "width": total_width,
-            "height": total_height,
-            "deviceScaleFactor": 1,
-            "screenOrientation": {"angle": 0, "type": "portraitPrimary"}
-        })
-        logger.debug("Device metrics overridden for full-page screenshot.")
+        # Ensure the directory exists
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        buffer = _get_capture_buffer()
+
+        if total_height <= tile_height:
+            # Decode the base64 screenshot data and save it to a file
+            with decode_base64_into(_capture_clip(driver, 0, 0, total_width, total_height), buffer) as data:
+                with open(output_path, "wb") as file:
+                    file.write(data)
+        else:
+            canvas = None
+            for top in range(0, total_height, tile_height):
+                height = min(tile_height, total_height - top)
+                with decode_base64_into(_capture_clip(driver, 0, top, total_width, height), buffer) as data:
+                    with Image.open(BytesIO(data)) as tile:
+                        if canvas is None:
+                            # Tiles come back in device pixels; size the canvas accordingly
+                            scale = tile.width / total_width
+                            canvas = Image.new('RGBA', (tile.width, math.ceil(total_height * scale)))
+                        canvas.paste(tile, (0, round(top * scale)))
+                logger.debug(f"Captured tile at y={top} (height={height}).")
+            canvas.save(output_path)
+            frame_store.publish(output_path, canvas).release()
+        logger.info(f"Full page screenshot saved to: {output_path}")
+    except Exception as e:
+        logger.exception("Error capturing full page screenshot.")
 
-        # Capture the screenshot
-        result = driver.execute_cdp_cmd('Page.captureScreenshot', {
-            'fromSurface': True,
-            'captureBeyondViewport': True
+
+def capture_pdf(driver, output_path):
+    """
+    Render the current page to a single-page PDF sized to the full document using
+    Chrome DevTools Protocol (CDP) Page.printToPDF. Text stays vector and selectable.
+    """
+    try:
+        log_path("capture_pdf output_path", output_path)
+
+        # Size the paper to the document so the whole report fits on one page (96 CSS px per inch)
+        total_width = driver.execute_script("return document.documentElement.scrollWidth")
+        total_height = driver.execute_script("return document.documentElement.scrollHeight")
+        logger.debug(f"PDF page dimensions: width={total_width}, height={total_height}")
+
+        result = driver.execute_cdp_cmd('Page.printToPDF', {
+            'printBackground': True,
+            'paperWidth': total_width / 96,
+            'paperHeight': total_height / 96,
+            'marginTop': 0,
+            'marginBottom': 0,
+            'marginLeft': 0,
+            'marginRight': 0,
+            'pageRanges': '1',
         })
 
-        # Ensure the directory exists
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-
-        # Decode the base64 screenshot data and save it to a file
         with open(output_path, "wb") as file:
             file.write(base64.b64decode(result['data']))
-        logger.info(f"Full page screenshot saved to: {output_path}")
+        logger.info(f"PDF saved to: {output_path}")
+        return True
     except Exception as e:
-        logger.exception("Error capturing full page screenshot.")
-    finally:
-        # Clear the device metrics override to reset the browser back to its original state
-        try:
-            driver.execute_cdp_cmd('Emulation.clearDeviceMetricsOverride', {})
-            logger.debug("Device metrics override cleared.")
-        except Exception as e:
-            logger.exception("Error clearing device metrics override.")
+        logger.exception("Error rendering page to PDF.")
+        return False
+
 
+def export_html(driver, output_path):
+    """
+    Save the current page's DOM as a self-contained HTML file, inlining local images as data URIs.
+    """
+    try:
+        log_path("export_html output_path", output_path)
+        page_html = driver.execute_script("return document.documentElement.outerHTML")
+        write_self_contained_html(page_html, driver.current_url, output_path)
+        return True
+    except Exception as e:
+        logger.exception("Error exporting page HTML.")
+        return False
+
+
+def write_self_contained_html(page_html, base_url, output_path):
+    """
+    Write a page's serialized DOM to output_path, inlining images under file: URLs as data URIs.
+    Shared by the browser engines' HTML exports.
+    """
+    def inline_image(match):
+        src = match.group(2)
+        if src.startswith('data:'):
+            return match.group(0)
+        source_path = None
+        if base_url.startswith('file:'):
+            resolved = urlparse(urljoin(base_url, src))
+            if resolved.scheme == 'file':
+                source_path = Path(unquote(resolved.path.lstrip('/') if os.name == 'nt' else resolved.path))
+        if source_path is None or not source_path.is_file():
+            return match.group(0)
+        mime = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp', '.gif': 'gif', '.svg': 'svg+xml'}.get(
+            source_path.suffix.lower(), 'png')
+        encoded = base64.b64encode(source_path.read_bytes()).decode('ascii')
+        return f'{match.group(1)}data:image/{mime};base64,{encoded}{match.group(3)}'
+
+    page_html = re.sub(r'(<img\b[^>]*?\bsrc=["\'])([^"\']+)(["\'])', inline_image, page_html)
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        file.write('<!DOCTYPE html>\n' + page_html)
+    logger.info(f"HTML export saved to: {output_path}")
+
+
+# Output formats a site entry may request through 'output_format'
+SITE_OUTPUT_FORMATS = ('png', 'pdf', 'html')
+
+
+def get_site_output_formats(site):
+    """
+    Return the output formats requested by a site entry; a string or a list, defaulting to PNG.
+    """
+    formats = site.get("output_format", "png")
+    if isinstance(formats, str):
+        formats = [formats]
+    return [output_format.lower() for output_format in formats]
 
-def capture_table(driver, table_selector, table_screenshot_file, timer, rows_to_capture=3):
+
+def capture_table(driver, table_selector, table_screenshot_file, timer, rows_to_capture=3, output_path=None):
     """
     Capture a screenshot of the table headers and the first N rows of the table.
+    The crop is saved to output_path, by default template/cropped_{table_screenshot_file}.
     """
     try:
         # Log table_selector and table_screenshot_file
@@ -465,479 +2170,5050 @@ def capture_table(driver, table_selector, table_screenshot_file, timer, rows_to_
         logger.debug(f"Image cropped with box: {crop_box}")
 
         # Save the cropped image
-        cropped_screenshot_path = Path(BASE_DIR, "template", f"cropped_{table_screenshot_file}")
+        cropped_screenshot_path = output_path or Path(BASE_DIR, "template", f"cropped_{table_screenshot_file}")
         log_path("cropped_screenshot_path", cropped_screenshot_path)
         cropped_screenshot_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
         cropped_img.save(cropped_screenshot_path)
+        frame_store.publish(cropped_screenshot_path, cropped_img).release()
         logger.info(f"Table screenshot cropped and saved to: {cropped_screenshot_path}")
 
     except Exception as e:
         logger.exception("An error occurred while capturing the table.")
 
 
-def capture_element_or_table(site, timer):
+# Offline snapshots of scraped sites
+SNAPSHOT_DIR = Path(BASE_DIR, 'snapshots')
+SNAPSHOT_CONCURRENCY = 8
+SNAPSHOT_FETCH_TIMEOUT = 20  # Seconds per fetched URL
+SNAPSHOT_MAX_ASSETS = 200
+SNAPSHOT_MAX_AGE = 15 * 60  # Seconds before a 'warm' snapshot is refetched
+SNAPSHOT_MODES = ('off', 'warm', 'replay')
+SNAPSHOT_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                       '(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36')
+
+# Asset references in HTML and CSS
+_HTML_ASSET_PATTERN = re.compile(
+    r'''(<(?:script|img|link|source|iframe|video|audio)\b[^>]*?\b(?:src|href)=["'])([^"'#]+)(["'])''',
+    re.IGNORECASE
+)
+_CSS_URL_PATTERN = re.compile(r'''(url\(\s*["']?)([^"')]+)(["']?\s*\))''', re.IGNORECASE)
+
+
+class SnapshotStore:
     """
-    Capture elements or tables from a site with a configurable timer.
+    Content-addressed store for prefetched pages and assets.
 
-    Returns:
-    - True if all operations succeed.
-    - False if any operation fails.
+    Bodies are stored once under objects/<hash[:2]>/<hash>, whatever URL they came from.
+    Each snapshot is a JSON manifest mapping the URLs of one page to object hashes.
     """
-    try:
-        # Log the entire site dictionary
-        logger.debug(f"Processing site: {json.dumps(site, default=str)}")
 
-        # Setup Chrome options
-        options = uc.ChromeOptions()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--force-device-scale-factor=1")
+    def __init__(self, root):
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
 
-        # Initialize WebDriver
-        driver = uc.Chrome(options=options)
-        logger.debug("WebDriver initialized.")
+    @staticmethod
+    def snapshot_name(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
 
-        # Log window size
-        window_size = site.get("window_size", "1920x1080")
-        logger.debug(f"Setting window size to: {window_size}")
-        width, height = map(int, window_size.split('x'))
-        driver.set_window_size(width, height)
+    def object_path(self, object_hash):
+        return self.objects_dir / object_hash[:2] / object_hash
 
-        # Log URL
-        url = site["url"]
-        logger.debug(f"Navigating to URL: {url}")
-        driver.get(url)
+    def put(self, body):
+        object_hash = hashlib.sha256(body).hexdigest()
+        path = self.object_path(object_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            tmp_path.write_bytes(body)
+            os.replace(tmp_path, path)
+        return object_hash
 
-        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        logger.debug("Page loaded successfully.")
-        time.sleep(timer)  # Wait for the page to load
-
-        screenshot_dir = Path(BASE_DIR, "images")  # Path to save screenshots
-        log_path("screenshot_dir", screenshot_dir)
-        screenshot_dir.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
-
-        # Ensure 'template' directory exists
-        template_dir = Path(BASE_DIR, "template")
-        log_path("template_dir", template_dir)
-        template_dir.mkdir(parents=True, exist_ok=True)
-
-        # 1. Capture Full-Page Screenshot (If Required)
-        if site.get("full_page", False):
-            full_screenshot_file = site.get("full_screenshot_file")
-            full_screenshot_path = screenshot_dir / full_screenshot_file
-            log_path("full_screenshot_path", full_screenshot_path)
-            logger.debug(f"Full screen path: {full_screenshot_path}")
-            if full_screenshot_path.exists():
-                full_screenshot_path.unlink()
-                logger.debug(f"Old file removed: {full_screenshot_path}")
-
-            capture_full_page(driver, full_screenshot_path)
-
-        # 2. Capture Element Screenshot (If div_selector is Present)
-        if "div_selector" in site:
-            div_selector = site["div_selector"]
-            logger.debug(f"Capturing element with selector: {div_selector}")
-            element = WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, div_selector))
-            )
-            driver.execute_script("arguments[0].scrollIntoView();", element)
-            logger.debug("Element scrolled into view.")
-            element_screenshot_file = site["full_screenshot_file"]
-            element_screenshot_path = screenshot_dir / element_screenshot_file
-            log_path("element_screenshot_path", element_screenshot_path)
-
-            if element_screenshot_path.exists():
-                element_screenshot_path.unlink()
-                logger.debug(f"Old file removed: {element_screenshot_path}")
-
-            # Convert Path to string before passing to Selenium
-            element_screenshot_path_str = str(element_screenshot_path)
-            time.sleep(timer)  # Wait for the element to be in view
-            element.screenshot(element_screenshot_path_str)
-            logger.info(f"Element screenshot saved to: {element_screenshot_path_str}")
-
-        # 3. Perform Cropping (If crop_percentages and output_files are Present)
-        if "crop_percentages" in site and "output_files" in site:
-            full_screenshot_file = site["full_screenshot_file"]
-            full_screenshot_path = screenshot_dir / full_screenshot_file
-            log_path("full_screenshot_path for cropping", full_screenshot_path)
-            if not full_screenshot_path.exists():
-                logger.error(f"Error: Image path {full_screenshot_path} does not exist.")
-                return False
+    def read(self, object_hash):
+        return self.object_path(object_hash).read_bytes()
 
-            logger.debug("Starting cropping process...")
-            # Ensure output_files are correctly logged
-            output_files = [template_dir / output_file for output_file in site["output_files"]]
-            for idx, output_file in enumerate(output_files, start=1):
-                log_path(f"output_file_{idx} for cropping", output_file)
-
-            # Pass Path objects
-            crop_image_with_percentage(
-                full_screenshot_path,
-                site["crop_percentages"],
-                output_files
-            )
+    def manifest_path(self, name):
+        return self.root / f"{name}.json"
 
-        # 4. Capture Table Screenshot (If table_selector is Present)
-        if "table_selector" in site:
-            table_selector = site["table_selector"]
-            table_screenshot_file = site["table_screenshot_file"]
-            logger.debug(f"Capturing table with selector: {table_selector}")
-            table_screenshot_path = screenshot_dir / table_screenshot_file
-            log_path("table_screenshot_path", table_screenshot_path)
-
-            if table_screenshot_path.exists():
-                table_screenshot_path.unlink()
-                logger.debug(f"Old file removed: {table_screenshot_path}")
-
-            capture_table(
-                driver,
-                table_selector,
-                table_screenshot_file,
-                timer=timer,
-                rows_to_capture=site.get("rows_to_capture", 3)  # Default to 3 if not specified
-            )
-            logger.info(f"Table screenshot saved to: {table_screenshot_path}")
+    def save_manifest(self, manifest):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.manifest_path(manifest['name'])
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+        os.replace(tmp_path, path)
 
-        # 5. **After Processing Sites: Reset All Email Statuses to 'unsent'**
-        logger.debug("Resetting all email statuses to 'unsent' after processing sites.")
+    def load_manifest(self, name):
+        path = self.manifest_path(name)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding='utf-8'))
+
+    def list_manifests(self):
+        if not self.root.exists():
+            return []
+        return [json.loads(path.read_text(encoding='utf-8')) for path in sorted(self.root.glob('*.json'))]
+
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR)
+
+
+async def _fetch_urls(urls, concurrency):
+    """
+    Fetch URLs concurrently over one aiohttp session, whose connector keeps at most concurrency
+    requests in flight. Returns a dictionary of URL to (status, content_type, body).
+    """
+    async def fetch(session, url):
         try:
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute("UPDATE emails SET status = 'unsent'")
-            db.commit()
-            logger.info("All email statuses have been reset to 'unsent'.")
+            async with session.get(url) as response:
+                body = await response.read()
+                content_type = response.headers.get('Content-Type', 'application/octet-stream')
+                return url, (response.status, content_type, body)
+        except Exception as e:
+            logger.warning(f"Snapshot fetch failed for {url}: {e!r}")
+            return url, None
+
+    async with aiohttp.ClientSession(
+            headers={'User-Agent': SNAPSHOT_USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=SNAPSHOT_FETCH_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        results = await asyncio.gather(*(fetch(session, url) for url in urls))
+    return {url: result for url, result in results if result is not None}
+
+
+def _extract_asset_urls(base_url, body, pattern):
+    """Resolve asset references found by pattern in an HTML or CSS body against base_url."""
+    text = body.decode('utf-8', errors='replace')
+    urls = []
+    for match in pattern.finditer(text):
+        reference = match.group(2).strip()
+        if reference.startswith(('data:', 'javascript:', 'mailto:', 'about:')):
+            continue
+        resolved = urljoin(base_url, reference)
+        if resolved.startswith(('http://', 'https://')) and resolved not in urls:
+            urls.append(resolved)
+    return urls
+
+
+async def _prefetch_snapshot(url, extra_urls, concurrency):
+    page = (await _fetch_urls([url], 1)).get(url)
+    if page is None or page[0] >= 400:
+        raise RuntimeError(f"Failed to fetch {url} for snapshot.")
+    fetched = {url: page}
+
+    # First level: assets referenced by the page, plus explicitly listed URLs (e.g. XHR endpoints)
+    asset_urls = _extract_asset_urls(url, page[2], _HTML_ASSET_PATTERN)
+    asset_urls += [extra for extra in extra_urls if extra not in asset_urls]
+    asset_urls = [asset for asset in asset_urls if asset not in fetched][:SNAPSHOT_MAX_ASSETS]
+    fetched.update(await _fetch_urls(asset_urls, concurrency))
+
+    # Second level: fonts and images referenced from stylesheets
+    css_urls = []
+    for asset_url, (status, content_type, body) in list(fetched.items()):
+        if 'css' in content_type:
+            css_urls += [css_url for css_url in _extract_asset_urls(asset_url, body, _CSS_URL_PATTERN)
+                         if css_url not in fetched and css_url not in css_urls]
+    remaining = SNAPSHOT_MAX_ASSETS - len(asset_urls)
+    if css_urls and remaining > 0:
+        fetched.update(await _fetch_urls(css_urls[:remaining], concurrency))
+    return fetched
+
+
+def prefetch_snapshot(url, extra_urls=(), concurrency=SNAPSHOT_CONCURRENCY):
+    """
+    Fetch a page and its assets concurrently into the snapshot store and write its manifest.
+    Returns the manifest.
+    """
+    start = time.perf_counter()
+    fetched = asyncio.run(_prefetch_snapshot(url, list(extra_urls), concurrency))
+
+    resources = {}
+    total_bytes = 0
+    for resource_url, (status, content_type, body) in fetched.items():
+        resources[resource_url] = {
+            "hash": snapshot_store.put(body),
+            "status": status,
+            "content_type": content_type,
+            "bytes": len(body),
+        }
+        total_bytes += len(body)
+
+    manifest = {
+        "name": SnapshotStore.snapshot_name(url),
+        "url": url,
+        "fetched_at": time.time(),
+        "resources": resources,
+    }
+    snapshot_store.save_manifest(manifest)
+    logger.info(f"Snapshot of {url} stored: {len(resources)} resource(s), {total_bytes} bytes "
+                f"in {time.perf_counter() - start:.2f}s.")
+    return manifest
+
+
+class SnapshotServer:
+    """
+    Local HTTP server that replays snapshots to the browser.
+
+    Pages are served with every captured asset URL rewritten to the local object store,
+    a <base> pointing at the original URL, and a shim that maps fetch/XHR calls for
+    captured URLs to their local copies.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._server = None
+        self._lock = threading.Lock()
+        self._manifests = {}  # name -> (mtime_ns, manifest, {object hash: (resource url, resource)})
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _manifest(self, name):
+        """
+        Return a snapshot's manifest and its resources indexed by object hash.
+        Manifests are parsed once and reloaded only when a new prefetch replaces the file.
+        """
+        path = self.store.manifest_path(name)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            raise FileNotFoundError(name) from None
+        with self._lock:
+            cached = self._manifests.get(name)
+        if cached is None or cached[0] != mtime:
+            manifest = json.loads(path.read_text(encoding='utf-8'))
+            objects = {resource["hash"]: (resource_url, resource)
+                       for resource_url, resource in manifest["resources"].items()}
+            cached = (mtime, manifest, objects)
+            with self._lock:
+                self._manifests[name] = cached
+        return cached[1], cached[2]
+
+    def ensure_started(self):
+        with self._lock:
+            if self._server is None:
+                from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+                snapshot_server = self
+
+                class Handler(BaseHTTPRequestHandler):
+                    def do_GET(self):
+                        snapshot_server.handle(self)
+
+                    def log_message(self, format, *args):
+                        logger.debug(f"Snapshot server: {format % args}")
+
+                self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, name="snapshot-server", daemon=True).start()
+                logger.info(f"Snapshot server listening on 127.0.0.1:{self.port}")
+
+    def page_url(self, name):
+        return f"http://127.0.0.1:{self.port}/page/{name}"
+
+    def _object_url(self, name, object_hash):
+        return f"http://127.0.0.1:{self.port}/object/{name}/{object_hash}"
+
+    def _rewrite(self, manifest, base_url, text, pattern):
+        resources = manifest["resources"]
+
+        def replace(match):
+            resource = resources.get(urljoin(base_url, match.group(2).strip()))
+            if resource is None:
+                return match.group(0)
+            return f"{match.group(1)}{self._object_url(manifest['name'], resource['hash'])}{match.group(3)}"
+
+        return pattern.sub(replace, text)
+
+    def render_page(self, manifest):
+        page = manifest["resources"][manifest["url"]]
+        text = self.store.read(page["hash"]).decode('utf-8', errors='replace')
+        text = self._rewrite(manifest, manifest["url"], text, _HTML_ASSET_PATTERN)
+
+        url_map = {resource_url: self._object_url(manifest['name'], resource['hash'])
+                   for resource_url, resource in manifest["resources"].items()}
+        shim = (
+            f'<base href="{html.escape(manifest["url"], quote=True)}">'
+            '<script>(function(){var m=' + json.dumps(url_map).replace('</', '<\\/') + ';'
+            'function r(u){try{var a=new URL(u,document.baseURI).href;return m[a]||u;}catch(e){return u;}}'
+            'var f=window.fetch;if(f){window.fetch=function(i,o){if(typeof i==="string"){i=r(i);}'
+            'else if(i&&i.url&&r(i.url)!==i.url){i=new Request(r(i.url),i);}return f.call(this,i,o);};}'
+            'var x=XMLHttpRequest.prototype.open;XMLHttpRequest.prototype.open=function(){'
+            'arguments[1]=r(arguments[1]);return x.apply(this,arguments);};})();</script>'
+        )
+        head = re.search(r'<head\b[^>]*>', text, re.IGNORECASE)
+        if head:
+            text = text[:head.end()] + shim + text[head.end():]
+        else:
+            text = shim + text
+        return text.encode('utf-8')
+
+    def handle(self, handler):
+        parts = handler.path.split('?', 1)[0].strip('/').split('/')
+        try:
+            if len(parts) == 2 and parts[0] == 'page':
+                manifest, _ = self._manifest(parts[1])
+                body, content_type = self.render_page(manifest), 'text/html; charset=utf-8'
+            elif len(parts) == 3 and parts[0] == 'object':
+                manifest, objects = self._manifest(parts[1])
+                match = objects.get(parts[2])
+                if match is None:
+                    raise FileNotFoundError(parts[2])
+                resource_url, resource = match
+                body, content_type = self.store.read(resource["hash"]), resource["content_type"]
+                if 'css' in content_type:
+                    text = body.decode('utf-8', errors='replace')
+                    body = self._rewrite(manifest, resource_url, text, _CSS_URL_PATTERN).encode('utf-8')
+            else:
+                raise FileNotFoundError(handler.path)
+        except FileNotFoundError:
+            handler.send_error(404)
+            return
         except Exception as e:
-            logger.exception("Failed to reset email statuses after processing sites.")
+            logger.exception("Snapshot server failed to serve a request.")
+            handler.send_error(500)
+            return
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('Cache-Control', 'no-store')
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+snapshot_server = SnapshotServer(snapshot_store)
+
+
+def resolve_site_url(plan):
+    """
+    Return (url, offline) for a site plan, honouring its 'snapshot' mode:
+    - 'off' (default): load the live URL.
+    - 'warm': render from a local snapshot, refetching it when missing or older than SNAPSHOT_MAX_AGE.
+    - 'replay': render only from an existing snapshot with all other network access blocked.
+    """
+    url = plan.url
+    mode = plan.snapshot
+    if mode == "off" or not url.startswith(('http://', 'https://')):
+        return url, False
+
+    name = SnapshotStore.snapshot_name(url)
+    manifest = snapshot_store.load_manifest(name)
+    if mode == "replay":
+        if manifest is None:
+            raise FileNotFoundError(f"No snapshot available to replay for {url}.")
+    elif manifest is None or time.time() - manifest["fetched_at"] > SNAPSHOT_MAX_AGE:
+        prefetch_snapshot(url, plan.snapshot_urls)
+
+    snapshot_server.ensure_started()
+    logger.debug(f"Serving {url} from snapshot {name} (mode={mode}).")
+    return snapshot_server.page_url(name), mode == "replay"
+
+
+# Built-in URL pattern sets a site's 'block' policy can reference by name
+BLOCK_PRESETS = {
+    'ads': [
+        '*doubleclick.net*', '*googlesyndication.com*', '*googleadservices.com*', '*adservice.google.*',
+        '*amazon-adsystem.com*', '*adnxs.com*', '*taboola.com*', '*outbrain.com*', '*criteo.*',
+        '*pubmatic.com*', '*rubiconproject.com*', '*moatads.com*',
+    ],
+    'trackers': [
+        '*google-analytics.com*', '*googletagmanager.com*', '*facebook.net*', '*connect.facebook.*',
+        '*hotjar.com*', '*segment.io*', '*segment.com/analytics*', '*newrelic.com*', '*nr-data.net*',
+        '*scorecardresearch.com*', '*quantserve.com*', '*clarity.ms*',
+    ],
+}
+
+# Network.setBlockedURLs only matches URLs, so resource types are blocked by file extension,
+# with and without a query string ('?' is literal in these patterns; only '*' is a wildcard)
+BLOCK_RESOURCE_TYPE_EXTENSIONS = {
+    'Font': ['woff', 'woff2', 'ttf', 'otf', 'eot'],
+    'Image': ['png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'svg', 'ico'],
+    'Media': ['mp4', 'webm', 'm3u8', 'ts', 'mp3', 'ogg'],
+    'Stylesheet': ['css'],
+    'Script': ['js'],
+}
+BLOCK_RESOURCE_TYPE_PATTERNS = {
+    resource_type: [pattern for extension in extensions for pattern in (f'*.{extension}', f'*.{extension}?*')]
+    for resource_type, extensions in BLOCK_RESOURCE_TYPE_EXTENSIONS.items()
+}
+
+
+def get_block_patterns(site):
+    """
+    Return the URL patterns to block for a site from its 'block' policy:
+    {"presets": [...], "url_patterns": [...], "resource_types": [...]}.
+    """
+    policy = site.get("block")
+    if not policy:
+        return []
+    patterns = []
+    for preset in policy.get("presets", []):
+        patterns.extend(BLOCK_PRESETS[preset])
+    patterns.extend(policy.get("url_patterns", []))
+    for resource_type in policy.get("resource_types", []):
+        patterns.extend(BLOCK_RESOURCE_TYPE_PATTERNS[resource_type])
+    return list(dict.fromkeys(patterns))
+
+
+def validate_block_policy(policy):
+    """Return an error message for an invalid 'block' policy, or None if it is valid."""
+    if not isinstance(policy, dict):
+        return "'block' must be an object."
+    for key in ("presets", "url_patterns", "resource_types"):
+        values = policy.get(key, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            return f"'{key}' must be a list of strings."
+    unknown_presets = set(policy.get("presets", [])) - set(BLOCK_PRESETS)
+    if unknown_presets:
+        return f"Unknown block presets: {', '.join(sorted(unknown_presets))}."
+    unknown_types = set(policy.get("resource_types", [])) - set(BLOCK_RESOURCE_TYPE_PATTERNS)
+    if unknown_types:
+        return f"Unknown resource types: {', '.join(sorted(unknown_types))}."
+    return None
+
+
+def apply_resource_policy(driver, patterns):
+    """Block requests matching the given URL patterns for the rest of the session."""
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    logger.debug(f"Blocking {len(patterns)} URL pattern(s).")
+
+
+def collect_network_stats(driver):
+    """
+    Summarize the network activity recorded in the performance log: requests and bytes loaded,
+    requests blocked by the resource policy, and an estimate of the bytes saved. The estimate
+    uses snapshot sizes when the blocked URL has been snapshotted, and otherwise the average
+    size of loaded requests of the same type.
+    """
+    requests_by_id = {}
+    loaded_bytes_by_type = {}
+    loaded_count_by_type = {}
+    blocked = []
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        method, params = message.get('method'), message.get('params', {})
+        if method == 'Network.requestWillBeSent':
+            requests_by_id[params['requestId']] = (params['request']['url'], params.get('type', 'Other'))
+        elif method == 'Network.loadingFinished':
+            _, resource_type = requests_by_id.get(params['requestId'], (None, 'Other'))
+            loaded_bytes_by_type[resource_type] = loaded_bytes_by_type.get(resource_type, 0) + \
+                params.get('encodedDataLength', 0)
+            loaded_count_by_type[resource_type] = loaded_count_by_type.get(resource_type, 0) + 1
+        elif method == 'Network.loadingFailed' and params.get('blockedReason'):
+            blocked.append(requests_by_id.get(params['requestId'], (None, params.get('type', 'Other'))))
+
+    return summarize_network_stats(loaded_bytes_by_type, loaded_count_by_type, blocked)
+
+
+def summarize_network_stats(loaded_bytes_by_type, loaded_count_by_type, blocked):
+    """
+    Summarize a visit's traffic. Bytes saved by each blocked (url, resource_type) request are taken
+    from the snapshot store when the URL was prefetched, else estimated from the average size
+    of loaded requests of the same type.
+    """
+    snapshot_sizes = {}
+    for manifest in snapshot_store.list_manifests():
+        for resource_url, resource in manifest["resources"].items():
+            snapshot_sizes[resource_url] = resource["bytes"]
+
+    bytes_saved = 0
+    for blocked_url, resource_type in blocked:
+        if blocked_url in snapshot_sizes:
+            bytes_saved += snapshot_sizes[blocked_url]
+        elif loaded_count_by_type.get(resource_type):
+            bytes_saved += loaded_bytes_by_type[resource_type] // loaded_count_by_type[resource_type]
+
+    return {
+        "requests_loaded": sum(loaded_count_by_type.values()),
+        "bytes_loaded": sum(loaded_bytes_by_type.values()),
+        "requests_blocked": len(blocked),
+        "estimated_bytes_saved": bytes_saved,
+    }
+
+
+# Ordered capture steps a compiled site plan can contain
+STEP_FULL_PAGE = 'full_page'
+STEP_ELEMENT = 'element'
+STEP_CROP = 'crop'
+STEP_TABLE = 'table'
+STEP_COMPOSE = 'compose'  # Draw the report with ReportCompositor instead of visiting a URL
+STEP_WIDGET = 'widget'  # Draw a forecast widget with WidgetRenderer instead of screenshotting its embed
+
+# How the final report image is produced: screenshotting generated_template.html, or composing it directly
+REPORT_RENDERERS = ('browser', 'native')
+
+SITE_PLAN_CACHE_SIZE = 32
+
+# Total seconds a site may take, retries and hedged attempts included; overridable per site with 'deadline'
+SITE_DEADLINE = 180
+
+# Browser engines a site can be captured with; 'auto' prefers Playwright and falls back to Selenium
+BROWSER_ENGINES = ('auto', 'playwright', 'selenium')
+DEFAULT_BROWSER_ENGINE = os.environ.get('WINGSTAR_BROWSER_ENGINE', 'auto')
+
+
+class SiteConfigError(ValueError):
+    """Raised when a site configuration cannot be compiled into a capture plan."""
+
+
+@dataclass(frozen=True)
+class CropRegion:
+    """A validated crop rectangle in fractions of the source image, and where to save it."""
+    left: float
+    top: float
+    right: float
+    bottom: float
+    output_path: Path
+
+    def as_tuple(self):
+        return self.left, self.top, self.right, self.bottom
+
+
+@dataclass(frozen=True)
+class SitePlan:
+    """
+    A validated site configuration with every path resolved and its capture steps in order.
+    Built by compile_site; capture code reads fields instead of probing dictionary keys.
+    """
+    url: str
+    window_width: int
+    window_height: int
+    steps: tuple
+    full_screenshot_path: Optional[Path] = None
+    output_formats: tuple = ('png',)
+    pdf_path: Optional[Path] = None
+    html_path: Optional[Path] = None
+    div_selector: Optional[str] = None
+    crops: tuple = ()
+    table_selector: Optional[str] = None
+    table_screenshot_file: Optional[str] = None
+    table_output_path: Optional[Path] = None
+    rows_to_capture: int = 3
+    snapshot: str = 'off'
+    snapshot_urls: tuple = ()
+    block_patterns: tuple = ()
+    engine: str = 'auto'
+    layout: Optional[str] = None
+    widget: Optional[WidgetSpec] = None
+    fallback: Optional['SitePlan'] = None  # Browser plan a widget plan was converted from, used if drawing fails
+    deadline: float = SITE_DEADLINE
+    hedge: bool = True
+
+    @property
+    def window_size(self):
+        return f"{self.window_width}x{self.window_height}"
+
+
+def _require_string(site, key):
+    value = site.get(key)
+    if not isinstance(value, str) or not value:
+        raise SiteConfigError(f"'{key}' must be a non-empty string.")
+    return value
+
+
+def site_output_dirs(report_id=None):
+    """
+    Return the (screenshot_dir, template_dir) a site's outputs are written to.
+    Sites captured for one report of a /generate-reports batch write under images/<report_id>/
+    and template/<report_id>/, next to that report's generated page, so reports never read
+    each other's captures.
+    """
+    screenshot_dir = Path(BASE_DIR, "images")
+    template_dir = Path(BASE_DIR, "template")
+    if report_id is None:
+        return screenshot_dir, template_dir
+    return screenshot_dir / report_id, template_dir / report_id
+
+
+def compile_site(site, report_id=None):
+    """
+    Validate a site configuration dictionary and compile it into a SitePlan.
+    With a report_id, outputs are placed in that report's directories (see site_output_dirs).
+    Raises SiteConfigError describing the first problem found.
+    """
+    if not isinstance(site, dict):
+        raise SiteConfigError("Site configuration must be an object.")
+
+    screenshot_dir, template_dir = site_output_dirs(report_id)
+
+    def output_path(directory, name):
+        # Report sites keep only the file name, so absolute paths from the app's site list
+        # still land in the report's directory
+        return directory / (Path(name).name if report_id is not None else name)
+
+    # A compose site renders the report natively; it has no URL and no browser settings
+    if site.get("compose", False):
+        layout = site.get("layout")
+        if layout is not None and (not isinstance(layout, str) or not layout):
+            raise SiteConfigError("'layout' must be a non-empty string.")
+        return SitePlan(
+            url=site.get("url", "compose:report"),
+            window_width=REPORT_LAYOUT["width"],
+            window_height=REPORT_LAYOUT["min_height"],
+            steps=(STEP_COMPOSE,),
+            full_screenshot_path=output_path(screenshot_dir, _require_string(site, "full_screenshot_file")),
+            layout=layout,
+        )
+
+    # A widget site draws a forecast panel from data; it is compiled like a screenshot-and-crop site
+    if "widget" in site:
+        widget = compile_widget(site["widget"])
+        full_screenshot_path = output_path(screenshot_dir, _require_string(site, "full_screenshot_file"))
+        plan = compile_site({**{key: value for key, value in site.items() if key != "widget"},
+                             "url": site.get("url", f"widget:{widget.type}"),
+                             "window_size": site.get("window_size", "800x800")}, report_id)
+        return replace(plan, steps=(STEP_WIDGET,) + ((STEP_CROP,) if plan.crops else ()), widget=widget,
+                       full_screenshot_path=full_screenshot_path, block_patterns=())
+
+    url = _require_string(site, "url")
+
+    window_size = site.get("window_size", "1920x1080")
+    match = re.fullmatch(r'(\d+)x(\d+)', str(window_size))
+    if not match or int(match.group(1)) == 0 or int(match.group(2)) == 0:
+        raise SiteConfigError(f"Invalid 'window_size' '{window_size}'. Expected WIDTHxHEIGHT.")
+
+    try:
+        output_formats = tuple(get_site_output_formats(site))
+    except (AttributeError, TypeError):
+        raise SiteConfigError("'output_format' must be a string or a list of strings.") from None
+    invalid_formats = set(output_formats) - set(SITE_OUTPUT_FORMATS)
+    if invalid_formats:
+        raise SiteConfigError(f"Invalid 'output_format'. Must be one of: {', '.join(SITE_OUTPUT_FORMATS)}.")
+
+    snapshot = site.get("snapshot", "off")
+    if snapshot not in SNAPSHOT_MODES:
+        raise SiteConfigError(f"Invalid 'snapshot'. Must be one of: {', '.join(SNAPSHOT_MODES)}.")
+
+    engine = site.get("engine", DEFAULT_BROWSER_ENGINE)
+    if engine not in BROWSER_ENGINES:
+        raise SiteConfigError(f"Invalid 'engine'. Must be one of: {', '.join(BROWSER_ENGINES)}.")
+
+    deadline = site.get("deadline", SITE_DEADLINE)
+    if isinstance(deadline, bool) or not isinstance(deadline, (int, float)) or deadline <= 0:
+        raise SiteConfigError("'deadline' must be a positive number of seconds.")
+    hedge = site.get("hedge", True)
+    if not isinstance(hedge, bool):
+        raise SiteConfigError("'hedge' must be true or false.")
+
+    if "block" in site:
+        block_error = validate_block_policy(site["block"])
+        if block_error:
+            raise SiteConfigError(block_error)
+
+    steps = []
+    fields = {}
+    needs_screenshot_file = site.get("full_page", False) or "div_selector" in site or \
+        "crop_percentages" in site or "output_files" in site
+    if needs_screenshot_file:
+        fields["full_screenshot_path"] = output_path(screenshot_dir, _require_string(site, "full_screenshot_file"))
+
+    # 1. Full-page capture and its alternative outputs
+    if site.get("full_page", False):
+        steps.append(STEP_FULL_PAGE)
+        full_screenshot_path = fields["full_screenshot_path"]
+        if "pdf" in output_formats:
+            fields["pdf_path"] = output_path(screenshot_dir,
+                                             site.get("pdf_file", full_screenshot_path.with_suffix('.pdf')))
+        if "html" in output_formats:
+            fields["html_path"] = output_path(screenshot_dir,
+                                              site.get("html_file", full_screenshot_path.with_suffix('.html')))
+
+    # 2. Element capture
+    if "div_selector" in site:
+        steps.append(STEP_ELEMENT)
+        fields["div_selector"] = _require_string(site, "div_selector")
+
+    # 3. Cropping, with every region checked up front
+    if "crop_percentages" in site or "output_files" in site:
+        crop_percentages = site.get("crop_percentages")
+        output_files = site.get("output_files")
+        if not isinstance(crop_percentages, list) or not isinstance(output_files, list):
+            raise SiteConfigError("'crop_percentages' and 'output_files' must both be lists.")
+        if len(crop_percentages) != len(output_files):
+            raise SiteConfigError("Mismatch between 'crop_percentages' and 'output_files'.")
+
+        crops = []
+        for i, (bounds, output_file) in enumerate(zip(crop_percentages, output_files), start=1):
+            if not isinstance(bounds, (list, tuple)) or len(bounds) != 4 or \
+                    not all(isinstance(pct, (int, float)) for pct in bounds):
+                raise SiteConfigError(f"Crop {i} must be four numbers: left, top, right, bottom.")
+            left, top, right, bottom = (float(pct) for pct in bounds)
+            if not all(0.0 <= pct <= 1.0 for pct in (left, top, right, bottom)):
+                raise SiteConfigError(f"Crop {i} percentages must be between 0 and 1.")
+            if left >= right or top >= bottom:
+                raise SiteConfigError(f"Crop {i} has invalid bounds: left >= right or top >= bottom.")
+            if not isinstance(output_file, str) or not output_file:
+                raise SiteConfigError(f"Crop {i} output file must be a non-empty string.")
+            crops.append(CropRegion(left, top, right, bottom, output_path(template_dir, output_file)))
+        steps.append(STEP_CROP)
+        fields["crops"] = tuple(crops)
+
+    # 4. Table capture
+    if "table_selector" in site:
+        steps.append(STEP_TABLE)
+        fields["table_selector"] = _require_string(site, "table_selector")
+        fields["table_screenshot_file"] = _require_string(site, "table_screenshot_file")
+        fields["table_output_path"] = output_path(template_dir, f"cropped_{fields['table_screenshot_file']}")
+        rows_to_capture = site.get("rows_to_capture", 3)  # Default to 3 if not specified
+        if not isinstance(rows_to_capture, int) or rows_to_capture <= 0:
+            raise SiteConfigError("'rows_to_capture' must be a positive integer.")
+        fields["rows_to_capture"] = rows_to_capture
+
+    return SitePlan(
+        url=url,
+        window_width=int(match.group(1)),
+        window_height=int(match.group(2)),
+        steps=tuple(steps),
+        output_formats=output_formats,
+        snapshot=snapshot,
+        snapshot_urls=tuple(site.get("snapshot_urls", ())),
+        block_patterns=tuple(get_block_patterns(site)),
+        engine=engine,
+        deadline=float(deadline),
+        hedge=hedge,
+        **fields
+    )
+
+
+_site_plan_cache = OrderedDict()
+
+
+def compile_site_plans(sites, report_id=None):
+    """
+    Compile a list of site configurations into SitePlans, for one report when report_id is given.
+
+    Results are cached by a hash of the configuration, so repeated runs with the same
+    sites skip validation entirely. Raises SiteConfigError naming the offending site.
+    """
+    config_hash = hashlib.sha256(
+        json.dumps([sites, report_id], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    plans = _site_plan_cache.get(config_hash)
+    if plans is not None:
+        _site_plan_cache.move_to_end(config_hash)
+        logger.debug(f"Site plan cache hit: {config_hash[:12]}")
+        return plans
+
+    compiled = []
+    for idx, site in enumerate(sites, start=1):
+        try:
+            compiled.append(compile_site(site, report_id))
+        except SiteConfigError as e:
+            raise SiteConfigError(f"Site {idx}: {e}") from None
+    plans = tuple(compiled)
+
+    _site_plan_cache[config_hash] = plans
+    if len(_site_plan_cache) > SITE_PLAN_CACHE_SIZE:
+        _site_plan_cache.popitem(last=False)
+    logger.debug(f"Compiled {len(plans)} site plan(s): {config_hash[:12]}")
+    return plans
+
+
+# Browser resource governor
+BROWSER_MAX_CONCURRENT = 3
+BROWSER_MEMORY_ESTIMATE_MB = 350  # Assumed footprint of a browser until real usage has been observed
+BROWSER_MEMORY_RESERVE_MB = 512  # Memory kept free for the OS and the backend itself
+BROWSER_ACQUIRE_TIMEOUT = 300
+BROWSER_MONITOR_INTERVAL = 5.0
+BROWSER_QUIT_GRACE = 5.0  # Seconds a browser's processes get to exit after quit() before they are killed
+BROWSER_PIDS_FILE = Path(BASE_DIR, 'browser-pids.json')
+
+_psutil = None
+
+
+def get_psutil():
+    """Return the psutil module, or None when it is not installed (memory checks are then skipped)."""
+    global _psutil
+    if _psutil is None:
+        try:
+            import psutil
+            _psutil = psutil
+        except ImportError:
+            logger.warning("psutil is not installed; browser memory tracking is disabled.")
+            _psutil = False
+    return _psutil or None
+
+
+class BrowserGovernor:
+    """
+    Tracks every browser the backend launches and keeps them within the machine's means.
+
+    - Caps concurrent browsers at BROWSER_MAX_CONCURRENT, and further by available memory
+      using the observed peak RSS of previous browser process trees.
+    - Samples RSS for each chromedriver/Chrome process tree in a background thread.
+    - Kills and reaps a browser's process tree when driver.quit() leaves it behind, and on
+      startup kills browsers recorded by a previous run that never shut down.
+    """
+
+    def __init__(self, max_concurrent=BROWSER_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._condition = threading.Condition()
+        self._active = {}  # id(driver) -> {"pids": [...], "started": ..., "rss_mb": ..., "peak_rss_mb": ...}
+        self._reserved = 0
+        self._peak_samples = []
+        self._monitor = None
+        self.counters = {"launches": 0, "launch_failures": 0, "waits": 0, "forced_kills": 0, "orphans_reaped": 0}
+
+    def memory_estimate_mb(self):
+        if not self._peak_samples:
+            return BROWSER_MEMORY_ESTIMATE_MB
+        return max(BROWSER_MEMORY_ESTIMATE_MB, sum(self._peak_samples) / len(self._peak_samples))
+
+    def available_mb(self):
+        psutil = get_psutil()
+        if psutil is None:
+            return None
+        return psutil.virtual_memory().available / (1024 * 1024)
+
+    def _can_launch(self):
+        running = len(self._active) + self._reserved
+        if running >= self.max_concurrent:
             return False
+        available = self.available_mb()
+        if available is None or running == 0:
+            return True  # Always allow one browser so work can make progress
+        return available - BROWSER_MEMORY_RESERVE_MB >= self.memory_estimate_mb()
+
+    def acquire(self, timeout=BROWSER_ACQUIRE_TIMEOUT):
+        """Reserve a browser slot, waiting until the concurrency and memory limits allow it."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if not self._can_launch():
+                self.counters["waits"] += 1
+                logger.info("Waiting for browser capacity.")
+            while not self._can_launch():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timed out waiting for browser capacity.")
+                self._condition.wait(min(remaining, BROWSER_MONITOR_INTERVAL))
+            self._reserved += 1
+
+    def cancel(self):
+        """Give back a slot reserved by acquire() when the launch failed."""
+        with self._condition:
+            self._reserved -= 1
+            self.counters["launch_failures"] += 1
+            self._condition.notify_all()
+
+    def register(self, driver):
+        """Record a launched driver's chromedriver and browser process ids."""
+        pids = [pid for pid in (
+            getattr(getattr(getattr(driver, 'service', None), 'process', None), 'pid', None),
+            getattr(driver, 'browser_pid', None),
+        ) if pid]
+        with self._condition:
+            self._reserved -= 1
+            self._active[id(driver)] = {"pids": pids, "started": time.time(), "rss_mb": 0.0, "peak_rss_mb": 0.0}
+            self.counters["launches"] += 1
+        self._save_pids()
+        self._ensure_monitor()
+        logger.debug(f"Browser registered with pids {pids}.")
+
+    def _tree(self, pids):
+        """Return psutil.Process objects for the given pids and all of their descendants."""
+        psutil = get_psutil()
+        processes = {}
+        for pid in pids:
+            try:
+                root = psutil.Process(pid)
+                for process in [root] + root.children(recursive=True):
+                    processes[process.pid] = process
+            except psutil.Error:
+                continue
+        return list(processes.values())
+
+    def _kill_pids(self, pids):
+        """Kill the given processes and their descendants; returns how many were killed."""
+        psutil = get_psutil()
+        if psutil is None:
+            killed = 0
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    killed += 1
+                except OSError:
+                    pass
+            return killed
+        return self._kill_processes(self._tree(pids))
+
+    def _kill_processes(self, processes, grace=0):
+        """
+        Kill the given psutil processes; returns how many had to be killed.
+        With a grace period, processes that exit on their own within it are left alone and not counted.
+        """
+        psutil = get_psutil()
+        if grace:
+            _, processes = psutil.wait_procs(processes, timeout=grace)
+        killed = []
+        for process in processes:
+            try:
+                process.kill()
+                killed.append(process)
+            except psutil.Error:
+                pass
+        gone, alive = psutil.wait_procs(killed, timeout=5)  # Reap so no zombies are left
+        for process in alive:
+            logger.warning(f"Browser process {process.pid} did not exit after kill.")
+        return len(gone)
+
+    def release(self, driver):
+        """Quit a driver, then kill whatever part of its process tree is still running."""
+        with self._condition:
+            entry = self._active.pop(id(driver), None)
+        psutil = get_psutil()
+        # Take the process tree before quitting: once chromedriver exits its children cannot be found through it
+        processes = self._tree(entry["pids"]) if entry and psutil is not None else []
+        quit_failed = False
+        try:
+            driver.quit()
+            logger.debug("WebDriver closed.")
+        except Exception as e:
+            quit_failed = True
+            logger.warning(f"driver.quit() failed: {e}")
+
+        if entry:
+            if entry["peak_rss_mb"]:
+                self._peak_samples = (self._peak_samples + [entry["peak_rss_mb"]])[-20:]
+            if psutil is not None:
+                killed = self._kill_processes(processes, grace=BROWSER_QUIT_GRACE)
+            elif quit_failed:
+                # Without psutil a pid cannot be told apart from a reused one, so it is only
+                # signalled when quit() did not shut the browser down itself
+                killed = self._kill_pids(entry["pids"])
+            else:
+                killed = 0
+            if killed:
+                self.counters["forced_kills"] += killed
+                logger.warning(f"Killed {killed} browser process(es) left behind after quit.")
+        self._save_pids()
+        with self._condition:
+            self._condition.notify_all()
+
+    def sample(self):
+        """Refresh the RSS of every tracked browser process tree."""
+        psutil = get_psutil()
+        if psutil is None:
+            return
+        with self._condition:
+            entries = list(self._active.values())
+        for entry in entries:
+            rss = 0
+            for process in self._tree(entry["pids"]):
+                try:
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    pass
+            entry["rss_mb"] = round(rss / (1024 * 1024), 1)
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], entry["rss_mb"])
+
+    def _ensure_monitor(self):
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._run_monitor, name="browser-governor", daemon=True)
+            self._monitor.start()
+
+    def _run_monitor(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.exception("Browser governor failed to sample memory.")
+            with self._condition:
+                self._condition.notify_all()  # Memory may have freed up for waiting launches
+                self._condition.wait(BROWSER_MONITOR_INTERVAL)
+
+    def _save_pids(self):
+        """Persist tracked pids so a later run can clean up after a crash."""
+        psutil = get_psutil()
+        with self._condition:
+            pids = [pid for entry in self._active.values() for pid in entry["pids"]]
+        records = []
+        for pid in pids:
+            created = None
+            if psutil is not None:
+                try:
+                    created = psutil.Process(pid).create_time()
+                except psutil.Error:
+                    continue
+            records.append({"pid": pid, "created": created})
+        try:
+            BROWSER_PIDS_FILE.write_text(json.dumps(records), encoding='utf-8')
+        except Exception as e:
+            logger.warning(f"Failed to record browser pids: {e}")
+
+    def reap_orphans(self):
+        """
+        Kill browsers recorded by a previous run that are still alive. A pid is only killed
+        when its creation time matches the record, so reused pids are left alone.
+        """
+        psutil = get_psutil()
+        if psutil is None or not BROWSER_PIDS_FILE.exists():
+            return 0
+        try:
+            records = json.loads(BROWSER_PIDS_FILE.read_text(encoding='utf-8'))
+        except Exception as e:
+            logger.warning(f"Failed to read recorded browser pids: {e}")
+            return 0
 
-        return True
+        orphans = []
+        for record in records:
+            try:
+                process = psutil.Process(record["pid"])
+                if record.get("created") is not None and abs(process.create_time() - record["created"]) < 1:
+                    orphans.append(record["pid"])
+            except psutil.Error:
+                continue
+        killed = self._kill_pids(orphans) if orphans else 0
+        self.counters["orphans_reaped"] += killed
+        BROWSER_PIDS_FILE.unlink(missing_ok=True)
+        logger.info(f"Reaped {killed} orphaned browser process(es) from a previous run.")
+        return killed
+
+    def metrics(self):
+        with self._condition:
+            browsers = [{
+                "pids": entry["pids"],
+                "age_s": round(time.time() - entry["started"], 1),
+                "rss_mb": entry["rss_mb"],
+                "peak_rss_mb": entry["peak_rss_mb"],
+            } for entry in self._active.values()]
+            reserved = self._reserved
+        available = self.available_mb()
+        return {
+            "active_browsers": len(browsers),
+            "pending_launches": reserved,
+            "max_concurrent": self.max_concurrent,
+            "available_mb": round(available, 1) if available is not None else None,
+            "memory_estimate_mb": round(self.memory_estimate_mb(), 1),
+            "total_rss_mb": round(sum(browser["rss_mb"] for browser in browsers), 1),
+            "browsers": browsers,
+            **self.counters,
+        }
+
+
+browser_governor = BrowserGovernor()
+
+
+_chromedriver_patcher = None
+_chromedriver_patch_lock = threading.Lock()
+
+
+def ensure_chromedriver_patched():
+    """
+    Patch the chromedriver binary once, before the first browser starts. Browsers launched
+    concurrently with user_multi_procs=True then reuse that binary instead of racing to patch it.
+    The patcher is kept so its cleanup never removes the binary while browsers use it.
+    """
+    global _chromedriver_patcher
+    with _chromedriver_patch_lock:
+        if _chromedriver_patcher is None:
+            patcher = uc.Patcher()
+            patcher.auto()
+            _chromedriver_patcher = patcher
+
+
+def create_driver(window_size="1920x1080", offline=False, performance_log=False):
+    """
+    Launch a Chrome WebDriver with the options used for all captures and set its window size.
+    With offline=True every host except 127.0.0.1 fails to resolve, for deterministic snapshot replays.
+    With performance_log=True network events are recorded for collect_network_stats.
+    Launches go through the browser governor; close the driver with close_driver().
+    """
+    # Setup Chrome options
+    options = uc.ChromeOptions()
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--force-device-scale-factor=1")
+    if offline:
+        options.add_argument("--host-resolver-rules=MAP * ~NOTFOUND , EXCLUDE 127.0.0.1")
+    if performance_log:
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
+    browser_governor.acquire()
+    try:
+        ensure_chromedriver_patched()
+        driver = uc.Chrome(options=options, user_multi_procs=True)
+    except Exception:
+        browser_governor.cancel()
+        raise
+    browser_governor.register(driver)
+    logger.debug("WebDriver initialized.")
+
+    try:
+        # Log window size
+        logger.debug(f"Setting window size to: {window_size}")
+        width, height = map(int, window_size.split('x'))
+        driver.set_window_size(width, height)
+    except Exception:
+        close_driver(driver)
+        raise
+    return driver
+
+
+def close_driver(driver):
+    """Quit a driver and make sure its whole browser process tree is gone."""
+    browser_governor.release(driver)
+
+
+# Playwright engine: one shared Chromium, a lightweight browser context per capture
+PLAYWRIGHT_NAVIGATION_TIMEOUT = 60000  # Milliseconds
+PLAYWRIGHT_WAIT_TIMEOUT = 15000  # Milliseconds; matches the Selenium engine's WebDriverWait timeouts
+
+
+def compile_block_pattern(patterns):
+    """Compile setBlockedURLs-style wildcard patterns ('*' matches anything) into one regular expression."""
+    return re.compile('|'.join(re.escape(pattern).replace(r'\*', '.*') for pattern in patterns))
+
+
+class _PlaywrightBrowserHandle:
+    """Stands in for a WebDriver so the browser governor can track, meter and reap the shared browser."""
+
+    def __init__(self, engine, pid):
+        self.engine = engine
+        self.browser_pid = pid
+
+    def quit(self):
+        self.engine.run(self.engine._close(), timeout=30)
+
+
+class PlaywrightEngine:
+    """
+    Browser engine built on asyncio Playwright.
+
+    A single Chromium instance runs on a private event loop thread and is kept for the life of
+    the process. Each capture gets its own browser context (viewport, cookies, routing), which
+    takes milliseconds to create instead of a browser launch; up to max_contexts run at once.
+    """
+
+    def __init__(self, max_contexts=BROWSER_MAX_CONCURRENT):
+        self.max_contexts = max_contexts
+        self.unavailable = None  # Why Playwright could not start here; 'auto' plans then use Selenium
+        self._lock = threading.Lock()
+        self._loop = None
+        self._playwright = None
+        self._browser = None
+        self._handle = None
+        self._contexts = None
+        self._launch_lock = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="playwright-engine", daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the engine's loop from any other thread and return its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result(timeout)
+
+    async def _ensure_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return self._browser
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            # Concurrent captures wait here for a single launch
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            return await self._launch()
+
+    async def _launch(self):
+        if self._handle is not None:
+            logger.warning("Shared Playwright browser disconnected; relaunching.")
+            await asyncio.to_thread(browser_governor.release, self._handle)
+
+        await asyncio.to_thread(browser_governor.acquire)
+        psutil = get_psutil()
+        children = {child.pid for child in psutil.Process().children()} if psutil else set()
+        try:
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(args=["--force-device-scale-factor=1"])
+        except BaseException:
+            browser_governor.cancel()
+            await self._close()
+            raise
+        # The Playwright driver is a child of this process and Chromium runs under it
+        pids = [child.pid for child in psutil.Process().children() if child.pid not in children] if psutil else []
+        self._handle = _PlaywrightBrowserHandle(self, pids[0] if pids else None)
+        browser_governor.register(self._handle)
+        self._contexts = asyncio.Semaphore(self.max_contexts)
+        logger.info(f"Playwright Chromium {self._browser.version} launched.")
+        return self._browser
+
+    async def _close(self):
+        browser, playwright = self._browser, self._playwright
+        self._browser = self._playwright = self._handle = None
+        for close in (browser and browser.close, playwright and playwright.stop):
+            if close:
+                try:
+                    await close()
+                except Exception as e:
+                    logger.warning(f"Failed to close Playwright cleanly: {e}")
+
+    def available(self):
+        """Start the shared browser if needed. False when Playwright is missing or cannot launch here."""
+        if self.unavailable is not None:
+            return False
+        try:
+            self.run(self._ensure_browser())
+            return True
+        except TimeoutError:
+            return False  # No browser capacity right now; not a reason to give up on Playwright
+        except Exception as e:
+            self.unavailable = str(e) or type(e).__name__
+            logger.warning(f"Playwright engine unavailable, using Selenium instead: {self.unavailable}")
+            return False
+
+    def capture(self, plan, url, offline, timer, network_stats=None):
+        """Capture one plan. Returns True if every step succeeded."""
+        return self.capture_many([(plan, url, offline, timer, network_stats)])[0]
+
+    def capture_many(self, jobs):
+        """
+        Capture (plan, url, offline, timer, network_stats) jobs concurrently in separate contexts.
+        Returns a list of booleans in job order.
+        """
+        async def gather():
+            return await asyncio.gather(*(self._capture_logged(*job) for job in jobs))
+        return self.run(gather())
+
+    def submit(self, plan, url, offline, timer, network_stats=None, timeout=None):
+        """
+        Start one capture without waiting for it and return a concurrent.futures.Future of its result.
+        The capture fails once it runs longer than timeout seconds; cancelling the future cancels it.
+        """
+        coroutine = self._capture_logged(plan, url, offline, timer, network_stats, timeout)
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def shutdown(self):
+        if self._handle is not None:
+            browser_governor.release(self._handle)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _capture_logged(self, plan, url, offline, timer, network_stats, timeout=None):
+        try:
+            await asyncio.wait_for(self._capture(plan, url, offline, timer, network_stats), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.error(f"Playwright capture of {plan.url} ran out of its {timeout:.1f} s budget.")
+            return False
+        except Exception as e:
+            logger.exception(f"Playwright capture of {plan.url} failed.")
+            return False
+
+    async def _capture(self, plan, url, offline, timer, network_stats):
+        browser = await self._ensure_browser()
+        async with self._contexts:
+            context = await browser.new_context(
+                viewport={"width": plan.window_width, "height": plan.window_height},
+                device_scale_factor=1,
+            )
+            blocked = []
+            loaded_bytes_by_type = {}
+            loaded_count_by_type = {}
+            try:
+                block_pattern = compile_block_pattern(plan.block_patterns) if plan.block_patterns else None
+                if block_pattern is not None or offline:
+                    async def route_request(route):
+                        request_url = route.request.url
+                        if block_pattern is not None and block_pattern.fullmatch(request_url):
+                            blocked.append((request_url, route.request.resource_type.capitalize()))
+                            await route.abort('blockedbyclient')
+                        elif offline and urlparse(request_url).hostname != '127.0.0.1':
+                            await route.abort('namenotresolved')
+                        else:
+                            await route.continue_()
+                    await context.route('**/*', route_request)
+
+                page = await context.new_page()
+                if block_pattern is not None:
+                    async def record_request(request):
+                        resource_type = request.resource_type.capitalize()
+                        loaded_count_by_type[resource_type] = loaded_count_by_type.get(resource_type, 0) + 1
+                        try:
+                            sizes = await request.sizes()
+                        except Exception:
+                            return  # The context closed before the sizes arrived
+                        loaded_bytes_by_type[resource_type] = loaded_bytes_by_type.get(resource_type, 0) + \
+                            sizes["responseHeadersSize"] + sizes["responseBodySize"]
+                    page.on('requestfinished', record_request)
+
+                logger.debug(f"Navigating to URL: {url}")
+                await page.goto(url, timeout=PLAYWRIGHT_NAVIGATION_TIMEOUT)
+                await page.locator('body').wait_for(state='attached', timeout=PLAYWRIGHT_WAIT_TIMEOUT)
+                logger.debug("Page loaded successfully.")
+                await asyncio.sleep(timer)  # Wait for the page to load
+
+                for step in plan.steps:
+                    if step == STEP_FULL_PAGE:
+                        await self._capture_full_page(page, plan)
+                    elif step == STEP_ELEMENT:
+                        await self._capture_element(page, plan, timer)
+                    elif step == STEP_CROP:
+                        if not await asyncio.to_thread(crop_plan_regions, plan):
+                            raise FileNotFoundError(plan.full_screenshot_path)
+                    elif step == STEP_TABLE:
+                        await capture_table_with_page(page, plan.table_selector, plan.table_screenshot_file, timer,
+                                                      plan.rows_to_capture, plan.table_output_path)
+            finally:
+                if block_pattern is not None and network_stats is not None:
+                    network_stats.update(summarize_network_stats(loaded_bytes_by_type, loaded_count_by_type, blocked))
+                    logger.info(f"Resource policy for {plan.url}: {network_stats}")
+                await context.close()
+
+    async def _capture_full_page(self, page, plan):
+        full_screenshot_path = plan.full_screenshot_path
+        log_path("full_screenshot_path", full_screenshot_path)
+        if "png" in plan.output_formats:
+            full_screenshot_path.unlink(missing_ok=True)
+            await page.screenshot(path=str(full_screenshot_path), full_page=True)
+            logger.info(f"Full-page screenshot saved to: {full_screenshot_path}")
+
+        if plan.pdf_path is not None:
+            # One page sized to the whole document, as in capture_pdf
+            total_width, total_height = await page.evaluate(
+                "[document.documentElement.scrollWidth, document.documentElement.scrollHeight]")
+            plan.pdf_path.parent.mkdir(parents=True, exist_ok=True)
+            await page.pdf(path=str(plan.pdf_path), width=f"{total_width}px", height=f"{total_height}px",
+                           print_background=True, page_ranges='1',
+                           margin={"top": "0", "bottom": "0", "left": "0", "right": "0"})
+            logger.info(f"PDF saved to: {plan.pdf_path}")
+
+        if plan.html_path is not None:
+            page_html = await page.evaluate("document.documentElement.outerHTML")
+            await asyncio.to_thread(write_self_contained_html, page_html, page.url, plan.html_path)
+
+    async def _capture_element(self, page, plan, timer):
+        logger.debug(f"Capturing element with selector: {plan.div_selector}")
+        element = page.locator(plan.div_selector).first
+        await element.scroll_into_view_if_needed(timeout=PLAYWRIGHT_WAIT_TIMEOUT)
+        logger.debug("Element scrolled into view.")
+        plan.full_screenshot_path.unlink(missing_ok=True)
+        await asyncio.sleep(timer)  # Wait for the element to be in view
+        await element.screenshot(path=str(plan.full_screenshot_path), timeout=PLAYWRIGHT_WAIT_TIMEOUT)
+        logger.info(f"Element screenshot saved to: {plan.full_screenshot_path}")
+
+
+async def capture_table_with_page(page, table_selector, table_screenshot_file, timer, rows_to_capture=3,
+                                  output_path=None):
+    """
+    Playwright counterpart of capture_table: screenshot the table header and first N rows
+    with a clip rectangle in document coordinates, so no full screenshot is decoded and cropped.
+    """
+    logger.debug(f"Capturing table with selector: {table_selector}")
+    table = page.locator(table_selector).first
+    await page.locator(f"{table_selector} tbody tr").first.wait_for(state='attached', timeout=PLAYWRIGHT_WAIT_TIMEOUT)
+    await table.scroll_into_view_if_needed(timeout=PLAYWRIGHT_WAIT_TIMEOUT)
+    logger.debug("Scrolled table into view.")
+    await asyncio.sleep(timer)  # Wait for the table to render completely
+
+    clip = await table.evaluate("""(table, rowsToCapture) => {
+        const rows = Array.from(table.querySelectorAll('tbody tr')).slice(0, rowsToCapture);
+        if (!rows.length) return null;
+        const top = (table.querySelector('thead') || rows[0]).getBoundingClientRect();
+        const bottom = rows[rows.length - 1].getBoundingClientRect();
+        return {x: top.left + window.scrollX, y: top.top + window.scrollY,
+                width: top.width, height: bottom.bottom - top.top};
+    }""", rows_to_capture)
+    if not clip or clip["width"] <= 0 or clip["height"] <= 0:
+        logger.warning("No rows found in the table.")
+        return
+
+    cropped_screenshot_path = output_path or Path(BASE_DIR, "template", f"cropped_{table_screenshot_file}")
+    cropped_screenshot_path.parent.mkdir(parents=True, exist_ok=True)
+    await page.screenshot(path=str(cropped_screenshot_path), clip=clip, full_page=True)
+    logger.info(f"Table screenshot cropped and saved to: {cropped_screenshot_path}")
+
+
+playwright_engine = PlaywrightEngine()
+atexit.register(playwright_engine.shutdown)
+
+
+def capture_element_or_table(site, timer, network_stats=None, report=None):
+    """
+    Capture elements or tables from a site with a configurable timer.
+
+    The site may be a SitePlan or a configuration dictionary, which is compiled first.
+    When the site has a 'block' policy, matching requests are blocked for the whole visit
+    and, if network_stats is a dictionary, it is filled with the requests and bytes saved.
+    Compose sites are rendered from report, a dictionary with 'boxes', 'comments' and 'palette'.
+
+    Returns:
+    - True if all operations succeed.
+    - False if any operation fails.
+    """
+    plan = None
+    try:
+        plan = site if isinstance(site, SitePlan) else compile_site(site)
+
+        # Log the compiled site plan
+        logger.debug(f"Processing site: {plan}")
+
+        if plan.steps == (STEP_COMPOSE,):
+            ensure_capture_dirs()
+            return compose_site(plan, report) and reset_email_statuses()
+
+        if plan.steps[0] == STEP_WIDGET:
+            ensure_capture_dirs()
+            if render_widget_site(plan):
+                return reset_email_statuses()
+            if plan.fallback is None:
+                return False
+            logger.warning(f"Falling back to a browser capture of {plan.url}.")
+            plan = plan.fallback
+
+        # Resolve the URL first so snapshot problems surface before a browser is launched
+        url, offline = resolve_site_url(plan)
+        ensure_capture_dirs()
+
+        if not capture_with_engine(plan, url, offline, timer, network_stats):
+            return False
+
+        # 5. **After Processing Sites: Reset All Email Statuses to 'unsent'**
+        return reset_email_statuses()
     except Exception as e:
         logger.exception("An error occurred during capture_element_or_table.")
         # Optionally, log the site URL and other details here
-        log_path("Error site URL", site.get("url", "Unknown URL"))
+        log_path("Error site URL", plan.url if plan else "Unknown URL")
         return False
-    finally:
-        if 'driver' in locals():
-            driver.quit()
-            logger.debug("WebDriver closed.")
 
 
-@app.before_request
-def log_request_info():
+def ensure_capture_dirs():
+    """Create the screenshot and template directories captures write into."""
+    screenshot_dir = Path(BASE_DIR, "images")  # Path to save screenshots
+    log_path("screenshot_dir", screenshot_dir)
+    screenshot_dir.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
+
+    # Ensure 'template' directory exists
+    template_dir = Path(BASE_DIR, "template")
+    log_path("template_dir", template_dir)
+    template_dir.mkdir(parents=True, exist_ok=True)
+
+
+def reset_email_statuses():
+    """Reset every email's status to 'unsent' once new screenshots have been captured."""
+    logger.debug("Resetting all email statuses to 'unsent' after processing sites.")
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("UPDATE emails SET status = 'unsent'")
+        db.commit()
+        recipient_cache.apply(db, cursor.rowcount, status_all='unsent')
+        logger.info("All email statuses have been reset to 'unsent'.")
+        return True
+    except Exception as e:
+        logger.exception("Failed to reset email statuses after processing sites.")
+        return False
+
+
+def compose_site(plan, report):
     """
-    Logs incoming request information.
+    Render a compose plan with the run's boxes, comments and palette, and its optional 'assets_dir'.
+    Returns True on success.
     """
+    if report is None:
+        logger.error(f"No report data to compose {plan.url} with.")
+        return False
     try:
-        # Avoid logging sensitive endpoints or data
-        if request.endpoint in ['send_email', 'send_emails_from_db', 'add_email', 'add_emails']:
-            logger.debug(f"Received {request.method} request for {request.url}")
-            logger.debug(f"Request headers: {dict(request.headers)}")
-            # Do not log request body for sensitive endpoints
-            logger.debug("Request body: [REDACTED]")
-        else:
-            logger.debug(f"Received {request.method} request for {request.url}")
-            logger.debug(f"Request headers: {dict(request.headers)}")
-            logger.debug(f"Request body: {request.get_data(as_text=True)}")
+        compose_report(plan.full_screenshot_path, report['boxes'], report['comments'],
+                       report.get('palette', DEFAULT_PALETTE), load_report_layout(plan.layout),
+                       assets_dir=report.get('assets_dir'))
+        return True
     except Exception as e:
-        logger.exception("Failed to log request information.")
+        logger.exception(f"Failed to compose report {plan.url}.")
+        return False
 
 
-@app.after_request
-def log_response_info(response):
+def use_native_renderer(plans, generated_html_path):
     """
-    Logs outgoing response information.
+    Replace full-page screenshots of the generated report page with compose steps.
+    Plans that also want PDF/HTML output or other steps still need the browser and are kept.
+    """
+    return tuple(
+        replace(plan, steps=(STEP_COMPOSE,), block_patterns=())
+        if plan.steps == (STEP_FULL_PAGE,) and plan.output_formats == ('png',)
+        and Path(plan.url).name == generated_html_path.name
+        else plan
+        for plan in plans
+    )
+
+
+def use_widget_renderer(plans):
     """
+    Replace browser captures of local pages embedding a Tomorrow.io widget with widget steps,
+    keeping their screenshot and crop outputs. Widgets whose locations the forecast provider cannot
+    look up, and all other plans, are kept as they are, as are all plans when no provider is configured.
+    A converted plan keeps the browser plan as its fallback.
+    """
+    provider = get_forecast_provider()
+    if provider is None:
+        return tuple(plans)
+    converted = []
+    for plan in plans:
+        widget = None
+        if plan.steps in ((STEP_ELEMENT,), (STEP_ELEMENT, STEP_CROP)) and \
+                not plan.url.startswith(('http://', 'https://')):
+            page = Path(unquote(urlparse(plan.url).path)) if plan.url.startswith('file:') else Path(plan.url)
+            widget = parse_widget_embed(page) if page.suffix.lower() in ('.html', '.htm') else None
+        if widget is not None and not all(map(provider.accepts, widget.locations)):
+            logger.info(f"The forecast provider cannot look up the locations of {plan.url}; using the browser.")
+            widget = None
+        if widget is None:
+            converted.append(plan)
+            continue
+        logger.debug(f"Rendering the {widget.type} widget of {plan.url} natively.")
+        converted.append(replace(plan, steps=(STEP_WIDGET,) + plan.steps[1:], widget=widget, block_patterns=(),
+                                 fallback=plan))
+    return tuple(converted)
+
+
+def render_widget_site(plan):
+    """Draw a widget plan's panel to its screenshot file and cut its crops. Returns True on success."""
     try:
-        logger.debug(f"Response status: {response.status}")
-        logger.debug(f"Response headers: {dict(response.headers)}")
-        # To log response data, ensure it's not binary and not too large
-        if response.content_type.startswith('application/json'):
-            response_data = response.get_json()
-            logger.debug(f"Response body: {json.dumps(response_data)}")
-        else:
-            logger.debug("Response body: [Non-JSON Content]")
+        image = render_widget(plan.widget, plan.window_width)
+        plan.full_screenshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = plan.full_screenshot_path.with_name(plan.full_screenshot_path.name + '.tmp')
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, plan.full_screenshot_path)
+        frame_store.publish(plan.full_screenshot_path, image).release()
+        return crop_plan_regions(plan) if plan.crops else True
     except Exception as e:
-        logger.exception("Failed to log response information.")
-    return response
+        logger.exception(f"Failed to render the widget for {plan.url}.")
+        return False
+
+
+def select_browser_engine(plan):
+    """
+    Return the engine that will capture the plan: 'playwright' or 'selenium'.
+    'auto' plans use Playwright whenever it can be started here.
+    """
+    if plan.engine == 'auto':
+        return 'playwright' if playwright_engine.available() else 'selenium'
+    return plan.engine
+
+
+def capture_with_engine(plan, url, offline, timer, network_stats=None):
+    """
+    Run the plan's capture steps with its browser engine. An 'auto' plan that fails under
+    Playwright is retried once with Selenium, whose undetected Chrome gets past more bot checks.
+    """
+    if select_browser_engine(plan) == 'selenium':
+        return capture_with_selenium(plan, url, offline, timer, network_stats)
+    if playwright_engine.capture(plan, url, offline, timer, network_stats):
+        return True
+    if plan.engine == 'auto':
+        logger.warning(f"Playwright capture of {plan.url} failed; retrying with Selenium.")
+        return capture_with_selenium(plan, url, offline, timer, network_stats)
+    return False
+
+
+class CaptureCancelled(Exception):
+    """Raised inside a Selenium capture whose attempt has been abandoned."""
+
+
+class CaptureCancel:
+    """
+    Cancels a running Selenium capture. cancel() quits the capture's browser at once, which frees
+    its governor slot and ends any navigation or WebDriverWait it is blocked in; the capture also
+    checks the token between steps and during its waits.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._driver = None
+        self._closed = False
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            driver, self._driver = self._driver, None
+            self._closed = driver is not None
+        if driver is not None:
+            logger.info("Quitting the browser of an abandoned capture.")
+            close_driver(driver)
+
+    def attach(self, driver):
+        """Hand the capture's driver to the token. Returns False if the capture is already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._driver = driver
+            return True
+
+    def detach(self):
+        """Take the driver back when the capture ends. Returns False if cancel() has already closed it."""
+        with self._lock:
+            self._driver = None
+            return not self._closed
+
+    def sleep(self, seconds):
+        if self._event.wait(seconds):
+            raise CaptureCancelled()
+
+    def check(self):
+        if self._event.is_set():
+            raise CaptureCancelled()
+
+
+def capture_with_selenium(plan, url, offline, timer, network_stats=None, cancel=None):
+    """
+    Run the plan's capture steps in a dedicated undetected Chrome instance.
+    Returns True if every step succeeded, False otherwise, including when cancel (a CaptureCancel)
+    stops the capture.
+    """
+    cancel = cancel or CaptureCancel()
+    driver = None
+    try:
+        # Initialize WebDriver
+        driver = create_driver(plan.window_size, offline=offline, performance_log=bool(plan.block_patterns))
+        if not cancel.attach(driver):
+            raise CaptureCancelled()
+        if plan.block_patterns:
+            apply_resource_policy(driver, list(plan.block_patterns))
+
+        # Log URL
+        logger.debug(f"Navigating to URL: {url}")
+        driver.get(url)
+
+        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+        logger.debug("Page loaded successfully.")
+        cancel.sleep(timer)  # Wait for the page to load
+
+        screenshot_dir = Path(BASE_DIR, "images")
+
+        for step in plan.steps:
+            cancel.check()
+            # 1. Capture Full-Page Screenshot
+            if step == STEP_FULL_PAGE:
+                full_screenshot_path = plan.full_screenshot_path
+                log_path("full_screenshot_path", full_screenshot_path)
+
+                if "png" in plan.output_formats:
+                    if full_screenshot_path.exists():
+                        full_screenshot_path.unlink()
+                        logger.debug(f"Old file removed: {full_screenshot_path}")
+
+                    capture_full_page(driver, full_screenshot_path)
+
+                if plan.pdf_path is not None and not capture_pdf(driver, plan.pdf_path):
+                    return False
+
+                if plan.html_path is not None and not export_html(driver, plan.html_path):
+                    return False
+
+            # 2. Capture Element Screenshot
+            elif step == STEP_ELEMENT:
+                logger.debug(f"Capturing element with selector: {plan.div_selector}")
+                element = WebDriverWait(driver, 15).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, plan.div_selector))
+                )
+                driver.execute_script("arguments[0].scrollIntoView();", element)
+                logger.debug("Element scrolled into view.")
+                element_screenshot_path = plan.full_screenshot_path
+                log_path("element_screenshot_path", element_screenshot_path)
+
+                if element_screenshot_path.exists():
+                    element_screenshot_path.unlink()
+                    logger.debug(f"Old file removed: {element_screenshot_path}")
+
+                # Convert Path to string before passing to Selenium
+                element_screenshot_path_str = str(element_screenshot_path)
+                cancel.sleep(timer)  # Wait for the element to be in view
+                element.screenshot(element_screenshot_path_str)
+                logger.info(f"Element screenshot saved to: {element_screenshot_path_str}")
+
+            # 3. Perform Cropping
+            elif step == STEP_CROP:
+                if not crop_plan_regions(plan):
+                    return False
+
+            # 4. Capture Table Screenshot
+            elif step == STEP_TABLE:
+                logger.debug(f"Capturing table with selector: {plan.table_selector}")
+                table_screenshot_path = screenshot_dir / plan.table_screenshot_file
+                log_path("table_screenshot_path", table_screenshot_path)
+
+                if table_screenshot_path.exists():
+                    table_screenshot_path.unlink()
+                    logger.debug(f"Old file removed: {table_screenshot_path}")
+
+                capture_table(
+                    driver,
+                    plan.table_selector,
+                    plan.table_screenshot_file,
+                    timer=timer,
+                    rows_to_capture=plan.rows_to_capture,
+                    output_path=plan.table_output_path
+                )
+                logger.info(f"Table screenshot saved to: {table_screenshot_path}")
+
+        return True
+    except Exception as e:
+        if cancel.cancelled:
+            logger.info(f"Selenium capture of {plan.url} stopped: its attempt was abandoned.")
+        else:
+            logger.exception(f"Selenium capture of {plan.url} failed.")
+        return False
+    finally:
+        if driver is not None and cancel.detach():
+            if plan.block_patterns and network_stats is not None:
+                try:
+                    network_stats.update(collect_network_stats(driver))
+                    logger.info(f"Resource policy for {plan.url}: {network_stats}")
+                except Exception as e:
+                    logger.exception("Failed to collect network statistics.")
+            close_driver(driver)
+
+
+def crop_plan_regions(plan):
+    """Cut the plan's crop regions out of its full screenshot. Returns False if the screenshot is missing."""
+    log_path("full_screenshot_path for cropping", plan.full_screenshot_path)
+    if not plan.full_screenshot_path.exists():
+        logger.error(f"Error: Image path {plan.full_screenshot_path} does not exist.")
+        return False
+
+    logger.debug("Starting cropping process...")
+    crop_image_with_percentage(
+        plan.full_screenshot_path,
+        [crop.as_tuple() for crop in plan.crops],
+        [crop.output_path for crop in plan.crops],
+        validated=True
+    )
+    return True
+
+
+def plan_output_paths(plan):
+    """Every file a plan's capture writes, used to decide which plans may run at the same time."""
+    paths = {plan.full_screenshot_path, plan.pdf_path, plan.html_path}
+    paths.add(plan.table_output_path)
+    paths.update(crop.output_path for crop in plan.crops)
+    paths.discard(None)
+    return paths
+
+
+def local_page_path(url):
+    """Return the file a site URL points at when it is a local page, or None for a web URL."""
+    if url.startswith('file://'):
+        return Path(unquote(urlparse(url).path))
+    if re.match(r'[A-Za-z][A-Za-z0-9+.-]+:', url) and not re.match(r'[A-Za-z]:[\\/]', url):
+        return None  # http(s), snapshot, widget: and compose: URLs; drive letters are paths
+    return Path(url)
+
+
+def plan_input_paths(plan):
+    """
+    Every local file a plan's capture reads, as absolute paths: a local page and the images,
+    stylesheets and scripts it references, such as the crops the generated report template embeds.
+    Used with plan_output_paths so a page is not captured while the files it shows are still being written.
+    """
+    if plan.steps[0] in (STEP_WIDGET, STEP_COMPOSE):
+        return set()
+    page = local_page_path(plan.url)
+    if page is None:
+        return set()
+    page = Path(os.path.abspath(page))
+    paths = {page}
+    try:
+        text = page.read_text(encoding='utf-8', errors='replace')
+    except OSError:
+        return paths
+    for pattern in (_HTML_ASSET_PATTERN, _CSS_URL_PATTERN):
+        for match in pattern.finditer(text):
+            reference = match.group(2).strip()
+            if reference.startswith(('data:', '//')) or re.match(r'[A-Za-z][A-Za-z0-9+.-]+:', reference):
+                continue
+            paths.add(Path(os.path.abspath(page.parent / unquote(reference.split('?', 1)[0]))))
+    return paths
+
+
+def is_generated_page(plan):
+    """
+    Return True for a capture of a local page under template/, where the generated report pages live.
+    Such pages show other sites' captures, including any that scripts load and plan_input_paths cannot see.
+    """
+    if plan.steps[0] in (STEP_WIDGET, STEP_COMPOSE):
+        return False
+    page = local_page_path(plan.url)
+    if page is None:
+        return False
+    template_dir = os.path.abspath(Path(BASE_DIR, "template"))
+    return os.path.abspath(page).startswith(template_dir + os.sep)
+
+
+# Capture resilience: hedged attempts for slow sites and per-host circuit breakers
+HEDGE_LATENCY_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 5  # Successful captures of a site needed before its latency percentile is trusted
+CAPTURE_LATENCY_HISTORY = 50
+CIRCUIT_FAILURE_THRESHOLD = 3  # Consecutive failed captures that open a host's breaker
+CIRCUIT_RESET_TIMEOUT = 300  # Seconds an open breaker waits before letting one trial capture through
+CAPTURE_STAGING_DIR = Path(BASE_DIR, 'images', 'staging')
+
+# Outcome statuses that fail a site in a capture run
+FAILED_CAPTURE_STATUSES = ('failed', 'timeout')
+
+# Selenium attempts run here; once started they cannot be interrupted, only abandoned
+selenium_executor = ThreadPoolExecutor(max_workers=BROWSER_MAX_CONCURRENT * 2, thread_name_prefix='selenium-capture')
+
+
+class CircuitBreaker:
+    """
+    Failure tracker for one host. Opens after failure_threshold consecutive failures so the host's
+    sites are skipped, and after reset_timeout lets a single trial capture through (half-open):
+    success closes it again, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self, now):
+        if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            return True
+        return self.state == 'closed'
+
+    def record(self, success, now):
+        if success:
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = now
+
+    def snapshot(self, now):
+        retry_in = None
+        if self.state == 'open':
+            retry_in = round(max(0.0, self.reset_timeout - (now - self.opened_at)), 1)
+        return {"state": self.state, "failures": self.failures, "retry_in_s": retry_in}
+
+
+class CaptureHealth:
+    """
+    Per-site latencies of successful captures, used to decide when to hedge, and per-host
+    circuit breakers. Shared by every capture run in the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}  # site url -> deque of attempt durations in seconds
+        self._breakers = {}  # hostname -> CircuitBreaker
+        self.counters = {"sites": 0, "hedges": 0, "hedge_wins": 0, "retries": 0, "timeouts": 0, "short_circuits": 0}
+
+    @staticmethod
+    def host(plan):
+        """Breaker key of a plan; local files and snapshots have none and are never skipped."""
+        hostname = urlparse(plan.url).hostname
+        return None if hostname in (None, 'localhost', '127.0.0.1') else hostname
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def hedge_delay(self, plan):
+        """Seconds after which a capture of the plan is hedged, or None until enough captures were seen."""
+        with self._lock:
+            samples = sorted(self._latencies.get(plan.url, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[math.ceil(len(samples) * HEDGE_LATENCY_PERCENTILE) - 1]
+
+    def allow(self, plan):
+        """False if the plan's host breaker is open and the site should be skipped."""
+        host = self.host(plan)
+        with self._lock:
+            self.counters["sites"] += 1
+            if host is None:
+                return True
+            allowed = self._breakers.setdefault(host, CircuitBreaker()).allow(time.monotonic())
+            if not allowed:
+                self.counters["short_circuits"] += 1
+            return allowed
+
+    def record(self, plan, success, duration=None):
+        host = self.host(plan)
+        with self._lock:
+            if success and duration is not None:
+                self._latencies.setdefault(plan.url, deque(maxlen=CAPTURE_LATENCY_HISTORY)).append(duration)
+            if host is not None:
+                self._breakers.setdefault(host, CircuitBreaker()).record(success, time.monotonic())
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            latencies = {url: list(samples) for url, samples in self._latencies.items()}
+            return {
+                "counters": dict(self.counters),
+                "breakers": {host: breaker.snapshot(now) for host, breaker in self._breakers.items()},
+                "latency_s": {
+                    url: {"samples": len(samples), "p50": round(sorted(samples)[len(samples) // 2], 2)}
+                    for url, samples in latencies.items()
+                },
+            }
+
+
+capture_health = CaptureHealth()
+
+
+def stage_plan(plan, stage_dir):
+    """
+    Return a copy of the plan that writes every output under stage_dir, and a {staged: final} mapping.
+    Attempts write staged files, so a failed, timed-out or losing attempt never touches the last good artifacts.
+    """
+    outputs = {}
+
+    def staged(path):
+        if path is None:
+            return None
+        staged_path = stage_dir / f"{len(outputs)}_{path.name}"
+        outputs[staged_path] = path
+        return staged_path
+
+    staged_plan = replace(
+        plan,
+        full_screenshot_path=staged(plan.full_screenshot_path),
+        pdf_path=staged(plan.pdf_path),
+        html_path=staged(plan.html_path),
+        table_output_path=staged(plan.table_output_path),
+        crops=tuple(replace(crop, output_path=staged(crop.output_path)) for crop in plan.crops),
+    )
+    return staged_plan, outputs
+
+
+class CaptureAttempt:
+    """One staged capture of a plan with a given engine, running in the background."""
+
+    def __init__(self, plan, url, offline, timer, engine, timeout, hedge=False):
+        self.engine = engine
+        self.hedge = hedge
+        self.network_stats = {}
+        self.stage_dir = CAPTURE_STAGING_DIR / uuid.uuid4().hex
+        self.stage_dir.mkdir(parents=True)
+        self.plan, self.outputs = stage_plan(plan, self.stage_dir)
+        self.started = time.monotonic()
+        self.finished = None
+        self.cancel = None
+        if engine == 'playwright':
+            self.future = playwright_engine.submit(self.plan, url, offline, timer, self.network_stats, timeout)
+        else:
+            self.cancel = CaptureCancel()
+            self.future = selenium_executor.submit(
+                capture_with_selenium, self.plan, url, offline, timer, self.network_stats, self.cancel)
+        self.future.add_done_callback(self._mark_finished)
+
+    def _mark_finished(self, future):
+        self.finished = time.monotonic()
+
+    @property
+    def duration(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def succeeded(self):
+        return self.future.done() and not self.future.cancelled() and self.future.result()
+
+    def commit(self):
+        """Move the staged files over the live outputs."""
+        for staged_path, final_path in self.outputs.items():
+            if staged_path.exists():
+                final_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged_path, final_path)
+                frame_store.move(staged_path, final_path)
+        self._discard_files()
+
+    def _discard_files(self, future=None):
+        for staged_path in self.outputs:
+            frame_store.discard(staged_path)
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+
+    def abandon(self):
+        """
+        Cancel the attempt if it is still running and discard its files once it stops. A running
+        Selenium attempt has its browser quit in the background, so the slot is free for other sites.
+        """
+        if not self.future.cancel() and self.cancel is not None and not self.future.done():
+            threading.Thread(target=self.cancel.cancel, name="capture-cancel", daemon=True).start()
+        self.future.add_done_callback(self._discard_files)
+
+
+def _site_outcome(plan, status, **fields):
+    outcome = {"url": plan.url, "status": status, "engine": None, "attempts": 0, "hedged": False,
+               "elapsed_ms": 0, "stale": False}
+    outcome.update(fields)
+    return outcome
+
+
+def capture_site_resilient(plan, url, offline, timer):
+    """
+    Capture a plan within its deadline. Returns (outcome, network_stats).
+
+    - An open circuit breaker for the plan's host skips the site; its last good artifacts stay in place.
+    - Every attempt writes to a staging directory and only a successful one replaces the outputs.
+    - An attempt still running past the site's p90 latency gets a hedged twin on the same engine;
+      the first to succeed wins and the other is cancelled, quitting its browser under Selenium.
+    - A failed attempt is retried once within the remaining budget; 'auto' plans retry with Selenium.
+
+    The outcome's status is 'captured', 'skipped', 'failed' or 'timeout'; 'stale' tells whether
+    artifacts from an earlier run are being kept in place of this one's.
+    """
+    start = time.monotonic()
+    deadline = start + plan.deadline
+    if not capture_health.allow(plan):
+        logger.warning(f"Circuit open for {CaptureHealth.host(plan)}; skipping {plan.url}.")
+        return _site_outcome(plan, 'skipped', stale=all(path.exists() for path in plan_output_paths(plan))), {}
+
+    primary = select_browser_engine(plan)
+    hedge_after = capture_health.hedge_delay(plan) if plan.hedge else None
+    outcome = _site_outcome(plan, 'failed')
+    winner = None
+    timed_out = False
+    try:
+        for engine in (primary, 'selenium' if plan.engine == 'auto' else primary):
+            if outcome["attempts"]:
+                logger.warning(f"Capture of {plan.url} failed; retrying with {engine}.")
+                capture_health.count("retries")
+            attempts = [CaptureAttempt(plan, url, offline, timer, engine, deadline - time.monotonic())]
+            outcome["attempts"] += 1
+
+            while winner is None:
+                pending = [attempt for attempt in attempts if not attempt.future.done()]
+                winner = next((attempt for attempt in attempts if attempt.succeeded()), None)
+                remaining = deadline - time.monotonic()
+                if winner is not None or not pending:
+                    break
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                can_hedge = hedge_after is not None and len(attempts) == 1
+                timeout = min(remaining, max(0.0, hedge_after - attempts[0].duration)) if can_hedge else remaining
+                wait([attempt.future for attempt in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+                if can_hedge and not attempts[0].future.done() and attempts[0].duration >= hedge_after:
+                    logger.info(f"Capture of {plan.url} passed its p90 of {hedge_after:.1f} s; hedging.")
+                    capture_health.count("hedges")
+                    attempts.append(CaptureAttempt(
+                        plan, url, offline, timer, engine, deadline - time.monotonic(), hedge=True))
+                    outcome["attempts"] += 1
+                    outcome["hedged"] = True
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.abandon()
+            if winner is not None or timed_out or deadline <= time.monotonic():
+                timed_out = winner is None
+                break
+
+        if winner is not None:
+            winner.commit()
+            capture_health.record(plan, True, winner.duration)
+            if winner.hedge:
+                capture_health.count("hedge_wins")
+            outcome.update(status='captured', engine=winner.engine)
+            return outcome, winner.network_stats
+    except Exception as e:
+        logger.exception(f"Resilient capture of {plan.url} failed.")
+    finally:
+        outcome["elapsed_ms"] = round((time.monotonic() - start) * 1000)
+
+    capture_health.record(plan, False)
+    if timed_out:
+        capture_health.count("timeouts")
+        logger.error(f"Capture of {plan.url} exceeded its {plan.deadline:g} s deadline.")
+        outcome["status"] = 'timeout'
+    outcome["stale"] = all(path.exists() for path in plan_output_paths(plan))
+    return outcome, {}
+
+
+def capture_sites(plans, timer, report=None):
+    """
+    Capture every plan within its deadline and reset the email statuses once at the end.
+
+    Sites are captured concurrently through capture_site_resilient, except that a plan waits for every
+    earlier plan it conflicts with, keeping the original order: one writing a file the plan reads or
+    writes, or one reading a file the plan writes (see plan_input_paths). Captures of generated
+    pages run after every other site, and compose plans are rendered from report last, once the
+    crops they lay out have been captured.
+    Returns (failed_urls, resource_savings, outcomes) with one outcome dictionary per plan, in order.
+    """
+    resource_savings = {}
+    outcomes = [None] * len(plans)
+    run_started = time.time()
+    ensure_capture_dirs()
+
+    # Group plans into waves; a plan joins the wave after the last one it conflicts with, and
+    # generated pages start a wave after all of the sites
+    site_indexes = [index for index, plan in enumerate(plans) if plan.steps != (STEP_COMPOSE,)]
+    page_indexes = [index for index in site_indexes if is_generated_page(plans[index])]
+    site_indexes = [index for index in site_indexes if index not in page_indexes]
+    waves = []
+    wave_outputs = []
+    wave_inputs = []
+    first_page_wave = None
+    for index in site_indexes + page_indexes:
+        plan = plans[index]
+        if first_page_wave is None and index in page_indexes:
+            first_page_wave = len(waves)
+        outputs = {Path(os.path.abspath(path)) for path in plan_output_paths(plan)}
+        inputs = plan_input_paths(plan)
+        wave = max([first_page_wave or 0] + [i + 1 for i, (written, read) in enumerate(zip(wave_outputs, wave_inputs))
+                                             if outputs & (written | read) or inputs & written])
+        if wave == len(waves):
+            waves.append([])
+            wave_outputs.append(set())
+            wave_inputs.append(set())
+        waves[wave].append(index)
+        wave_outputs[wave] |= outputs
+        wave_inputs[wave] |= inputs
+
+    def capture(index):
+        plan = plans[index]
+        if plan.steps[0] == STEP_WIDGET:
+            start = time.monotonic()
+            rendered = render_widget_site(plan)
+            if rendered or plan.fallback is None:
+                return _site_outcome(plan, 'captured' if rendered else 'failed', engine='widget', attempts=1,
+                                     elapsed_ms=round((time.monotonic() - start) * 1000)), {}
+            logger.warning(f"Falling back to a browser capture of {plan.url}.")
+            plan = plan.fallback
+        try:
+            url, offline = resolve_site_url(plan)
+        except Exception as e:
+            logger.exception(f"Failed to resolve {plan.url}.")
+            return _site_outcome(plan, 'failed'), {}
+        return capture_site_resilient(plan, url, offline, timer)
+
+    with ThreadPoolExecutor(max_workers=BROWSER_MAX_CONCURRENT, thread_name_prefix='site-capture') as executor:
+        for wave in waves:
+            for index, (outcome, network_stats) in zip(wave, executor.map(capture, wave)):
+                outcomes[index] = outcome
+                if network_stats:
+                    resource_savings[plans[index].url] = network_stats
+
+    for index, plan in enumerate(plans):
+        if plan.steps == (STEP_COMPOSE,):
+            start = time.monotonic()
+            composed = compose_site(plan, report)
+            outcomes[index] = _site_outcome(plan, 'captured' if composed else 'failed', engine='compose', attempts=1,
+                                            elapsed_ms=round((time.monotonic() - start) * 1000))
+
+    # A skipped site only fails the run when there is nothing from an earlier run to fall back on
+    failed_sites = [
+        outcome["url"] for outcome in outcomes
+        if outcome["status"] in FAILED_CAPTURE_STATUSES or (outcome["status"] == 'skipped' and not outcome["stale"])
+    ]
+
+    # Like capture_element_or_table, a site only counts as processed once the statuses are reset
+    if len(failed_sites) < len(plans) and not reset_email_statuses():
+        failed_sites = [plan.url for plan in plans]
+    else:
+        archive_capture_run(plans, outcomes, run_started)
+    return failed_sites, resource_savings, outcomes
+
+
+# Capture history. Every captured artifact is kept in a content-addressed archive so past reports
+# can be fetched and played back. Images are split into bands of rows and other files at line
+# boundaries, and each chunk is stored once, so the archive only grows by what actually changed.
+HISTORY_DIR = Path(BASE_DIR, 'history')
+HISTORY_BAND_ROWS = 32  # Image rows per chunk; a changed pixel only costs the band it falls in
+HISTORY_CHUNK_MIN = 2 * 1024
+HISTORY_CHUNK_MAX = 64 * 1024
+HISTORY_CHUNK_MASK = 0x3f  # A line whose CRC has these bits clear ends a chunk, about every 64 lines
+HISTORY_IMAGE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+HISTORY_TIMELAPSE_FORMATS = {'gif': 'image/gif', 'webp': 'image/webp'}
+HISTORY_TIMELAPSE_MAX_FRAMES = 240
+HISTORY_TIMELAPSE_WIDTH = 800  # Default frame width; larger captures are scaled down to it
+HISTORY_TIMELAPSE_MAX_BYTES = 256 * 1024 * 1024  # Decoded frames held at once; longer ranges are sampled more sparsely
+HISTORY_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')  # Archived as pixel bands, served back as PNG
+HISTORY_MIMETYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp',
+    '.pdf': 'application/pdf', '.html': 'text/html', '.htm': 'text/html', '.json': 'application/json',
+}
+
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='capture-archive')
+
+
+def _line_chunks(data):
+    """
+    Split bytes into content-defined chunks that end on line boundaries, so an edit early in a
+    file only changes the chunks around it instead of shifting every chunk after it.
+    """
+    chunk = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        chunk.append(line)
+        size += len(line)
+        if size >= HISTORY_CHUNK_MAX or (size >= HISTORY_CHUNK_MIN and not zlib.crc32(line) & HISTORY_CHUNK_MASK):
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+class CaptureArchive:
+    """
+    Content-addressed, chunk-deduplicated history of captured artifacts.
+
+    Chunks are stored zlib-compressed once under chunks/<hash[:2]>/<hash>. An artifact is the ordered
+    list of its chunk hashes, keyed by the SHA-256 of the original file, and history.db indexes which
+    artifact each run captured for each site and file. Images are archived as pixels and come back as
+    pixel-identical PNGs.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunks_dir = self.root / 'chunks'
+        self.db_path = self.root / 'history.db'
+        self._schema_ready = False
+
+    def connect(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.db_path), timeout=30)
+        db.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL,
+                    finished_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    hash TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    mode TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    size INTEGER NOT NULL,
+                    chunks BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    hash BLOB PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    stored INTEGER NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS captures (
+                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                    site TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    artifact TEXT NOT NULL REFERENCES artifacts(hash),
+                    captured_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, name)
+                );
+                CREATE INDEX IF NOT EXISTS idx_captures_name_time ON captures (name, captured_at);
+                CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started_at);
+            ''')
+            self._schema_ready = True
+        return db
+
+    def chunk_path(self, chunk_hash):
+        name = chunk_hash.hex()
+        return self.chunks_dir / name[:2] / name
+
+    def _put_chunk(self, db, chunk):
+        chunk_hash = hashlib.sha256(chunk).digest()
+        exists = db.execute("SELECT 1 FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone()
+        if exists is None:
+            body = zlib.compress(chunk, 6)
+            path = self.chunk_path(chunk_hash)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            tmp_path.write_bytes(body)
+            os.replace(tmp_path, path)
+            db.execute("INSERT INTO chunks (hash, size, stored) VALUES (?, ?, ?)", (chunk_hash, len(chunk), len(body)))
+        return chunk_hash
+
+    def _read_chunks(self, chunk_hashes):
+        return b''.join(zlib.decompress(self.chunk_path(chunk_hashes[i:i + 32]).read_bytes())
+                        for i in range(0, len(chunk_hashes), 32))
+
+    def put_artifact(self, db, name, data, frame=None):
+        """
+        Store one artifact's chunks and return its hash; an artifact seen before costs nothing.
+        frame is the image's shared frame, when a capture stage has already decoded it.
+        """
+        artifact_hash = hashlib.sha256(data).hexdigest()
+        if db.execute("SELECT 1 FROM artifacts WHERE hash = ?", (artifact_hash,)).fetchone():
+            return artifact_hash
+
+        kind, mode, width, height, chunks = 'bytes', None, None, None, None
+        if Path(name).suffix.lower() in HISTORY_IMAGE_EXTENSIONS:
+            try:
+                with frame.restore_mode(frame.image()) if frame is not None else Image.open(BytesIO(data)) as image:
+                    if image.mode not in HISTORY_IMAGE_MODES:
+                        image = image.convert('RGBA')
+                    kind, mode, (width, height) = 'image', image.mode, image.size
+                    pixels = memoryview(image.tobytes())
+                band = width * len(mode) * HISTORY_BAND_ROWS
+                chunks = (pixels[i:i + band] for i in range(0, len(pixels), band))
+            except Exception as e:
+                logger.warning(f"Archiving {name} as raw bytes; it could not be decoded as an image: {e}")
+                kind, mode, width, height = 'bytes', None, None, None
+        if kind == 'bytes':
+            chunks = _line_chunks(data)
+
+        chunk_hashes = b''.join(self._put_chunk(db, chunk) for chunk in chunks)
+        db.execute(
+            "INSERT INTO artifacts (hash, kind, mode, width, height, size, chunks) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (artifact_hash, kind, mode, width, height, len(data), chunk_hashes)
+        )
+        return artifact_hash
+
+    def record_run(self, started_at, finished_at, artifacts):
+        """Archive one capture run; artifacts is a list of (site_url, name, file bytes, shared frame or None)."""
+        db = self.connect()
+        try:
+            cursor = db.execute("INSERT INTO runs (started_at, finished_at) VALUES (?, ?)", (started_at, finished_at))
+            run_id = cursor.lastrowid
+            for site, name, data, frame in artifacts:
+                artifact_hash = self.put_artifact(db, name, data, frame)
+                db.execute(
+                    "INSERT OR REPLACE INTO captures (run_id, site, name, artifact, captured_at) VALUES (?, ?, ?, ?, ?)",
+                    (run_id, site, name, artifact_hash, finished_at)
+                )
+            db.commit()
+            logger.info(f"Archived capture run {run_id} with {len(artifacts)} artifact(s).")
+            return run_id
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def load_image(self, artifact_hash, db=None):
+        """Rebuild an archived image artifact as a PIL image. Returns None if it is not an image."""
+        own_db = db is None
+        db = self.connect() if own_db else db
+        try:
+            row = db.execute("SELECT * FROM artifacts WHERE hash = ?", (artifact_hash,)).fetchone()
+        finally:
+            if own_db:
+                db.close()
+        if row is None or row["kind"] != 'image':
+            return None
+        return Image.frombytes(row["mode"], (row["width"], row["height"]), self._read_chunks(row["chunks"]))
+
+    def load(self, artifact_hash):
+        """Return (body, kind) for an archived artifact, or None if it is unknown."""
+        db = self.connect()
+        try:
+            row = db.execute("SELECT kind, chunks FROM artifacts WHERE hash = ?", (artifact_hash,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        if row["kind"] != 'image':
+            return self._read_chunks(row["chunks"]), row["kind"]
+        buffer = BytesIO()
+        self.load_image(artifact_hash).save(buffer, format='PNG', compress_level=6)
+        return buffer.getvalue(), row["kind"]
+
+    def runs(self, since=None, until=None, limit=50):
+        """Return the runs started in [since, until], newest first, each with what it captured."""
+        db = self.connect()
+        try:
+            runs = [dict(row) for row in db.execute(
+                "SELECT id, started_at, finished_at FROM runs WHERE started_at >= ? AND started_at <= ? "
+                "ORDER BY started_at DESC LIMIT ?",
+                (since if since is not None else 0, until if until is not None else math.inf, limit)
+            )]
+            for run in runs:
+                run["artifacts"] = [dict(row) for row in db.execute(
+                    "SELECT site, name, artifact FROM captures WHERE run_id = ? ORDER BY name", (run["id"],)
+                )]
+            return runs
+        finally:
+            db.close()
+
+    def version_at(self, name, at):
+        """Return the capture of name that was current at time at, or None."""
+        db = self.connect()
+        try:
+            row = db.execute(
+                "SELECT run_id, site, artifact, captured_at FROM captures WHERE name = ? AND captured_at <= ? "
+                "ORDER BY captured_at DESC LIMIT 1",
+                (name, at)
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            db.close()
+
+    def versions(self, name, since=None, until=None):
+        """Return the captures of name in [since, until] oldest first, dropping repeats of an unchanged artifact."""
+        db = self.connect()
+        try:
+            rows = db.execute(
+                "SELECT artifact, captured_at FROM captures WHERE name = ? AND captured_at >= ? AND captured_at <= ? "
+                "ORDER BY captured_at",
+                (name, since if since is not None else 0, until if until is not None else math.inf)
+            ).fetchall()
+        finally:
+            db.close()
+        versions = []
+        for row in rows:
+            if not versions or versions[-1]["artifact"] != row["artifact"]:
+                versions.append(dict(row))
+        return versions
+
+    def timelapse(self, name, since=None, until=None, fps=2.0, width=HISTORY_TIMELAPSE_WIDTH, image_format='gif'):
+        """
+        Render the changes to an image artifact over a time range as an animated GIF or WebP.
+        Frames are scaled down to width, and the range is sampled evenly so that at most
+        HISTORY_TIMELAPSE_MAX_FRAMES frames, and HISTORY_TIMELAPSE_MAX_BYTES of decoded frames, are held.
+        Returns the encoded bytes, or None if the range holds no archived images of name.
+        """
+        def sample(items, count):
+            if len(items) <= count:
+                return items
+            if count <= 0:
+                return []
+            step = len(items) / count
+            return [items[int(i * step)] for i in range(count)]
+
+        versions = sample(self.versions(name, since, until), HISTORY_TIMELAPSE_MAX_FRAMES)
+
+        frames = []
+        db = self.connect()
+        try:
+            index = 0
+            while index < len(versions):
+                frame = self.load_image(versions[index]["artifact"], db)
+                index += 1
+                if frame is None:
+                    continue
+                frame = frame.convert('RGB')
+                if frames:
+                    if frame.size != frames[0].size:
+                        frame = frame.resize(frames[0].size, Image.Resampling.LANCZOS)
+                else:
+                    if width and frame.width > width:
+                        frame = frame.resize((width, round(frame.height * width / frame.width)),
+                                             Image.Resampling.LANCZOS)
+                    # Every frame has the first one's size, so the budget fixes how many can be kept
+                    budget = max(1, HISTORY_TIMELAPSE_MAX_BYTES // (frame.width * frame.height * 3))
+                    versions = versions[:index] + sample(versions[index:], budget - 1)
+                frames.append(frame)
+        finally:
+            db.close()
+        if not frames:
+            return None
+
+        buffer = BytesIO()
+        frames[0].save(buffer, format=image_format.upper(), save_all=True, append_images=frames[1:],
+                       duration=round(1000 / fps), loop=0)
+        return buffer.getvalue()
+
+    def stats(self):
+        db = self.connect()
+        try:
+            chunks = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored), 0) FROM chunks").fetchone()
+            logical = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(a.size), 0) FROM captures c JOIN artifacts a ON a.hash = c.artifact"
+            ).fetchone()
+            runs = db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+            artifacts = db.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+        finally:
+            db.close()
+        return {
+            "runs": runs,
+            "captures": logical[0],
+            "artifacts": artifacts,
+            "chunks": chunks[0],
+            "captured_bytes": logical[1],
+            "chunk_bytes": chunks[1],
+            "stored_bytes": chunks[2],
+            "dedup_ratio": round(logical[1] / chunks[2], 2) if chunks[2] else None,
+        }
+
+
+capture_archive = CaptureArchive(HISTORY_DIR)
+
+
+def archive_capture_run(plans, outcomes, started_at):
+    """
+    Queue the files written by the captured sites of a run for archiving.
+
+    The files are read now, before a later run can overwrite them, and chunked on the archive thread
+    so the capture response is not held up. Decoded frames of the images are held until then, so
+    archiving does not decode them again.
+    """
+    artifacts = []
+    for plan, outcome in zip(plans, outcomes):
+        if outcome["status"] != 'captured':
+            continue
+        for path in sorted(plan_output_paths(plan)):
+            try:
+                artifacts.append((plan.url, path.relative_to(BASE_DIR).as_posix(), path.read_bytes(),
+                                  frame_store.acquire(path)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Not archiving {path}: {e}")
+    if not artifacts:
+        return None
+
+    def record():
+        try:
+            return capture_archive.record_run(started_at, time.time(), artifacts)
+        except Exception as e:
+            logger.exception("Failed to archive the capture run.")
+            return None
+        finally:
+            for artifact in artifacts:
+                if artifact[3] is not None:
+                    artifact[3].release()
+
+    return archive_executor.submit(record)
+
+
+def parse_history_time(value):
+    """Parse a history query time given as epoch seconds or an ISO 8601 string. Returns None for None."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+# On-demand profiling. A request carrying PROFILE_HEADER, or one of the next N requests or capture jobs
+# armed through /debug/profile, is profiled; the output is kept in a bounded ring under PROFILE_DIR.
+PROFILE_DIR = Path(BASE_DIR, 'profiles')
+PROFILE_RING_SIZE = 20
+PROFILE_HEADER = 'X-Profile'
+PROFILE_MODES = ('cprofile', 'sampling')
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_TARGETS = ('requests', 'captures')
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread at a fixed interval, so work spread over capture worker
+    threads and the Playwright loop is seen too. Output is wall-clock folded stacks
+    ("thread;frame;frame count"), readable by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    """One running profile: cProfile (pstats output) or SamplingProfiler (folded stacks)."""
+
+    def __init__(self, label, mode):
+        self.label = re.sub(r'[^A-Za-z0-9_-]', '_', label)
+        self.mode = mode
+        self.started = datetime.now()
+        if mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = SamplingProfiler()
+            self._profiler.start()
+
+    def stop(self, directory):
+        """Stop profiling and write the output into directory. Returns its path."""
+        extension = 'pstats' if self.mode == 'cprofile' else 'folded'
+        path = Path(directory, f"{self.started:%Y%m%d-%H%M%S-%f}-{self.label}.{extension}")
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            self._profiler.dump_stats(str(path))
+        else:
+            self._profiler.stop()
+            self._profiler.dump(path)
+        return path
+
+
+class ProfileManager:
+    """
+    Arms profiling for the next N requests or capture jobs and stores finished profiles.
+
+    Only one cProfile session runs at a time (from Python 3.12 it observes every thread and
+    cannot be nested); a request that would start a second one is served unprofiled.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, ring_size=PROFILE_RING_SIZE):
+        self.directory = Path(directory)
+        self.ring_size = ring_size
+        self._lock = threading.Lock()
+        self.armed = {target: 0 for target in PROFILE_TARGETS}
+        self.modes = {"requests": 'cprofile', "captures": 'sampling'}
+        self._cprofile_active = False
+
+    def arm(self, target, count, mode=None):
+        with self._lock:
+            self.armed[target] = count
+            if mode is not None:
+                self.modes[target] = mode
+
+    def claim(self, target):
+        """Take one armed slot for the target. Returns the profiling mode, or None if nothing is armed."""
+        with self._lock:
+            if self.armed[target] <= 0:
+                return None
+            self.armed[target] -= 1
+            return self.modes[target]
+
+    def start(self, label, mode):
+        if mode == 'cprofile':
+            with self._lock:
+                if self._cprofile_active:
+                    logger.warning(f"A cProfile session is already running; not profiling {label}.")
+                    return None
+                self._cprofile_active = True
+        try:
+            return ProfileSession(label, mode)
+        except Exception as e:
+            logger.exception(f"Failed to start profiling {label}.")
+            if mode == 'cprofile':
+                self._cprofile_active = False
+            return None
+
+    def finish(self, session):
+        """Stop a session, store its output and trim the ring. Returns the output path or None."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = session.stop(self.directory)
+            logger.info(f"Profile of {session.label} saved to: {path}")
+            self._prune()
+            return path
+        except Exception as e:
+            logger.exception(f"Failed to save the profile of {session.label}.")
+            return None
+        finally:
+            if session.mode == 'cprofile':
+                self._cprofile_active = False
+
+    @contextmanager
+    def job(self, target, label):
+        """Profile the enclosed block if the target has an armed slot."""
+        mode = self.claim(target)
+        session = self.start(label, mode) if mode else None
+        try:
+            yield session
+        finally:
+            if session is not None:
+                self.finish(session)
+
+    def _prune(self):
+        entries = sorted((entry for entry in self.directory.iterdir() if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:-self.ring_size]:
+            entry.unlink()
+            logger.debug(f"Evicted profile: {entry}")
+
+    def profiles(self):
+        if not self.directory.is_dir():
+            return []
+        entries = sorted((entry for entry in self.directory.iterdir() if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [{"name": entry.name, "bytes": entry.stat().st_size,
+                 "created": datetime.fromtimestamp(entry.stat().st_mtime).isoformat(timespec='seconds')}
+                for entry in entries]
+
+
+profiler = ProfileManager()
+
+
+@app.before_request
+def start_request_profile():
+    """
+    Start timing the request and, when asked for through PROFILE_HEADER or an armed slot, profiling it.
+    The header value picks the mode; any other value uses cProfile.
+    """
+    g.request_started = time.perf_counter()
+    requested = request.headers.get(PROFILE_HEADER)
+    mode = (requested if requested in PROFILE_MODES else 'cprofile') if requested else profiler.claim('requests')
+    if mode:
+        g.profile = profiler.start(f"{request.method}-{request.endpoint or 'unknown'}", mode)
+
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Add a Server-Timing header with the request's total time, the phases recorded through
+    server_timing and, for profiled requests, the name of the stored profile.
+    """
+    try:
+        metrics = [f"app;dur={(time.perf_counter() - g.request_started) * 1000:.1f}"] \
+            if 'request_started' in g else []
+        for name, (duration, count) in g.get('server_timings', {}).items():
+            metrics.append(f'{name};dur={duration:.1f};desc="{count}x"')
+        session = g.pop('profile', None)
+        if session is not None:
+            path = profiler.finish(session)
+            if path is not None:
+                metrics.append(f'profile;desc="{path.name}"')
+        if metrics:
+            response.headers['Server-Timing'] = ', '.join(metrics)
+    except Exception as e:
+        logger.exception("Failed to add Server-Timing header.")
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(error):
+    """Stop a profile left running by a request that never produced a response."""
+    session = g.pop('profile', None)
+    if session is not None:
+        profiler.finish(session)
+
+
+@app.before_request
+def log_request_info():
+    """
+    Logs incoming request information.
+    """
+    try:
+        # Avoid logging sensitive endpoints or data
+        if request.endpoint in ['send_email', 'send_emails_from_db', 'add_email', 'add_emails', 'resume_outbox']:
+            logger.debug(f"Received {request.method} request for {request.url}")
+            logger.debug(f"Request headers: {dict(request.headers)}")
+            # Do not log request body for sensitive endpoints
+            logger.debug("Request body: [REDACTED]")
+        else:
+            logger.debug(f"Received {request.method} request for {request.url}")
+            logger.debug(f"Request headers: {dict(request.headers)}")
+            logger.debug(f"Request body: {request.get_data(as_text=True)}")
+    except Exception as e:
+        logger.exception("Failed to log request information.")
+
+
+@app.after_request
+def log_response_info(response):
+    """
+    Logs outgoing response information.
+    """
+    try:
+        logger.debug(f"Response status: {response.status}")
+        logger.debug(f"Response headers: {dict(response.headers)}")
+        # To log response data, ensure it's not binary and not too large
+        if response.content_type.startswith('application/json'):
+            response_data = response.get_json()
+            logger.debug(f"Response body: {json.dumps(response_data)}")
+        else:
+            logger.debug("Response body: [Non-JSON Content]")
+    except Exception as e:
+        logger.exception("Failed to log response information.")
+    return response
+
+
+@app.errorhandler(Exception)
+def handle_exception(e):
+    """
+    Handle uncaught exceptions and log them.
+    """
+    logger.exception("An unhandled exception occurred.")
+    return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Readiness endpoint for the Electron shell. Touches neither the database nor any lazily
+    imported dependency, so it answers as soon as the server is listening.
+    """
+    return jsonify({
+        "status": "ok",
+        "uptime_ms": round((time.perf_counter() - _PROCESS_START) * 1000, 2),
+    }), 200
+
+
+@app.route('/metrics/browsers', methods=['GET'])
+def browser_metrics():
+    """
+    Endpoint exposing the browser governor's metrics: active browsers, their RSS,
+    available memory and launch/kill counters.
+    """
+    return jsonify({"status": "success", "metrics": browser_governor.metrics()}), 200
+
+
+@app.route('/metrics/captures', methods=['GET'])
+def capture_metrics():
+    """
+    Endpoint exposing capture resilience metrics: hedge, retry and timeout counters, the state of
+    each host's circuit breaker and per-site capture latencies, plus the shared frames held in memory.
+    """
+    return jsonify({"status": "success", "metrics": capture_health.metrics(), "frames": frame_store.stats()}), 200
+
+
+@app.route('/debug/startup', methods=['GET'])
+def startup_profile():
+    """
+    Endpoint reporting startup phase timings and the import cost of each lazily loaded module.
+    """
+    return jsonify({
+        "status": "success",
+        "startup_ms": STARTUP_TIMINGS,
+        "lazy_imports_ms": IMPORT_PROFILE,
+        "loaded_modules": len(sys.modules),
+    }), 200
+
+
+@app.route('/debug/profile', methods=['GET'])
+def list_profiles():
+    """
+    Endpoint listing what is armed for profiling and the stored profiles, newest first.
+    """
+    return jsonify({
+        "status": "success",
+        "armed": dict(profiler.armed),
+        "modes": dict(profiler.modes),
+        "profiles": profiler.profiles(),
+    }), 200
+
+
+@app.route('/debug/profile', methods=['POST'])
+def arm_profiler():
+    """
+    Endpoint arming the profiler. Expects a JSON payload with 'requests' and/or 'captures',
+    the number of upcoming requests or capture jobs to profile, and an optional 'mode'
+    ('cprofile' or 'sampling'). A count of 0 disarms.
+    """
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode')
+    if mode is not None and mode not in PROFILE_MODES:
+        return jsonify({"status": "error", "message": f"Invalid mode. Must be one of: {', '.join(PROFILE_MODES)}."}), 400
+
+    targets = {target: data[target] for target in PROFILE_TARGETS if target in data}
+    if not targets or not all(isinstance(count, int) and not isinstance(count, bool) and count >= 0
+                              for count in targets.values()):
+        return jsonify({"status": "error",
+                        "message": "Provide 'requests' and/or 'captures' as non-negative integers."}), 400
+
+    for target, count in targets.items():
+        profiler.arm(target, count, mode)
+    logger.info(f"Profiler armed: {profiler.armed} ({profiler.modes})")
+    return jsonify({"status": "success", "armed": dict(profiler.armed), "modes": dict(profiler.modes)}), 200
+
+
+@app.route('/debug/profile/<path:name>', methods=['GET'])
+def download_profile(name):
+    """
+    Endpoint serving a stored profile; .pstats files load with pstats or snakeviz,
+    .folded files with flamegraph.pl or speedscope.
+    """
+    path = PROFILE_DIR / Path(name).name
+    if not path.is_file():
+        return jsonify({"status": "error", "message": "Profile not found."}), 404
+    return send_file(path, as_attachment=True, download_name=path.name)
+
+
+@app.route('/process-sites', methods=['POST'])
+def process_sites():
+    """
+    Endpoint to process sites and generate screenshots.
+    Expects a JSON payload with 'data', 'comments', 'timer', and 'sites'.
+    An optional 'renderer' of 'native' composes the report image directly instead of
+    screenshotting the generated template page. An optional 'widgets' of 'native' draws the forecast
+    widget pages from provider data instead of screenshotting them; the default 'auto' does so
+    whenever a forecast provider is configured.
+    """
+    template_path = Path(BASE_DIR, "template", "template.html")
+    generated_html_path = Path(BASE_DIR, "template", "generated_template.html")
+    log_path("template_path in process_sites", template_path)
+    log_path("generated_html_path", generated_html_path)
+
+    # Get JSON data from the request
+    data = request.get_json()
+    logger.debug(f"Received data: {data}")
+
+    # Validate input data
+    if not data or 'data' not in data or 'comments' not in data or 'timer' not in data or 'sites' not in data:
+        logger.error("Invalid input data received.")
+        return jsonify({
+            "status": "error",
+            "message": "Invalid input data. Required fields: 'data', 'comments', 'timer', 'sites'."
+        }), 400
+
+    boxes = data['data']
+    comments = data['comments']
+    timer = data['timer']
+    sites = data['sites']
+
+    # Log received data
+    logger.debug(f"Boxes: {boxes}")
+    logger.debug(f"Comments: {comments}")
+    logger.debug(f"Timer: {timer}")
+    logger.debug(f"Sites: {sites}")
+
+    # Validate 'timer' value
+    if not isinstance(timer, (int, float)) or timer <= 0:
+        logger.error("Invalid timer value received.")
+        return jsonify({"status": "error", "message": "Invalid timer value. It must be a positive number."}), 400
+
+    # Validate 'sites'
+    if not isinstance(sites, list) or not all(isinstance(site, dict) for site in sites):
+        logger.error("Invalid sites data received.")
+        return jsonify(
+            {"status": "error", "message": "Invalid sites data. It must be a list of site configurations."}), 400
+
+    # Compile the site plans; invalid configurations are rejected before any browser starts
+    try:
+        plans = compile_site_plans(sites)
+    except SiteConfigError as e:
+        logger.error(f"Invalid site configuration: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Log all site URLs
+    for idx, plan in enumerate(plans, start=1):
+        log_path(f"Site_{idx}_url", plan.url)
+
+    # Validate 'palette' value
+    palette = data.get('palette', DEFAULT_PALETTE)
+    if palette not in PALETTES:
+        logger.error(f"Invalid palette received: {palette}")
+        return jsonify({"status": "error", "message": f"Invalid palette. Must be one of: {', '.join(PALETTES)}."}), 400
+
+    # Validate 'renderer' value
+    renderer = data.get('renderer', 'browser')
+    if renderer not in REPORT_RENDERERS:
+        logger.error(f"Invalid renderer received: {renderer}")
+        return jsonify(
+            {"status": "error", "message": f"Invalid renderer. Must be one of: {', '.join(REPORT_RENDERERS)}."}), 400
+    if renderer == 'native':
+        plans = use_native_renderer(plans, generated_html_path)
+
+    # Validate 'widgets' value
+    widgets = data.get('widgets', 'auto')
+    if widgets not in WIDGET_RENDERERS:
+        logger.error(f"Invalid widgets renderer received: {widgets}")
+        return jsonify(
+            {"status": "error", "message": f"Invalid widgets. Must be one of: {', '.join(WIDGET_RENDERERS)}."}), 400
+    if widgets == 'native' and get_forecast_provider() is None:
+        return jsonify({"status": "error", "message": "No forecast provider is configured for native widgets."}), 400
+    if widgets == 'native' or (widgets == 'auto' and get_forecast_provider() is not None):
+        plans = use_widget_renderer(plans)
+
+    # Generate the HTML file with variables replaced
+    logger.debug("Generating HTML file with replaced variables...")
+    with server_timing('template'):
+        generated = generate_html_file(template_path, generated_html_path, boxes, comments, palette)
+    if not generated:
+        logger.error("Failed to generate HTML file.")
+        return jsonify({"status": "error", "message": "Failed to generate HTML file."}), 500
+
+    # Process each site concurrently, each within its own deadline
+    report = {"boxes": boxes, "comments": comments, "palette": palette}
+    with profiler.job('captures', 'process-sites'), server_timing('capture'):
+        failed_sites, resource_savings, outcomes = capture_sites(plans, timer, report)
+    messages = {
+        'timeout': "Capture exceeded the site's deadline.",
+        'skipped': "Skipped: the site's host keeps failing and there is no earlier capture to reuse.",
+    }
+    error_messages = {
+        outcome["url"]: messages.get(outcome["status"], "Failed to capture screenshots.")
+        for outcome in outcomes if outcome["url"] in failed_sites
+    }
+
+    if failed_sites:
+        logger.error(f"Failed to process sites: {failed_sites}")
+        return jsonify({
+            "status": "error",
+            "message": "Failed to process some sites.",
+            "failed_sites": failed_sites,
+            "details": error_messages,
+            "resource_savings": resource_savings,
+            "sites": outcomes
+        }), 500  # Use 500 for server-side errors
+
+    logger.info("All screenshots captured successfully.")
+    return jsonify({
+        "status": "success",
+        "message": "Screenshots captured successfully.",
+        "resource_savings": resource_savings,
+        "sites": outcomes
+    }), 200
+
+
+def prepare_report_dirs(report_id):
+    """
+    Create a report's image and template directories and copy the shared template assets
+    (logos, backgrounds and the crops of shared sites) into the latter, so the report's generated
+    page finds every image it embeds next to it. The report's own sites then overwrite their files.
+    """
+    screenshot_dir, template_dir = site_output_dirs(report_id)
+    screenshot_dir.mkdir(parents=True, exist_ok=True)
+    template_dir.mkdir(parents=True, exist_ok=True)
+    for asset in Path(BASE_DIR, "template").iterdir():
+        if asset.is_file() and asset.suffix.lower() != '.html':
+            shutil.copy2(asset, template_dir / asset.name)
+
+
+def render_report_batch(reports, timer, window_size="1920x1080"):
+    """
+    Render every report's HTML and screenshot all of them in one shared browser session.
+
+    All report pages are opened in their own tab up front so they load in parallel,
+    then each tab is captured in turn.
+
+    Parameters:
+    - reports: List of report definitions with 'id', 'template', 'data', 'comments' and 'palette'.
+      Each page is generated in the report's template directory (see prepare_report_dirs).
+    - timer: Seconds to wait once after all tabs have been opened.
+
+    Returns a manifest: a list of dictionaries describing each report's artifacts.
+    """
+    template_dir = Path(BASE_DIR, "template")
+    screenshot_dir = Path(BASE_DIR, "images")
+    screenshot_dir.mkdir(parents=True, exist_ok=True)
+
+    # 1. Render every HTML variant
+    manifest = []
+    for report in reports:
+        html_path = site_output_dirs(report["id"])[1] / "generated_template.html"
+        entry = {
+            "id": report["id"],
+            "template": report["template"],
+            "html": str(html_path),
+            "screenshot": None,
+            "status": "error",
+        }
+        if generate_html_file(template_dir / report["template"], html_path, report["data"], report["comments"],
+                              report["palette"]):
+            entry["status"] = "rendered"
+        manifest.append(entry)
+
+    rendered = [entry for entry in manifest if entry["status"] == "rendered"]
+    if not rendered:
+        return manifest
+
+    # 2. Open each rendered report in its own tab so pages load concurrently
+    driver = None
+    try:
+        driver = create_driver(window_size)
+        tabs = {}
+        for index, entry in enumerate(rendered):
+            url = Path(entry["html"]).as_uri()
+            if index == 0:
+                driver.get(url)
+                tabs[driver.current_window_handle] = entry
+            else:
+                known_handles = set(driver.window_handles)
+                driver.execute_script("window.open(arguments[0], '_blank');", url)
+                new_handles = set(driver.window_handles) - known_handles
+                tabs[new_handles.pop()] = entry
+        logger.debug(f"Opened {len(tabs)} report tab(s).")
+        time.sleep(timer)
+
+        # 3. Capture each tab
+        for handle, entry in tabs.items():
+            try:
+                driver.switch_to.window(handle)
+                WebDriverWait(driver, 15).until(
+                    lambda d: d.execute_script("return document.readyState") == "complete"
+                )
+                screenshot_path = screenshot_dir / f"report_{entry['id']}.png"
+                capture_full_page(driver, screenshot_path)
+                if screenshot_path.exists():
+                    entry["screenshot"] = str(screenshot_path)
+                    entry["bytes"] = screenshot_path.stat().st_size
+                    entry["sha256"] = get_file_hash(screenshot_path)
+                    entry["status"] = "success"
+            except Exception as e:
+                logger.exception(f"Failed to capture report {entry['id']}.")
+    except Exception as e:
+        logger.exception("An error occurred while rendering the report batch.")
+    finally:
+        if driver is not None:
+            close_driver(driver)
+
+    return manifest
+
+
+@app.route('/generate-reports', methods=['POST'])
+def generate_reports():
+    """
+    Endpoint to generate many reports in one pass.
+    Expects a JSON payload with 'timer' and 'reports', and optionally 'sites' and 'window_size'.
+    Shared sites are captured once into the common directories; each report's own sites are
+    captured into that report's directories, so reports that embed the same file names show
+    their own captures. Every report is then rendered and screenshotted in a shared browser
+    session. Returns a manifest of the produced artifacts.
+    """
+    data = request.get_json()
+    logger.debug(f"Received generate-reports data: {data}")
+
+    if not data or 'timer' not in data or 'reports' not in data:
+        logger.error("Invalid input data received for generate-reports.")
+        return jsonify({"status": "error", "message": "Invalid input data. Required fields: 'timer', 'reports'."}), 400
+
+    timer = data['timer']
+    if not isinstance(timer, (int, float)) or timer <= 0:
+        logger.error("Invalid timer value received.")
+        return jsonify({"status": "error", "message": "Invalid timer value. It must be a positive number."}), 400
+
+    reports = data['reports']
+    if not isinstance(reports, list) or not reports or not all(isinstance(report, dict) for report in reports):
+        logger.error("Invalid reports data received.")
+        return jsonify({"status": "error", "message": "The 'reports' field must be a non-empty list."}), 400
+
+    # Normalize report definitions
+    definitions = []
+    seen_ids = set()
+    for idx, report in enumerate(reports, start=1):
+        report_id = re.sub(r'[^A-Za-z0-9_-]', '_', str(report.get('id', idx)))
+        if report_id in seen_ids:
+            return jsonify({"status": "error", "message": f"Duplicate report id '{report_id}'."}), 400
+        seen_ids.add(report_id)
+
+        template_name = Path(report.get('template', 'template.html')).name
+        if not Path(BASE_DIR, "template", template_name).is_file():
+            return jsonify({"status": "error", "message": f"Report '{report_id}' template not found."}), 400
+
+        palette = report.get('palette', DEFAULT_PALETTE)
+        if palette not in PALETTES:
+            return jsonify({"status": "error", "message": f"Report '{report_id}' has an invalid palette."}), 400
+
+        report_sites = report.get('sites', [])
+        if not isinstance(report_sites, list) or not all(isinstance(site, dict) for site in report_sites):
+            return jsonify({"status": "error",
+                            "message": f"Report '{report_id}' sites must be a list of site configurations."}), 400
+
+        definitions.append({
+            "id": report_id,
+            "template": template_name,
+            "data": report.get('data', []),
+            "comments": report.get('comments', []),
+            "palette": palette,
+            "sites": report_sites,
+        })
+
+    shared_sites = data.get('sites', [])
+    if not isinstance(shared_sites, list) or not all(isinstance(site, dict) for site in shared_sites):
+        logger.error("Invalid sites data received for generate-reports.")
+        return jsonify(
+            {"status": "error", "message": "Invalid sites data. It must be a list of site configurations."}), 400
+
+    # Shared sites are captured once for every report; a report site that repeats one is not captured again
+    def distinct(sites, seen):
+        unique = {}
+        for site in sites:
+            key = json.dumps(site, sort_keys=True, default=str)
+            if key not in seen:
+                unique.setdefault(key, site)
+        return list(unique.values())
+
+    shared_keys = {json.dumps(site, sort_keys=True, default=str) for site in shared_sites}
+    try:
+        plans = list(compile_site_plans(distinct(shared_sites, set())))
+        report_plans = [compile_site_plans(distinct(definition["sites"], shared_keys), definition["id"])
+                        for definition in definitions]
+    except SiteConfigError as e:
+        logger.error(f"Invalid site configuration: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # A compose site lays out one report's data, so it can only be one of that report's sites
+    if any(plan.steps == (STEP_COMPOSE,) for plan in plans):
+        logger.error("Compose site received in the shared sites.")
+        return jsonify({"status": "error", "message": "Compose sites must be listed in a report's 'sites'."}), 400
+
+    failed_sites = []
+    for plan in plans:
+        if not capture_element_or_table(plan, timer):
+            failed_sites.append(plan.url)
+
+    # Each report's sites write into its own directories, seeded with the shared assets
+    for definition, site_plans in zip(definitions, report_plans):
+        report_id = definition["id"]
+        report = {"boxes": definition["data"], "comments": definition["comments"], "palette": definition["palette"],
+                  "assets_dir": site_output_dirs(report_id)[1]}
+        try:
+            prepare_report_dirs(report_id)
+        except OSError as e:
+            logger.exception(f"Failed to prepare the directories for report {report_id}.")
+            failed_sites.extend(plan.url for plan in site_plans)
+            continue
+        for plan in site_plans:
+            if not capture_element_or_table(plan, timer, report=report):
+                failed_sites.append(plan.url)
+
+    manifest = render_report_batch(definitions, timer, data.get('window_size', "1920x1080"))
+
+    manifest_path = Path(BASE_DIR, "images", "reports_manifest.json")
+    try:
+        manifest_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    except Exception as e:
+        logger.exception("Failed to write the report manifest.")
+
+    failed_reports = [entry["id"] for entry in manifest if entry["status"] != "success"]
+    status = "success" if not failed_reports and not failed_sites else "error"
+    logger.info(f"Report batch finished: {len(manifest) - len(failed_reports)} of {len(manifest)} succeeded.")
+    return jsonify({
+        "status": status,
+        "message": "Reports generated successfully." if status == "success" else "Failed to generate some reports.",
+        "reports": manifest,
+        "failed_reports": failed_reports,
+        "failed_sites": failed_sites,
+    }), 200 if status == "success" else 500
+
+
+@app.route('/snapshots', methods=['GET'])
+def list_snapshots():
+    """
+    Endpoint to list stored site snapshots.
+    """
+    try:
+        snapshots = [{
+            "name": manifest["name"],
+            "url": manifest["url"],
+            "fetched_at": datetime.fromtimestamp(manifest["fetched_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "resources": len(manifest["resources"]),
+            "bytes": sum(resource["bytes"] for resource in manifest["resources"].values()),
+        } for manifest in snapshot_store.list_manifests()]
+        return jsonify({"status": "success", "snapshots": snapshots}), 200
+    except Exception as e:
+        logger.exception("An error occurred while listing snapshots.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+
+
+@app.route('/snapshots/prefetch', methods=['POST'])
+def prefetch_snapshots():
+    """
+    Endpoint to prefetch snapshots ahead of a capture run.
+    Expects a JSON payload with 'sites' (site configurations) or 'urls' (a list of page URLs).
+    """
+    data = request.get_json()
+    logger.debug(f"Received snapshot prefetch data: {data}")
+
+    if not data or ('sites' not in data and 'urls' not in data):
+        logger.error("Invalid input data received for snapshot prefetch.")
+        return jsonify({"status": "error", "message": "Invalid input data. Required field: 'sites' or 'urls'."}), 400
+
+    targets = [(url, ()) for url in data.get('urls', [])]
+    targets += [(site["url"], site.get("snapshot_urls", ())) for site in data.get('sites', [])
+                if isinstance(site, dict) and str(site.get("url", "")).startswith(('http://', 'https://'))]
+
+    snapshots, failed_urls = [], []
+    for url, extra_urls in targets:
+        try:
+            manifest = prefetch_snapshot(url, extra_urls)
+            snapshots.append({"name": manifest["name"], "url": url, "resources": len(manifest["resources"])})
+        except Exception as e:
+            logger.exception(f"Failed to prefetch snapshot for {url}.")
+            failed_urls.append(url)
+
+    status = "success" if not failed_urls else "error"
+    return jsonify({"status": status, "snapshots": snapshots, "failed_urls": failed_urls}), \
+        200 if status == "success" else 500
+
+
+@app.route('/history/runs', methods=['GET'])
+def list_history_runs():
+    """
+    Endpoint to list archived capture runs, newest first.
+    Optional query parameters: 'since' and 'until' (epoch seconds or ISO 8601) and 'limit'.
+    """
+    try:
+        since = parse_history_time(request.args.get('since'))
+        until = parse_history_time(request.args.get('until'))
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid 'since', 'until' or 'limit'."}), 400
+
+    try:
+        runs = capture_archive.runs(since, until, limit)
+        return jsonify({"status": "success", "runs": runs}), 200
+    except Exception as e:
+        logger.exception("An error occurred while listing capture history.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+
+
+@app.route('/history/stats', methods=['GET'])
+def history_stats():
+    """
+    Endpoint to report the size of the capture archive and how much chunk deduplication saves.
+    """
+    try:
+        return jsonify({"status": "success", **capture_archive.stats()}), 200
+    except Exception as e:
+        logger.exception("An error occurred while reading capture history statistics.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+
+
+@app.route('/history/artifacts/<artifact_hash>', methods=['GET'])
+def get_history_artifact(artifact_hash):
+    """
+    Endpoint to fetch an archived artifact by hash. Optional query parameter 'name' picks the file type.
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', artifact_hash):
+        return jsonify({"status": "error", "message": "Invalid artifact hash."}), 400
+    try:
+        artifact = capture_archive.load(artifact_hash)
+    except Exception as e:
+        logger.exception(f"An error occurred while loading archived artifact {artifact_hash}.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+    if artifact is None:
+        return jsonify({"status": "error", "message": "Artifact not found."}), 404
+
+    body, kind = artifact
+    mimetype = 'image/png' if kind == 'image' else \
+        HISTORY_MIMETYPES.get(Path(request.args.get('name', '')).suffix.lower(), 'application/octet-stream')
+    return send_file(BytesIO(body), mimetype=mimetype, max_age=31536000)
+
+
+@app.route('/history/report', methods=['GET'])
+def get_history_report():
+    """
+    Endpoint to fetch a file as it was at a point in time.
+    Expects query parameters 'name' (e.g. 'images/full_page_screenshot.png') and 'at'; 'at' defaults to now.
+    """
+    name = request.args.get('name')
+    if not name:
+        return jsonify({"status": "error", "message": "Missing required query parameter: 'name'."}), 400
+    try:
+        at = parse_history_time(request.args.get('at'))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid 'at' time."}), 400
+
+    try:
+        version = capture_archive.version_at(name, at if at is not None else time.time())
+        artifact = capture_archive.load(version["artifact"]) if version else None
+    except Exception as e:
+        logger.exception(f"An error occurred while loading the archived {name}.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+    if artifact is None:
+        return jsonify({"status": "error", "message": f"No archived capture of {name} at that time."}), 404
+
+    body, kind = artifact
+    mimetype = 'image/png' if kind == 'image' else \
+        HISTORY_MIMETYPES.get(Path(name).suffix.lower(), 'application/octet-stream')
+    response = send_file(BytesIO(body), mimetype=mimetype)
+    response.headers['X-Artifact-Hash'] = version["artifact"]
+    response.headers['X-Captured-At'] = datetime.fromtimestamp(version["captured_at"]).isoformat(timespec='seconds')
+    return response
+
+
+@app.route('/history/timelapse', methods=['GET'])
+def get_history_timelapse():
+    """
+    Endpoint to play back how an image changed over a time range as an animation.
+    Expects query parameter 'name'; optional 'since', 'until', 'fps' (default 2), 'width'
+    (default HISTORY_TIMELAPSE_WIDTH) and 'format' ('gif' or 'webp').
+    """
+    name = request.args.get('name')
+    image_format = request.args.get('format', 'gif').lower()
+    if not name or image_format not in HISTORY_TIMELAPSE_FORMATS:
+        return jsonify({"status": "error", "message": "Required query parameter 'name'; 'format' must be 'gif' or 'webp'."}), 400
+    try:
+        since = parse_history_time(request.args.get('since'))
+        until = parse_history_time(request.args.get('until'))
+        fps = float(request.args.get('fps', 2))
+        width = int(request.args['width']) if request.args.get('width') else HISTORY_TIMELAPSE_WIDTH
+        if not 0 < fps <= 30 or (width is not None and width <= 0):
+            raise ValueError
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid 'since', 'until', 'fps' or 'width'."}), 400
+
+    try:
+        with server_timing('timelapse'):
+            body = capture_archive.timelapse(name, since, until, fps, width, image_format)
+    except Exception as e:
+        logger.exception(f"An error occurred while building the time-lapse of {name}.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+    if body is None:
+        return jsonify({"status": "error", "message": f"No archived images of {name} in that range."}), 404
+    return send_file(BytesIO(body), mimetype=HISTORY_TIMELAPSE_FORMATS[image_format])
+
+
+@app.route('/widgets/<widget_type>', methods=['GET'])
+def get_widget(widget_type):
+    """
+    Endpoint to draw a forecast widget as a PNG.
+    Expects query parameter 'locations' (comma-separated location IDs); optional 'units' and 'width'.
+    """
+    try:
+        spec = compile_widget({"type": widget_type, "locations": request.args.get('locations', ''),
+                               "units": request.args.get('units', 'imperial')})
+        width = int(request.args.get('width', 800))
+        if not 320 <= width <= 2000:
+            raise SiteConfigError("'width' must be between 320 and 2000.")
+    except (SiteConfigError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if get_forecast_provider() is None:
+        return jsonify({"status": "error", "message": "No forecast provider is configured."}), 503
+
+    try:
+        with server_timing('widget'):
+            image = render_widget(spec, width)
+            buffer = BytesIO()
+            image.save(buffer, format='PNG')
+    except Exception as e:
+        logger.exception(f"An error occurred while rendering the {widget_type} widget.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+    buffer.seek(0)
+    return send_file(buffer, mimetype='image/png')
+
+
+@app.route('/send-email', methods=['POST'])
+def send_email():
+    """
+    Queue an email with a resized image for compatibility with email clients.
+    Returns 202 with the batch_id once the messages are in the outbox; poll GET /outbox/<batch_id>
+    for their delivery.
+    """
+    data = request.get_json()
+    logger.debug(f"Received email data: {data}")
+
+    # Validate input data: one sender as 'email'/'password', or a pool of them as 'senders'
+    if not data or "receiver" not in data or ("senders" not in data and not {"email", "password"} <= data.keys()):
+        logger.error("Invalid email input data received.")
+        return jsonify({"status": "error",
+                        "message": "Invalid input data. Required fields: 'email', 'password', 'receiver'."}), 400
+
+    sender_entries = data["senders"] if "senders" in data else [{"email": data["email"], "password": data["password"]}]
+    try:
+        if not isinstance(sender_entries, list) or not sender_entries:
+            raise ValueError("The 'senders' field must be a non-empty list.")
+        senders = list({sender[0]: sender for sender in map(parse_sender, sender_entries)}.values())
+    except ValueError as e:
+        logger.error(f"Invalid senders received: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    recipient_emails = data["receiver"] if isinstance(data["receiver"], list) else [data["receiver"]]
+    # Look recipients up under the same canonical form they are stored with
+    recipient_emails = [normalize_email(email) or email for email in recipient_emails]
+
+    # Image variant options
+    image_variant = data.get("image_variant", "email")
+    image_format = data.get("image_format")
+    max_image_bytes = data.get("max_image_bytes", EMAIL_IMAGE_MAX_BYTES)
+    if image_variant not in EMAIL_IMAGE_VARIANTS:
+        logger.error(f"Invalid image variant received: {image_variant}")
+        return jsonify({"status": "error",
+                        "message": f"Invalid image variant. Must be one of: {', '.join(EMAIL_IMAGE_VARIANTS)}."}), 400
+    if image_format is not None and image_format not in IMAGE_FORMAT_EXTENSIONS:
+        logger.error(f"Invalid image format received: {image_format}")
+        return jsonify({"status": "error",
+                        "message": f"Invalid image format. Must be one of: {', '.join(IMAGE_FORMAT_EXTENSIONS)}."}), 400
+    if not isinstance(max_image_bytes, int) or isinstance(max_image_bytes, bool) or max_image_bytes <= 0:
+        logger.error(f"Invalid max image bytes received: {max_image_bytes}")
+        return jsonify({"status": "error", "message": "Invalid max_image_bytes. Must be a positive integer."}), 400
+
+    report_format = data.get("report_format", "png")
+    if report_format not in ("png", "pdf"):
+        logger.error(f"Invalid report format received: {report_format}")
+        return jsonify({"status": "error", "message": "Invalid report format. Must be 'png' or 'pdf'."}), 400
+
+    # Image paths
+    image_path = Path(BASE_DIR, 'images', 'full_page_screenshot.png')  # Update with actual path
+
+    if report_format == "pdf":
+        # PDF reports are sent as rendered; no resize step is needed
+        resized_image_path = image_path.with_suffix('.pdf')
+        if not resized_image_path.exists():
+            logger.error(f"PDF report not found at {resized_image_path}")
+            return jsonify({"status": "error",
+                            "message": "PDF report not found. Enable the 'pdf' output format for the report site."}), 404
+    else:
+        # Resize the image (served from the derivative cache when the screenshot is unchanged)
+        with server_timing('image'):
+            resized_image_path = get_image_variant(
+                image_path,
+                EMAIL_IMAGE_VARIANTS[image_variant],
+                image_format=image_format,
+                max_bytes=max_image_bytes
+            )
+        if resized_image_path is None:
+            return jsonify({"status": "error", "message": "Failed to process image."}), 500
+
+    # Per-recipient personalization: {"<email>": {"name": "...", "image": "<file in images/>"}}
+    recipient_data = {}
+    for recipient_email, details in (data.get("recipient_data") or {}).items():
+        if not isinstance(details, dict):
+            continue
+        entry = {'name': details.get('name')}
+        if details.get('image'):
+            location_image = Path(BASE_DIR, 'images', Path(details['image']).name)
+            with server_timing('image'):
+                entry['image_path'] = get_image_variant(
+                    location_image,
+                    EMAIL_IMAGE_VARIANTS[image_variant],
+                    image_format=image_format,
+                    max_bytes=max_image_bytes
+                )
+            if entry['image_path'] is None:
+                return jsonify({"status": "error", "message": f"Failed to process image for {recipient_email}."}), 500
+        recipient_data[normalize_email(recipient_email) or recipient_email] = entry
+
+    # Create email content
+    try:
+        html_content = get_email_body_template()
+    except Exception as e:
+        logger.error(f"Error creating email HTML content: {e}")
+        return jsonify({"status": "error", "message": "Failed to create email content."}), 500
+
+    # Send emails
+    with server_timing('send'):
+        response = send_emails(senders, recipient_emails, html_content, resized_image_path,
+                               recipient_data=recipient_data, unsubscribe_base_url=data.get("unsubscribe_url"),
+                               batch_id=data.get("batch_id"))
+    return jsonify(response), 202 if response["status"] == "queued" else 500
+
+
+# Source hashes keyed by (path, mtime_ns, size) so unchanged files are not rehashed
+_source_hash_cache = {}
+
+
+def get_file_hash(path):
+    """
+    Return the SHA-256 hex digest of a file, reusing the previous digest if the file is unchanged.
+    """
+    path = Path(path)
+    stat = path.stat()
+    signature = (str(path), stat.st_mtime_ns, stat.st_size)
+    cached = _source_hash_cache.get(signature)
+    if cached:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    # Drop stale entries for the same path
+    for key in [key for key in _source_hash_cache if key[0] == signature[0]]:
+        del _source_hash_cache[key]
+    _source_hash_cache[signature] = file_hash
+    return file_hash
+
+
+def _resolve_target_size(source_size, size):
+    """
+    Resolve the size an image is scaled to so it fits a (width, height) box with its aspect ratio kept.
+    Either dimension may be None to leave that side unbounded.
+    """
+    src_width, src_height = source_size
+    width, height = size
+    if width is None and height is None:
+        return src_width, src_height
+    scale = min(width / src_width if width is not None else math.inf,
+                height / src_height if height is not None else math.inf)
+    return max(1, round(src_width * scale)), max(1, round(src_height * scale))
+
+
+def _encode_image(img, image_format):
+    """
+    Encode a PIL image into bytes using optimized settings for the given format.
+    """
+    buffer = BytesIO()
+    if image_format == 'png':
+        img.save(buffer, format='PNG', optimize=True)
+    elif image_format == 'jpeg':
+        img.convert('RGB').save(buffer, format='JPEG', quality=85, optimize=True, progressive=True)
+    elif image_format == 'webp':
+        img.save(buffer, format='WEBP', quality=80, method=4)
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return buffer.getvalue()
+
+
+def _prune_image_cache():
+    """
+    Remove the oldest cached derivatives once the cache grows beyond IMAGE_CACHE_MAX_ENTRIES.
+    """
+    try:
+        entries = sorted(
+            (entry for entry in IMAGE_CACHE_DIR.iterdir() if entry.is_file() and not entry.name.endswith('.tmp')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries[:-IMAGE_CACHE_MAX_ENTRIES]:
+            entry.unlink()
+            logger.debug(f"Evicted cached image: {entry}")
+    except Exception as e:
+        logger.warning(f"Failed to prune image cache: {e}")
+
+
+def get_image_variant(image_path, size, image_format=None, max_bytes=None, formats=EMAIL_IMAGE_FORMATS,
+                      source_image=None):
+    """
+    Return the path of a resized derivative of image_path, generating it only when not cached.
+
+    Parameters:
+    - image_path: Path to the source image.
+    - size: (width, height) box the image is fitted into; either dimension may be None to leave it unbounded.
+    - image_format: 'png', 'jpeg' or 'webp'. When None, the first format in 'formats' that fits
+      within max_bytes is used, falling back to the smallest encoding.
+    - max_bytes: Byte budget used when choosing a format automatically.
+    - formats: Candidate formats for automatic selection, in order of preference.
+    - source_image: Already decoded PIL image of image_path; resized directly instead of decoding the file.
+
+    The cache is keyed on the source content hash, target size and format, so repeat sends
+    of an unchanged screenshot skip the resize and encode entirely.
+    """
+    try:
+        image_path = Path(image_path)
+        if not image_path.exists():
+            logger.error(f"Image path {image_path} does not exist.")
+            return None
+
+        if image_format is not None and image_format not in IMAGE_FORMAT_EXTENSIONS:
+            logger.error(f"Unsupported image format requested: {image_format}")
+            return None
+
+        source_hash = get_file_hash(image_path)
+        width_key = size[0] if size[0] is not None else 'auto'
+        height_key = size[1] if size[1] is not None else 'auto'
+        format_key = image_format or f"auto{max_bytes or 0}"
+        cache_stem = f"{source_hash[:16]}_{width_key}x{height_key}_{format_key}"
+
+        IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for candidate in IMAGE_CACHE_DIR.glob(f"{cache_stem}.*"):
+            if candidate.suffix != '.tmp':
+                logger.debug(f"Image cache hit: {candidate}")
+                os.utime(candidate)  # Keep recently used entries from being evicted
+                return candidate
+
+        logger.debug(f"Image cache miss: {cache_stem}")
+        frame = frame_store.acquire(image_path) if source_image is None else None
+        if frame is not None:
+            try:
+                source = frame.image()
+                target_size = _resolve_target_size(source.size, size)
+                resized = frame.restore_mode(source.resize(target_size, Image.Resampling.LANCZOS))
+            finally:
+                frame.release()
+        elif source_image is not None:
+            target_size = _resolve_target_size(source_image.size, size)
+            resized = source_image.resize(target_size, Image.Resampling.LANCZOS)
+        else:
+            with Image.open(image_path) as img:
+                img.load()
+                target_size = _resolve_target_size(img.size, size)
+                resized = img.resize(target_size, Image.Resampling.LANCZOS)
+
+        if image_format is not None:
+            chosen_format, data = image_format, _encode_image(resized, image_format)
+        else:
+            chosen_format, data = None, None
+            for candidate_format in formats:
+                encoded = _encode_image(resized, candidate_format)
+                if data is None or len(encoded) < len(data):
+                    chosen_format, data = candidate_format, encoded
+                if max_bytes is None or len(encoded) <= max_bytes:
+                    chosen_format, data = candidate_format, encoded
+                    break
+            if max_bytes is not None and len(data) > max_bytes:
+                logger.warning(f"No encoding fits within {max_bytes} bytes; using {chosen_format} ({len(data)} bytes).")
+
+        output_path = IMAGE_CACHE_DIR / f"{cache_stem}.{IMAGE_FORMAT_EXTENSIONS[chosen_format]}"
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, output_path)
+        logger.info(f"Cached {chosen_format} image variant {target_size} ({len(data)} bytes) at {output_path}")
+
+        _prune_image_cache()
+        return output_path
+    except Exception as e:
+        logger.exception("Error generating image variant.")
+        return None
+
+
+EMAIL_BODY_TEMPLATE = '''
+<html>
+<body style="margin: 0; padding: 0; background-color: #f4f4f4;">
+    <table width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; margin: 0; padding: 0; background-color: #f4f4f4;">
+        {{greeting}}
+        {{report_block}}
+        <!-- Buttons Row -->
+        <tr>
+            <td>
+                <table width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; margin: 0 auto; max-width: 1366px;">
+                    <tr>
+                        <!-- Left Aligned Button -->
+                        <td align="left" style="padding: 10px;">
+                            <a href="https://weather.tomorrow.io/widget/" style="background-color: #1d3361; color: white; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
+                                CLICK HERE FOR <span style="color: #ed1c24;">LIVE</span> VIEW!
+                            </a>
+                        </td>
+
+                        <!-- Centered Button 1 -->
+                        <td align="center" style="padding: 10px;">
+                            <a href="https://www.massport.com/logan-airport/flights/flight-status#departure" style="background-color: #edba25; color: #1d3359; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
+                                PRESS FOR DEPARTURES
+                            </a>
+                        </td>
+
+                        <!-- Centered Button 2 -->
+                        <td align="center" style="padding: 10px;">
+                            <a href="https://www.massport.com/logan-airport/flights/flight-status" style="background-color: #edba25; color: #1d3359; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
+                                PRESS FOR ARRIVALS
+                            </a>
+                        </td>
+
+                        <!-- Right Aligned Button -->
+                        <td align="right" style="padding: 10px;">
+                            <a href="https://metar-taf.com/livestream/KBOS?zoom=88" style="background-color: #1d3361; color: white; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
+                                CLICK HERE FOR <span style="color: #ed1c24;">LIVE</span> WEATHER VIEW!
+                            </a>
+                        </td>
+                    </tr>
+                </table>
+            </td>
+        </tr>
+        {{footer}}
+    </table>
+</body>
+</html>
+    '''
+
+
+class EmailBodyTemplate:
+    """
+    A precompiled email body template.
+
+    Placeholders of the form {{field}} are located once at construction time, so rendering a
+    body for each recipient is a single join over literal segments and context values.
+    Values are inserted verbatim; callers are responsible for escaping user-supplied text.
+    """
+
+    PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+    def __init__(self, source):
+        self.source = source
+        parts = self.PLACEHOLDER_PATTERN.split(source)
+        self._literals = parts[0::2]
+        self._fields = parts[1::2]
+
+    @property
+    def fields(self):
+        return set(self._fields)
+
+    def render(self, context):
+        """Render the template with the given context; missing fields render as empty strings."""
+        pieces = [self._literals[0]]
+        for field, literal in zip(self._fields, self._literals[1:]):
+            pieces.append(context.get(field, ''))
+            pieces.append(literal)
+        return ''.join(pieces)
+
+
+_email_body_template = None
+
+
+def get_email_body_template():
+    """Return the compiled email body template, compiling it on first use."""
+    global _email_body_template
+    if _email_body_template is None:
+        _email_body_template = EmailBodyTemplate(EMAIL_BODY_TEMPLATE)
+        logger.debug(f"Email body template compiled with fields: {sorted(_email_body_template.fields)}")
+    return _email_body_template
+
+
+def create_html_body():
+    """Create the HTML body for the email."""
+    return get_email_body_template().render(build_recipient_context())
+
+
+_unsubscribe_secret = None
+
+
+def get_unsubscribe_secret():
+    """
+    Return the secret used to sign unsubscribe tokens.
+    Taken from WINGSTAR_UNSUBSCRIBE_SECRET, or generated once and stored next to the database;
+    the stored key is read on first use only.
+    """
+    global _unsubscribe_secret
+    secret = os.environ.get('WINGSTAR_UNSUBSCRIBE_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+
+    if _unsubscribe_secret is None:
+        secret_path = Path(BASE_DIR, 'unsubscribe.key')
+        if not secret_path.exists():
+            secret_path.write_text(secrets.token_hex(32), encoding='utf-8')
+            logger.info(f"Generated unsubscribe secret at {secret_path}")
+        _unsubscribe_secret = secret_path.read_text(encoding='utf-8').strip().encode('utf-8')
+    return _unsubscribe_secret
+
+
+def make_unsubscribe_token(email):
+    """Return an HMAC token that proves an unsubscribe link was issued for this email."""
+    canonical = normalize_email(email) or email.strip()
+    return hmac.new(get_unsubscribe_secret(), canonical.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def build_unsubscribe_url(base_url, email):
+    """Build the unsubscribe link for a recipient."""
+    separator = '&' if '?' in base_url else '?'
+    return f"{base_url}{separator}{urlencode({'email': email, 'token': make_unsubscribe_token(email)})}"
+
+
+def build_recipient_context(name=None, unsubscribe_url=None, image_cid='image1', inline_image=True):
+    """
+    Build the template context for one recipient, escaping user-supplied values.
+    When inline_image is False the report travels as a PDF attachment instead of an inline image.
+    """
+    if inline_image:
+        report_block = (
+            '<tr><td align="center" style="padding: 20px;">'
+            f'<img src="cid:{image_cid}" alt="Daily Report" style="width: 100%; max-width: 1366px; height: auto;">'
+            '</td></tr>'
+        )
+    else:
+        report_block = (
+            '<tr><td align="center" style="padding: 20px; font-family: Arial, sans-serif; color: #1d3361;">'
+            'The daily report is attached as a PDF.</td></tr>'
+        )
+    context = {'image_cid': image_cid, 'report_block': report_block}
+    if name:
+        context['greeting'] = (
+            '<tr><td style="padding: 20px 20px 0 20px; font-family: Arial, sans-serif; color: #1d3361;">'
+            f'Hello {html.escape(name)},</td></tr>'
+        )
+    if unsubscribe_url:
+        context['footer'] = (
+            '<tr><td align="center" style="padding: 10px; font-family: Arial, sans-serif; font-size: 12px;">'
+            f'<a href="{html.escape(unsubscribe_url, quote=True)}" style="color: #888888;">Unsubscribe</a>'
+            '</td></tr>'
+        )
+    return context
+
+
+class _SMTPDataWriter:
+    """
+    File-like sink that streams a generated message into an open SMTP DATA command.
+    Applies dot-stuffing and sends in fixed-size chunks instead of building the whole message.
+    """
+
+    def __init__(self, sock, chunk_size=64 * 1024):
+        self._sock = sock
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._at_line_start = True
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii', 'surrogateescape')
+        if not data:
+            return
+        if self._at_line_start and data[:1] == b'.':
+            self._buffer += b'.'
+        self._buffer += data.replace(b'\n.', b'\n..')
+        self._at_line_start = data.endswith(b'\n')
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._sock.sendall(self._buffer)
+            self._buffer.clear()
+
+    def close(self):
+        if not self._at_line_start:
+            self._buffer += b'\r\n'
+        self._buffer += b'.\r\n'
+        self.flush()
+
+
+def stream_message(server, from_addr, to_addr, msg):
+    """
+    Send a message over an authenticated SMTP connection, streaming the MIME output
+    to the socket with BytesGenerator rather than serializing it with msg.as_string().
+    """
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(from_addr)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+    code, response = server.rcpt(to_addr)
+    if code not in (250, 251):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused({to_addr: (code, response)})
+    server.putcmd('data')
+    code, response = server.getreply()
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    writer = _SMTPDataWriter(server.sock)
+    BytesGenerator(writer, mangle_from_=False, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+    writer.close()
+
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+
+MIME_IMAGE_SUBTYPES = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp'}
+
+
+def _load_attachment_part(attachment_path, part_cache):
+    """
+    Return the MIME part for attachment_path, building and base64-encoding it only once per send run.
+    Images become an inline MIMEImage (cid:image1); PDFs become a regular file attachment.
+    The same part object is attached to every message that uses the file.
+    """
+    key = str(attachment_path)
+    if key not in part_cache:
+        with open(attachment_path, 'rb') as attachment_file:
+            data = attachment_file.read()
+        if Path(attachment_path).suffix.lower() == '.pdf':
+            part = MIMEApplication(data, _subtype='pdf')
+            part.add_header('Content-Disposition', 'attachment', filename='daily-report.pdf')
+        else:
+            part = MIMEImage(data, _subtype=MIME_IMAGE_SUBTYPES.get(Path(attachment_path).suffix, 'png'))
+            part.add_header('Content-ID', '<image1>')
+        part_cache[key] = part
+    return part_cache[key]
+
+
+def build_email_message(sender_email, recipient_email, html_content, image_part, name=None,
+                        unsubscribe_base_url=None, subject="Daily Report"):
+    """
+    Build the MIME message for one recipient.
+
+    Parameters:
+    - html_content: A static HTML string, or an EmailBodyTemplate rendered for this recipient.
+    - image_part: The MIMEImage embedded as cid:image1, or a PDF attachment part.
+    - unsubscribe_base_url: When set, the message gets a signed unsubscribe link and
+      a List-Unsubscribe header.
+    """
+    unsubscribe_url = build_unsubscribe_url(unsubscribe_base_url, recipient_email) if unsubscribe_base_url else None
+
+    # Render the body for this recipient
+    if isinstance(html_content, EmailBodyTemplate):
+        body = html_content.render(build_recipient_context(
+            name=name,
+            unsubscribe_url=unsubscribe_url,
+            inline_image=image_part.get_content_type() != 'application/pdf'
+        ))
+    else:
+        body = html_content
+
+    # Create email message
+    msg = MIMEMultipart('related')
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    msg['Subject'] = subject
+    if unsubscribe_url:
+        msg['List-Unsubscribe'] = f"<{unsubscribe_url}>"
+        msg['List-Unsubscribe-Post'] = "List-Unsubscribe=One-Click"
+
+    msg_alternative = MIMEMultipart('alternative')
+    msg.attach(msg_alternative)
+    msg_alternative.attach(MIMEText(body, 'html', 'utf-8'))
+
+    # Attach the image
+    msg.attach(image_part)
+    return msg
+
+
+# Durable outbound mail queue
+OUTBOX_WORKERS = 4
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 30  # Seconds before the first retry; doubles per attempt
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_POLL_INTERVAL = 1.0
+SENDER_VERIFY_TTL = 30 * 60  # Seconds a successful SMTP login vouches for the same credentials
+OUTBOX_MAX_WORKERS = 32
+SENDER_DAILY_QUOTA = 500  # Messages per sender per rolling 24 hours; Gmail's limit for a consumer account
+SENDER_CONNECTIONS = 2  # Messages one sender account may have in flight at once
+SENDER_RING_REPLICAS = 64  # Points per sender on the consistent-hash ring
+SENDER_THROTTLE_COOLDOWN = 15 * 60  # Seconds a throttled sender rests before it is used again
+THROTTLE_SMTP_CODES = (421, 454)  # Gmail's "try again later" and "too many logins" replies
+# Enhanced status codes about the sending account: Gmail's "try again later" and "daily sending quota exceeded".
+# Recipient-side replies such as 552 5.2.2 (mailbox over quota) must not put the sender to rest.
+THROTTLE_SMTP_STATUS_CODES = ('4.7.0', '5.4.5')
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 465
+
+
+def open_smtp_connection():
+    """Open a connection to the SMTP server; every mail connection is made here."""
+    return smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT)
+
+
+def get_outbox_connection():
+    """
+    Open a standalone database connection for outbox workers, which run outside the request context.
+    """
+    db = sqlite3.connect(str(BASE_DIR / 'wing-master-db.db'), timeout=30)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def init_outbox():
+    """
+    Requeue messages that were in flight when the process last stopped,
+    so an interrupted send resumes instead of being lost.
+    """
+    db = None
+    try:
+        db = get_outbox_connection()
+        cursor = db.cursor()
+        cursor.execute(
+            "UPDATE outbox SET state = 'pending', updated_at = ? WHERE state = 'sending'",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),)
+        )
+        resumed = cursor.rowcount
+        db.commit()
+        logger.info(f"Outbox initialized; {resumed} interrupted message(s) requeued.")
+    except Exception as e:
+        logger.exception("Failed to initialize the outbox.")
+    finally:
+        if db is not None:
+            db.close()
+
+
+def enqueue_outbox_messages(db, batch_id, messages):
+    """
+    Insert messages into the outbox. Re-enqueuing the same (batch_id, recipient) is a no-op,
+    which makes retried or resumed /send-email calls idempotent.
+
+    Parameters:
+    - messages: List of (sender_email, recipient_email, payload dict) tuples.
+    """
+    now = time.time()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor = db.cursor()
+    cursor.executemany(
+        '''INSERT OR IGNORE INTO outbox
+           (batch_id, sender_email, recipient_email, payload, state, attempts, next_attempt_at, created_at, updated_at)
+           VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?)''',
+        [(batch_id, sender_email, recipient, json.dumps(payload), now, timestamp, timestamp)
+         for sender_email, recipient, payload in messages]
+    )
+    db.commit()
+    logger.info(f"Enqueued {cursor.rowcount} message(s) for batch {batch_id}.")
+
+
+def outbox_retry_delay(attempts):
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def is_permanent_smtp_error(error):
+    """Return True for SMTP errors that will not succeed on retry (5xx replies other than auth)."""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+def is_throttle_smtp_error(error):
+    """
+    Return True for SMTP replies saying the sender account is being rate limited or is over its quota.
+    Only reply codes and the leading enhanced status code are used; reply text is not matched.
+    """
+    if not isinstance(error, smtplib.SMTPResponseException) or isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    message = error.smtp_error.decode('utf-8', 'replace') if isinstance(error.smtp_error, bytes) else str(error.smtp_error)
+    status_code = message.split(None, 1)[0] if message.strip() else ''
+    return error.smtp_code in THROTTLE_SMTP_CODES or status_code in THROTTLE_SMTP_STATUS_CODES
+
+
+def parse_sender(entry):
+    """
+    Validate a sender account given as {'email', 'password', 'quota', 'rate'}.
+    'quota' is messages per rolling 24 hours and 'rate' messages per minute; both are optional.
+    Returns (email, password, quota, rate) or raises ValueError.
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get('email'), str) or \
+            not isinstance(entry.get('password'), str):
+        raise ValueError("Each sender needs an 'email' and a 'password'.")
+    quota = entry.get('quota', SENDER_DAILY_QUOTA)
+    rate = entry.get('rate')
+    if not isinstance(quota, int) or isinstance(quota, bool) or quota <= 0:
+        raise ValueError(f"Invalid quota for sender {entry['email']}.")
+    if rate is not None and (not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0):
+        raise ValueError(f"Invalid rate for sender {entry['email']}.")
+    return entry['email'], entry['password'], quota, rate
+
+
+def _ring_point(key):
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class SenderRing:
+    """
+    Consistent-hash ring that maps recipients to sender accounts.
+
+    A recipient keeps the same sender for as long as that sender is in the pool, and adding or
+    removing a sender only moves the recipients on its own arcs of the ring.
+    """
+
+    def __init__(self, senders, replicas=SENDER_RING_REPLICAS):
+        self.senders = tuple(sorted(set(senders)))
+        points = sorted((_ring_point(f"{sender}#{replica}"), sender)
+                        for sender in self.senders for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [sender for _, sender in points]
+
+    def route(self, recipient_email):
+        """Return every sender in ring order from the recipient's owner: the owner first, then failovers."""
+        order = []
+        start = bisect.bisect(self._points, _ring_point(recipient_email))
+        for offset in range(len(self._owners)):
+            sender = self._owners[(start + offset) % len(self._owners)]
+            if sender not in order:
+                order.append(sender)
+                if len(order) == len(self.senders):
+                    break
+        return order
+
+
+# Rings keyed by their sorted sender tuple; pools rarely change between batches
+_sender_rings = {}
+
+
+def get_sender_ring(senders):
+    key = tuple(sorted(set(senders)))
+    ring = _sender_rings.get(key)
+    if ring is None:
+        if len(_sender_rings) > 64:
+            _sender_rings.clear()
+        ring = _sender_rings[key] = SenderRing(key)
+    return ring
+
+
+class OutboxWorkerPool:
+    """
+    Pool of threads that drain the outbox concurrently.
+
+    Each worker keeps one SMTP connection per sender. Credentials are held in memory only,
+    so after a restart pending messages wait until the sender logs in again via /send-email
+    or /outbox/resume.
+
+    Messages are only claimed for senders that are under their quota, rate and in-flight limits
+    and are not resting after being throttled. When a sender is throttled, runs out of quota or
+    fails to authenticate, its pending messages from sender pools move to the next usable sender
+    on each recipient's ring.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._credentials = {}
+        self._limits = {}
+        self._sent_times = {}
+        self._in_flight = {}
+        self._throttled_until = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def set_credentials(self, sender_email, sender_password, quota=SENDER_DAILY_QUOTA, rate=None):
+        sent_times = None if sender_email in self._sent_times else self._load_sent_times(sender_email)
+        with self._lock:
+            self._credentials[sender_email] = sender_password
+            self._limits[sender_email] = (quota, rate)
+            self._throttled_until.pop(sender_email, None)
+            if sent_times is not None:
+                self._sent_times.setdefault(sender_email, sent_times)
+        self.notify()
+
+    @staticmethod
+    def _load_sent_times(sender_email):
+        """Read when the sender's messages of the last 24 hours were sent, so quotas survive restarts."""
+        db = get_outbox_connection()
+        try:
+            since = datetime.fromtimestamp(time.time() - 86400).strftime("%Y-%m-%d %H:%M:%S")
+            rows = db.execute(
+                "SELECT updated_at FROM outbox WHERE sender_email = ? AND state = 'sent' AND updated_at >= ? "
+                "ORDER BY updated_at",
+                (sender_email, since)
+            ).fetchall()
+        finally:
+            db.close()
+        return deque(datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").timestamp() for row in rows)
+
+    def _sent_within(self, sender_email, seconds, now):
+        """Count the sender's messages sent in the last seconds; call with the lock held."""
+        sent_times = self._sent_times.setdefault(sender_email, deque())
+        while sent_times and sent_times[0] <= now - 86400:
+            sent_times.popleft()
+        if seconds >= 86400:
+            return len(sent_times)
+        count = 0
+        for sent_at in reversed(sent_times):
+            if sent_at <= now - seconds:
+                break
+            count += 1
+        return count
+
+    def _usable(self, sender_email, now):
+        """Whether the sender may take more messages at all; call with the lock held."""
+        quota, _ = self._limits.get(sender_email, (SENDER_DAILY_QUOTA, None))
+        return (sender_email in self._credentials
+                and self._throttled_until.get(sender_email, 0) <= now
+                and self._sent_within(sender_email, 86400, now) < quota)
+
+    def _ready(self, sender_email, now):
+        """Whether the sender may start a message right now; call with the lock held."""
+        quota, rate = self._limits.get(sender_email, (SENDER_DAILY_QUOTA, None))
+        in_flight = self._in_flight.get(sender_email, 0)
+        return (self._usable(sender_email, now)
+                and in_flight < SENDER_CONNECTIONS
+                and self._sent_within(sender_email, 86400, now) + in_flight < quota
+                and (rate is None or self._sent_within(sender_email, 60, now) < rate))
+
+    def throttle(self, sender_email, seconds=SENDER_THROTTLE_COOLDOWN):
+        with self._lock:
+            self._throttled_until[sender_email] = time.time() + seconds
+        logger.warning(f"Sender {sender_email} is throttled; resting it for {seconds}s.")
+
+    def assign(self, db, ring, recipient_emails):
+        """
+        Pick a sender for each recipient: the first usable sender on its ring that still has quota
+        left once this batch and the sender's pending messages are counted.
+        Returns a dictionary of recipient email to sender email.
+        """
+        now = time.time()
+        pending = {row[0]: row[1] for row in db.execute(
+            f"SELECT sender_email, COUNT(*) FROM outbox WHERE state IN ('pending', 'sending') "
+            f"AND sender_email IN ({', '.join(['?'] * len(ring.senders))}) GROUP BY sender_email",
+            ring.senders
+        )}
+        with self._lock:
+            usable = {sender for sender in ring.senders if self._usable(sender, now)}
+            remaining = {
+                sender: self._limits.get(sender, (SENDER_DAILY_QUOTA, None))[0]
+                - self._sent_within(sender, 86400, now) - pending.get(sender, 0)
+                for sender in ring.senders
+            }
+
+        assignments = {}
+        for recipient_email in recipient_emails:
+            route = ring.route(recipient_email)
+            candidates = [sender for sender in route if sender in usable] or route
+            sender = next((sender for sender in candidates if remaining[sender] > 0), candidates[0])
+            remaining[sender] -= 1
+            assignments[recipient_email] = sender
+        return assignments
+
+    def _fail_over(self, db, sender_email):
+        """Move the sender's pending pool messages to the next usable sender on each recipient's ring."""
+        rows = db.execute(
+            "SELECT id, recipient_email, payload FROM outbox WHERE state = 'pending' AND sender_email = ?",
+            (sender_email,)
+        ).fetchall()
+        now = time.time()
+        moves = []
+        with self._lock:
+            for row in rows:
+                pool = json.loads(row["payload"]).get("senders") or ()
+                if len(pool) < 2:
+                    continue
+                target = next((sender for sender in get_sender_ring(pool).route(row["recipient_email"])
+                               if sender != sender_email and self._usable(sender, now)), None)
+                if target is not None:
+                    moves.append((target, now, row["id"]))
+        if moves:
+            db.executemany(
+                "UPDATE outbox SET sender_email = ?, next_attempt_at = ? WHERE id = ? AND state = 'pending'", moves
+            )
+            db.commit()
+            logger.info(f"Failed over {len(moves)} message(s) from {sender_email} to other senders.")
+            self.notify()
+
+    def sender_status(self):
+        """Return the quota, usage and health of every sender with credentials."""
+        now = time.time()
+        with self._lock:
+            return {
+                sender: {
+                    "quota": self._limits.get(sender, (SENDER_DAILY_QUOTA, None))[0],
+                    "rate": self._limits.get(sender, (SENDER_DAILY_QUOTA, None))[1],
+                    "sent_24h": self._sent_within(sender, 86400, now),
+                    "in_flight": self._in_flight.get(sender, 0),
+                    "throttled_for": max(0, round(self._throttled_until.get(sender, 0) - now)),
+                }
+                for sender in self._credentials
+            }
+
+    def drop_credentials(self, sender_email):
+        with self._lock:
+            self._credentials.pop(sender_email, None)
+
+    def has_credentials(self, sender_email):
+        with self._lock:
+            return sender_email in self._credentials
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def ensure_started(self, size=None):
+        with self._lock:
+            if size:
+                self.size = max(self.size, min(size, OUTBOX_MAX_WORKERS))
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._run, name=f"outbox-worker-{len(self._threads) + 1}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.debug(f"Outbox worker pool running with {self.size} worker(s).")
+
+    def _claim(self, db):
+        """Atomically move the next due message for a ready sender to 'sending'."""
+        with self._claim_lock:
+            now = time.time()
+            with self._lock:
+                senders = [sender for sender in self._credentials if self._ready(sender, now)]
+            if not senders:
+                return None
+            row = self._claim_from(db, senders)
+            if row is not None:
+                with self._lock:
+                    self._in_flight[row["sender_email"]] = self._in_flight.get(row["sender_email"], 0) + 1
+            return row
+
+    def _release(self, sender_email):
+        with self._lock:
+            self._in_flight[sender_email] = max(0, self._in_flight.get(sender_email, 0) - 1)
+
+    def _claim_from(self, db, senders):
+        placeholders = ', '.join(['?'] * len(senders))
+        cursor = db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                f'''SELECT * FROM outbox
+                    WHERE state = 'pending' AND next_attempt_at <= ? AND sender_email IN ({placeholders})
+                    ORDER BY next_attempt_at, id LIMIT 1''',
+                (time.time(), *senders)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                cursor.execute(
+                    "UPDATE outbox SET state = 'sending', updated_at = ? WHERE id = ?",
+                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), row["id"])
+                )
+            db.commit()
+            return row
+        except Exception:
+            db.rollback()
+            raise
+
+    def _get_server(self, connections, sender_email):
+        server = connections.get(sender_email)
+        if server is None:
+            with self._lock:
+                password = self._credentials.get(sender_email)
+            if password is None:
+                raise smtplib.SMTPAuthenticationError(535, b"No credentials available for sender.")
+            server = open_smtp_connection()
+            server.login(sender_email, password)
+            connections[sender_email] = server
+            logger.debug(f"Outbox SMTP connection opened for {sender_email}.")
+        return server
+
+    def _deliver(self, db, connections, image_parts, row):
+        payload = json.loads(row["payload"])
+        sender_email = row["sender_email"]
+        recipient_email = row["recipient_email"]
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            server = self._get_server(connections, sender_email)
+            html_content = payload["html"] if payload.get("html") is not None else get_email_body_template()
+            if len(image_parts) > 16:
+                image_parts.clear()
+            msg = build_email_message(
+                sender_email,
+                recipient_email,
+                html_content,
+                _load_attachment_part(payload.get("image_path") or payload["attachment_path"], image_parts),
+                name=payload.get("name"),
+                unsubscribe_base_url=payload.get("unsubscribe_base_url"),
+                subject=payload.get("subject", "Daily Report")
+            )
+            stream_message(server, sender_email, recipient_email, msg)
+        except Exception as e:
+            broken = connections.pop(sender_email, None)
+            if broken is not None:
+                try:
+                    broken.close()
+                except Exception:
+                    pass
+            if isinstance(e, smtplib.SMTPAuthenticationError):
+                logger.error(f"Outbox authentication failed for {sender_email}; waiting for new credentials.")
+                self.drop_credentials(sender_email)
+                forget_sender_verification(sender_email)
+            elif is_throttle_smtp_error(e):
+                self.throttle(sender_email)
+            if isinstance(e, smtplib.SMTPAuthenticationError) or is_throttle_smtp_error(e):
+                # The sender is at fault, not the recipient: requeue without spending an attempt
+                db.execute(
+                    "UPDATE outbox SET state = 'pending', next_attempt_at = ?, last_error = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (time.time(), str(e), timestamp, row["id"])
+                )
+                db.commit()
+                self._fail_over(db, sender_email)
+                return
+
+            attempts = row["attempts"] + 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS or is_permanent_smtp_error(e):
+                state, next_attempt_at = 'dead', row["next_attempt_at"]
+                logger.error(f"Dead-lettered email to {recipient_email} after {attempts} attempt(s): {e}")
+            else:
+                state, next_attempt_at = 'pending', time.time() + outbox_retry_delay(attempts)
+                logger.warning(f"Failed to send email to {recipient_email} (attempt {attempts}); retrying: {e}")
+            db.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (state, attempts, next_attempt_at, str(e), timestamp, row["id"])
+            )
+            db.commit()
+            return
+
+        db.execute(
+            "UPDATE outbox SET state = 'sent', attempts = attempts + 1, last_error = NULL, updated_at = ? WHERE id = ?",
+            (timestamp, row["id"])
+        )
+        cursor = db.execute("UPDATE emails SET status = 'sent' WHERE email = ?", (recipient_email,))
+        db.commit()
+        recipient_cache.apply(db, cursor.rowcount, updates=[{"email": recipient_email, "status": 'sent'}])
+        logger.info(f"Email sent to {recipient_email} (batch {row['batch_id']}).")
+
+        now = time.time()
+        with self._lock:
+            self._sent_times.setdefault(sender_email, deque()).append(now)
+            exhausted = not self._usable(sender_email, now) and sender_email in self._credentials
+        if exhausted:
+            logger.warning(f"Sender {sender_email} has reached its daily quota.")
+            self._fail_over(db, sender_email)
+
+    def _run(self):
+        db = get_outbox_connection()
+        connections = {}
+        image_parts = {}
+        try:
+            while True:
+                try:
+                    row = self._claim(db)
+                except Exception as e:
+                    logger.exception("Outbox worker failed to claim a message.")
+                    row = None
+                if row is None:
+                    for server in connections.values():
+                        try:
+                            server.noop()
+                        except Exception:
+                            pass
+                    with self._condition:
+                        self._condition.wait(OUTBOX_POLL_INTERVAL)
+                    continue
+                try:
+                    self._deliver(db, connections, image_parts, row)
+                finally:
+                    self._release(row["sender_email"])
+                self.notify()
+        finally:
+            for server in connections.values():
+                try:
+                    server.quit()
+                except Exception:
+                    pass
+            db.close()
+
+
+outbox_pool = OutboxWorkerPool(OUTBOX_WORKERS)
+
+
+# Credentials whose SMTP login succeeded: (email, password digest) -> monotonic time of the login
+_verified_senders = {}
+_verified_senders_lock = threading.Lock()
+
+
+def _sender_credential_key(sender_email, sender_password):
+    return sender_email, hashlib.sha256(sender_password.encode('utf-8')).hexdigest()
+
 
+def forget_sender_verification(sender_email):
+    """Make the next verify_sender call for the account log in again, e.g. after the server rejected it."""
+    with _verified_senders_lock:
+        for key in [key for key in _verified_senders if key[0] == sender_email]:
+            del _verified_senders[key]
 
-@app.errorhandler(Exception)
-def handle_exception(e):
+
+def verify_sender(sender_email, sender_password):
     """
-    Handle uncaught exceptions and log them.
+    Log in to the SMTP server once. Returns None on success or an error message.
+    A successful login is remembered for SENDER_VERIFY_TTL, so repeated sends skip it.
     """
-    logger.exception("An unhandled exception occurred.")
-    return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+    key = _sender_credential_key(sender_email, sender_password)
+    with _verified_senders_lock:
+        verified_at = _verified_senders.get(key)
+    if verified_at is not None and time.monotonic() - verified_at < SENDER_VERIFY_TTL:
+        return None
+    try:
+        with open_smtp_connection() as server:
+            server.login(sender_email, sender_password)
+            logger.info(f"SMTP login verified for {sender_email}.")
+        with _verified_senders_lock:
+            _verified_senders[key] = time.monotonic()
+        return None
+    except smtplib.SMTPAuthenticationError:
+        logger.error(f"Authentication failed for {sender_email}. Check the email and app password.")
+        return "Authentication failed."
+    except Exception as e:
+        logger.error(f"Unexpected error verifying {sender_email}: {e}")
+        return str(e)
 
 
-@app.route('/process-sites', methods=['POST'])
-def process_sites():
+def derive_batch_id(senders, recipient_emails, html_content, attachment_path,
+                    recipient_data=None, unsubscribe_base_url=None):
     """
-    Endpoint to process sites and generate screenshots.
-    Expects a JSON payload with 'data', 'comments', 'timer', and 'sites'.
+    Return a batch id derived from who sends what to whom, so a retried /send-email call without
+    an explicit batch_id lands in the same batch instead of sending everything again.
+    Images are identified by content, so a new capture of the report starts a new batch.
     """
-    template_path = Path(BASE_DIR, "template", "template.html")
-    generated_html_path = Path(BASE_DIR, "template", "generated_template.html")
-    log_path("template_path in process_sites", template_path)
-    log_path("generated_html_path", generated_html_path)
-
-    # Get JSON data from the request
-    data = request.get_json()
-    logger.debug(f"Received data: {data}")
-
-    # Validate input data
-    if not data or 'data' not in data or 'comments' not in data or 'timer' not in data or 'sites' not in data:
-        logger.error("Invalid input data received.")
-        return jsonify({
-            "status": "error",
-            "message": "Invalid input data. Required fields: 'data', 'comments', 'timer', 'sites'."
-        }), 400
-
-    boxes = data['data']
-    comments = data['comments']
-    timer = data['timer']
-    sites = data['sites']
-
-    # Log received data
-    logger.debug(f"Boxes: {boxes}")
-    logger.debug(f"Comments: {comments}")
-    logger.debug(f"Timer: {timer}")
-    logger.debug(f"Sites: {sites}")
-
-    # Validate 'timer' value
-    if not isinstance(timer, (int, float)) or timer <= 0:
-        logger.error("Invalid timer value received.")
-        return jsonify({"status": "error", "message": "Invalid timer value. It must be a positive number."}), 400
+    def content_hash(path):
+        try:
+            return get_file_hash(path)
+        except OSError:
+            return str(path)
+
+    recipient_data = recipient_data or {}
+    body = html_content.source if isinstance(html_content, EmailBodyTemplate) else html_content
+    key = {
+        "senders": sorted(sender[0] for sender in senders),
+        "recipients": sorted(set(recipient_emails)),
+        "body": hashlib.sha256(body.encode('utf-8')).hexdigest(),
+        "attachment": content_hash(attachment_path),
+        "recipient_data": {
+            email: [details.get("name"),
+                    content_hash(details["image_path"]) if details.get("image_path") else None]
+            for email, details in recipient_data.items()
+        },
+        "unsubscribe_base_url": unsubscribe_base_url,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:32]
 
-    # Validate 'sites'
-    if not isinstance(sites, list) or not all(isinstance(site, dict) for site in sites):
-        logger.error("Invalid sites data received.")
-        return jsonify(
-            {"status": "error", "message": "Invalid sites data. It must be a list of site configurations."}), 400
 
-    # Log all site URLs
-    for idx, site in enumerate(sites, start=1):
-        if 'url' not in site:
-            logger.error(f"Site {idx} does not contain a 'url'.")
-            return jsonify({"status": "error", "message": f"Site {idx} is missing a 'url' field."}), 400
-        log_path(f"Site_{idx}_url", site["url"])
+def send_emails(senders, recipient_emails, html_content, attachment_path,
+                recipient_data=None, unsubscribe_base_url=None, batch_id=None):
+    """
+    Queue emails to the recipients in the durable outbox and return without waiting for delivery;
+    progress is read from batch_status (GET /outbox/<batch_id>).
 
-    # Generate the HTML file with variables replaced
-    logger.debug("Generating HTML file with replaced variables...")
-    if not generate_html_file(template_path, generated_html_path, boxes, comments):
-        logger.error("Failed to generate HTML file.")
-        return jsonify({"status": "error", "message": "Failed to generate HTML file."}), 500
+    Recipients are spread over the sender accounts with a consistent-hash ring, so each recipient
+    keeps the same sender from one send to the next, and the outbox workers send for all of the
+    accounts in parallel within each account's quota.
 
-    # Process each site
-    failed_sites = []
-    error_messages = {}
+    Parameters:
+    - senders: List of (email, password, quota, rate) tuples, as returned by parse_sender.
+    - html_content: A static HTML string, or an EmailBodyTemplate rendered per recipient.
+    - attachment_path: Default image embedded as cid:image1.
+    - recipient_data: Optional mapping of recipient email to {'name': ..., 'image_path': ...}
+      used to personalize the greeting and the embedded image.
+    - unsubscribe_base_url: When set, each message gets a signed unsubscribe link.
+    - batch_id: Identifies the send; re-sending with the same batch_id does not duplicate messages.
+      Defaults to one derived from the senders, recipients and content (see derive_batch_id).
+    """
+    skipped_emails = []
+    recipient_data = recipient_data or {}
+    batch_id = batch_id or derive_batch_id(senders, recipient_emails, html_content, attachment_path,
+                                           recipient_data, unsubscribe_base_url)
+    db = get_db()
 
-    for site in sites:
-        success = capture_element_or_table(site, timer)
-        if not success:
-            failed_sites.append(site["url"])
-            error_messages[site["url"]] = "Failed to capture screenshots."
+    # Verify the credentials up front so auth problems are reported to the caller; a pool
+    # carries on without the accounts that fail
+    with ThreadPoolExecutor(max_workers=min(len(senders), 8)) as executor:
+        errors = list(executor.map(lambda sender: verify_sender(sender[0], sender[1]), senders))
+    failed_senders = {sender[0]: error for sender, error in zip(senders, errors) if error}
+    senders = [sender for sender in senders if sender[0] not in failed_senders]
+    if not senders:
+        return {"status": "error", "message": next(iter(failed_senders.values()))}
+
+    recipients = []
+    for recipient_email in recipient_emails:
+        # Check email status in the recipient cache
+        result = recipient_cache.get(db, recipient_email)
+
+        if result and result["status"] == 'sent':
+            logger.info(f"Skipping email to {recipient_email}, already sent.")
+            skipped_emails.append(recipient_email)
+            continue
+
+        recipients.append(recipient_email)
+
+    for sender_email, sender_password, quota, rate in senders:
+        outbox_pool.set_credentials(sender_email, sender_password, quota=quota, rate=rate)
+    ring = get_sender_ring([sender[0] for sender in senders])
+    pool = list(ring.senders) if len(ring.senders) > 1 else None
+
+    messages = []
+    try:
+        assignments = outbox_pool.assign(db, ring, recipients)
+        for recipient_email in recipients:
+            details = recipient_data.get(recipient_email, {})
+            messages.append((assignments[recipient_email], recipient_email, {
+                "attachment_path": str(attachment_path),
+                "image_path": str(details["image_path"]) if details.get("image_path") else None,
+                "name": details.get("name"),
+                "unsubscribe_base_url": unsubscribe_base_url,
+                "html": None if isinstance(html_content, EmailBodyTemplate) else html_content,
+                "senders": pool,
+            }))
+        enqueue_outbox_messages(db, batch_id, messages)
+    except Exception as e:
+        logger.exception("Failed to enqueue emails.")
+        return {"status": "error", "message": str(e)}
 
-    if failed_sites:
-        logger.error(f"Failed to process sites: {failed_sites}")
-        return jsonify({
-            "status": "error",
-            "message": "Failed to process some sites.",
-            "failed_sites": failed_sites,
-            "details": error_messages
-        }), 500  # Use 500 for server-side errors
+    outbox_pool.ensure_started(len(senders) * SENDER_CONNECTIONS)
+    outbox_pool.notify()
 
-    logger.info("All screenshots captured successfully.")
-    return jsonify({"status": "success", "message": "Screenshots captured successfully."}), 200
+    return {
+        "status": "queued",
+        "message": "Emails queued for delivery.",
+        "batch_id": batch_id,
+        "skipped_emails": skipped_emails,
+        "queued_emails": recipients,
+        "failed_senders": failed_senders,
+    }
 
 
-@app.route('/send-email', methods=['POST'])
-def send_email():
+def batch_status(db, batch_id):
     """
-    Send an email with a resized image for compatibility with email clients.
+    Return the delivery progress of an outbox batch, or None if the batch is unknown:
+    the recipients by outcome, the message counts per sender and state, and whether every
+    message has reached 'sent' or 'dead'.
     """
-    data = request.get_json()
-    logger.debug(f"Received email data: {data}")
-
-    # Validate input data
-    required_fields = {"email", "password", "receiver"}
-    if not data or not required_fields.issubset(data.keys()):
-        logger.error("Invalid email input data received.")
-        return jsonify({"status": "error",
-                        "message": "Invalid input data. Required fields: 'email', 'password', 'receiver'."}), 400
+    rows = db.execute(
+        "SELECT sender_email, recipient_email, state FROM outbox WHERE batch_id = ? ORDER BY id", (batch_id,)
+    ).fetchall()
+    if not rows:
+        return None
+    sent_emails, failed_emails, queued_emails = [], [], []
+    sender_counts = {}
+    for row in rows:
+        if row["state"] == 'sent':
+            sent_emails.append(row["recipient_email"])
+        elif row["state"] == 'dead':
+            failed_emails.append(row["recipient_email"])
+        else:
+            queued_emails.append(row["recipient_email"])
+        counts = sender_counts.setdefault(row["sender_email"], {})
+        counts[row["state"]] = counts.get(row["state"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "done": not queued_emails,
+        "sent_emails": sent_emails,
+        "failed_emails": failed_emails,
+        "queued_emails": queued_emails,
+        "senders": sender_counts,
+    }
 
-    sender_email = data["email"]
-    sender_password = data["password"]
-    recipient_emails = data["receiver"] if isinstance(data["receiver"], list) else [data["receiver"]]
 
-    # Image paths
-    image_path = Path(BASE_DIR, 'images', 'full_page_screenshot.png')  # Update with actual path
-    resized_image_path = Path(BASE_DIR, 'images', 'resized_screenshot.png')
+@app.route('/outbox', methods=['GET'])
+def get_outbox():
+    """
+    Endpoint to inspect the outbox: message counts by state and the dead-lettered messages.
+    Accepts an optional 'batch_id' query parameter.
+    """
+    batch_id = request.args.get('batch_id')
+    try:
+        db = get_db()
+        where, params = ("WHERE batch_id = ?", (batch_id,)) if batch_id else ("", ())
+        counts = {row["state"]: row["count"] for row in db.execute(
+            f"SELECT state, COUNT(*) AS count FROM outbox {where} GROUP BY state", params)}
+        dead_where = "WHERE state = 'dead'" + (" AND batch_id = ?" if batch_id else "")
+        dead = [dict(row) for row in db.execute(
+            f"SELECT id, batch_id, recipient_email, attempts, last_error, updated_at FROM outbox {dead_where}",
+            params)]
+        return jsonify({"status": "success", "counts": counts, "dead_letters": dead,
+                        "senders": outbox_pool.sender_status()}), 200
+    except Exception as e:
+        logger.exception("An error occurred while reading the outbox.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
-    # Resize the image
-    if not resize_image(image_path, resized_image_path, (870, 490)):
-        return jsonify({"status": "error", "message": "Failed to process image."}), 500
 
-    # Create email content
+@app.route('/outbox/<batch_id>', methods=['GET'])
+def get_outbox_batch(batch_id):
+    """
+    Endpoint polled after /send-email: the delivery progress of one batch (see batch_status).
+    """
     try:
-        html_content = create_html_body()
+        status = batch_status(get_db(), batch_id)
+        if status is None:
+            return jsonify({"status": "error", "message": f"Unknown batch '{batch_id}'."}), 404
+        return jsonify({"status": "success", **status}), 200
     except Exception as e:
-        logger.error(f"Error creating email HTML content: {e}")
-        return jsonify({"status": "error", "message": "Failed to create email content."}), 500
+        logger.exception("An error occurred while reading an outbox batch.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
-    # Send emails
-    response = send_emails(sender_email, sender_password, recipient_emails, html_content, resized_image_path)
-    return jsonify(response), 200 if response["status"] == "success" else 500
 
+@app.route('/outbox/retry', methods=['POST'])
+def retry_outbox():
+    """
+    Endpoint to requeue dead-lettered messages.
+    Accepts an optional JSON payload with 'ids'; all dead letters are requeued otherwise.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        logger.error("Invalid ids received for outbox retry.")
+        return jsonify({"status": "error", "message": "The 'ids' field must be a list of integers."}), 400
 
-def resize_image(image_path, output_path, size):
-    """Resize an image and save it to the specified path."""
     try:
-        with Image.open(image_path) as img:
-            img = img.resize(size)
-            img.save(output_path)
-        logger.debug(f"Image resized to {size} and saved at {output_path}")
-        return True
+        db = get_db()
+        sql = ("UPDATE outbox SET state = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+               "WHERE state = 'dead'")
+        params = [time.time(), datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+        if ids:
+            sql += f" AND id IN ({', '.join(['?'] * len(ids))})"
+            params.extend(ids)
+        cursor = db.execute(sql, params)
+        db.commit()
+        outbox_pool.notify()
+        logger.info(f"Requeued {cursor.rowcount} dead-lettered message(s).")
+        return jsonify({"status": "success", "requeued": cursor.rowcount}), 200
     except Exception as e:
-        logger.error(f"Error resizing image: {e}")
-        return False
+        logger.exception("An error occurred while requeuing outbox messages.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
 
-def create_html_body():
-    """Create the HTML body for the email."""
-    return '''
-<html>
-<body style="margin: 0; padding: 0; background-color: #f4f4f4;">
-    <table width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; margin: 0; padding: 0; background-color: #f4f4f4;">
-        <tr>
-            <td align="center" style="padding: 20px;">
-                <img src="cid:image1" alt="Daily Report" style="width: 100%; max-width: 1366px; height: auto;">
-            </td>
-        </tr>
-        <!-- Buttons Row -->
-        <tr>
-            <td>
-                <table width="100%" cellpadding="0" cellspacing="0" border="0" style="border-collapse: collapse; margin: 0 auto; max-width: 1366px;">
-                    <tr>
-                        <!-- Left Aligned Button -->
-                        <td align="left" style="padding: 10px;">
-                            <a href="https://weather.tomorrow.io/widget/" style="background-color: #1d3361; color: white; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
-                                CLICK HERE FOR <span style="color: #ed1c24;">LIVE</span> VIEW!
-                            </a>
-                        </td>
+@app.route('/outbox/resume', methods=['POST'])
+def resume_outbox():
+    """
+    Endpoint to resume delivery of pending messages after a restart.
+    Expects a JSON payload with the sender 'email' and 'password', and optionally its 'quota' and 'rate'.
+    """
+    data = request.get_json()
+    if not data or 'email' not in data or 'password' not in data:
+        logger.error("Invalid input data received for outbox resume.")
+        return jsonify({"status": "error", "message": "Invalid input data. Required fields: 'email', 'password'."}), 400
+    try:
+        sender_email, sender_password, quota, rate = parse_sender(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-                        <!-- Centered Button 1 -->
-                        <td align="center" style="padding: 10px;">
-                            <a href="https://www.massport.com/logan-airport/flights/flight-status#departure" style="background-color: #edba25; color: #1d3359; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
-                                PRESS FOR DEPARTURES
-                            </a>
-                        </td>
+    error = verify_sender(sender_email, sender_password)
+    if error is not None:
+        return jsonify({"status": "error", "message": error}), 401 if error == "Authentication failed." else 500
 
-                        <!-- Centered Button 2 -->
-                        <td align="center" style="padding: 10px;">
-                            <a href="https://www.massport.com/logan-airport/flights/flight-status" style="background-color: #edba25; color: #1d3359; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
-                                PRESS FOR ARRIVALS
-                            </a>
-                        </td>
+    outbox_pool.set_credentials(sender_email, sender_password, quota=quota, rate=rate)
+    outbox_pool.ensure_started()
+    pending = get_db().execute(
+        "SELECT COUNT(*) FROM outbox WHERE state = 'pending' AND sender_email = ?", (data['email'],)
+    ).fetchone()[0]
+    logger.info(f"Outbox resumed for {data['email']} with {pending} pending message(s).")
+    return jsonify({"status": "success", "pending": pending}), 200
 
-                        <!-- Right Aligned Button -->
-                        <td align="right" style="padding: 10px;">
-                            <a href="https://metar-taf.com/livestream/KBOS?zoom=88" style="background-color: #1d3361; color: white; padding: 10px 20px; text-decoration: none; font-weight: bold; border-radius: 24px; display: inline-block;">
-                                CLICK HERE FOR <span style="color: #ed1c24;">LIVE</span> WEATHER VIEW!
-                            </a>
-                        </td>
-                    </tr>
-                </table>
-            </td>
-        </tr>
-    </table>
+
+UNSUBSCRIBE_CONFIRM_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Unsubscribe</title></head>
+<body style="font-family: Arial, sans-serif; text-align: center; padding: 40px;">
+<p>Stop sending the daily report to <strong>{email}</strong>?</p>
+<form method="post">
+<input type="hidden" name="email" value="{email}">
+<input type="hidden" name="token" value="{token}">
+<button type="submit">Unsubscribe</button>
+</form>
 </body>
 </html>
-    '''
+"""
 
 
-def send_emails(sender_email, sender_password, recipient_emails, html_content, attachment_path):
-    """Send emails to the recipients."""
-    sent_emails, skipped_emails, failed_emails = [], [], []
-    db = get_db()
-    cursor = db.cursor()
+@app.route('/unsubscribe', methods=['GET', 'POST'])
+def unsubscribe():
+    """
+    Endpoint linked from personalized emails.
+
+    GET only shows a confirmation page, so mail scanners and link prefetchers that follow the
+    link do not remove anyone; the recipient is removed on POST, either from that page or from
+    a one-click List-Unsubscribe request, when the token matches.
+    """
+    email = request.values.get('email', '').strip()
+    token = request.values.get('token', '')
+    expected = make_unsubscribe_token(email).encode('ascii')
+    if not email or not hmac.compare_digest(token.encode('utf-8'), expected):
+        logger.warning(f"Invalid unsubscribe request for: {email}")
+        return jsonify({"status": "error", "message": "Invalid unsubscribe link."}), 400
+
+    if request.method == 'GET':
+        page = UNSUBSCRIBE_CONFIRM_PAGE.format(email=html.escape(email, quote=True),
+                                               token=html.escape(token, quote=True))
+        return Response(page, mimetype='text/html')
 
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, sender_password)
-            logger.info("SMTP server connection established.")
+        db = get_db()
+        cursor = db.cursor()
+        canonical = normalize_email(email) or email.strip()
+        cursor.execute("DELETE FROM emails WHERE email = ?", (canonical,))
+        db.commit()
+        recipient_cache.apply(db, cursor.rowcount, removed=[canonical])
+        logger.info(f"Email '{email}' unsubscribed.")
+        return jsonify({"status": "success", "message": f"Email '{email}' has been unsubscribed."}), 200
+    except Exception as e:
+        logger.exception("An error occurred while unsubscribing the email.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
-            for recipient_email in recipient_emails:
-                try:
-                    # Check email status in the database
-                    cursor.execute("SELECT status FROM emails WHERE email = ?", (recipient_email,))
-                    result = cursor.fetchone()
-
-                    if result and result["status"] == 'sent':
-                        logger.info(f"Skipping email to {recipient_email}, already sent.")
-                        skipped_emails.append(recipient_email)
-                        continue
-
-                    # Create email message
-                    msg = MIMEMultipart('related')
-                    msg['From'] = sender_email
-                    msg['To'] = recipient_email
-                    msg['Subject'] = "Daily Report"
-
-                    msg_alternative = MIMEMultipart('alternative')
-                    msg.attach(msg_alternative)
-                    msg_alternative.attach(MIMEText(html_content, 'html'))
-
-                    # Attach the image
-                    with open(attachment_path, 'rb') as img_file:
-                        img_data = img_file.read()
-                        msg_image = MIMEImage(img_data)
-                        msg_image.add_header('Content-ID', '<image1>')
-                        msg.attach(msg_image)
-
-                    # Send email
-                    server.sendmail(sender_email, recipient_email, msg.as_string())
-                    sent_emails.append(recipient_email)
-
-                    # Update database
-                    cursor.execute("UPDATE emails SET status = 'sent' WHERE email = ?", (recipient_email,))
-                    db.commit()
 
-                except Exception as e:
-                    logger.error(f"Failed to send email to {recipient_email}: {e}")
-                    failed_emails.append(recipient_email)
+RECIPIENT_EVENT_HISTORY = 256
+RECIPIENT_STREAM_KEEPALIVE = 15  # Seconds between SSE keepalives; also how often writes from other processes are noticed
 
-    except smtplib.SMTPAuthenticationError:
-        logger.error("Authentication failed. Check your email and app password.")
-        return {"status": "error", "message": "Authentication failed."}
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return {"status": "error", "message": str(e)}
 
-    return {
-        "status": "success",
-        "message": "Emails processed successfully.",
-        "sent_emails": sent_emails,
-        "skipped_emails": skipped_emails,
-        "failed_emails": failed_emails,
-    }
+class RecipientCache:
+    """
+    Process-local copy of the 'emails' table, indexed by address and by status.
+    Writers call apply() after committing; the 'emails' version counter (bumped by triggers
+    for every changed row) tells whether anything else wrote in between, in which case
+    the cache reloads from the database instead of patching itself.
+    """
+
+    def __init__(self, history=RECIPIENT_EVENT_HISTORY):
+        self._lock = threading.Condition()  # Reentrant; also wakes SSE subscribers
+        self._by_email = {}
+        self._by_status = {}
+        self._sorted = {}
+        self._events = deque(maxlen=history)
+        self.version = None
+
+    @staticmethod
+    def read_version(db):
+        row = db.execute("SELECT version FROM table_versions WHERE name = 'emails'").fetchone()
+        return row[0] if row else 0
+
+    def _index(self, row):
+        self._by_email[row["email"]] = row
+        self._by_status.setdefault(row["status"], {})[row["email"]] = row
+
+    def _unindex(self, email):
+        row = self._by_email.pop(email, None)
+        if row is not None:
+            self._by_status.get(row["status"], {}).pop(email, None)
+        return row
+
+    def _emit(self, event):
+        event["since"] = self.version
+        self.version = event["version"]
+        self._sorted.clear()
+        self._events.append(event)
+        self._lock.notify_all()
+
+    def _reload(self, db, version):
+        rows = db.execute('SELECT id, email, status, date_added FROM emails').fetchall()
+        self._by_email.clear()
+        self._by_status.clear()
+        for row in rows:
+            self._index(dict(row))
+        self._emit({"version": version, "reload": True})
+        logger.debug(f"Recipient cache loaded {len(rows)} emails at version {version}.")
+
+    def refresh(self, db):
+        """
+        Reload the cache if the table changed behind its back. Returns the current version.
+        """
+        version = self.read_version(db)
+        with self._lock:
+            if version != self.version:
+                self._reload(db, version)
+        return version
+
+    def apply(self, db, changed, added=(), updates=(), removed=(), status_all=None):
+        """
+        Write through a committed change of `changed` rows:
+        - added: full rows that were inserted.
+        - updates: {'email', 'new_email'?, 'status'?} for rows that were updated.
+        - removed: addresses that were deleted.
+        - status_all: a status that was set on every row.
+        """
+        version = self.read_version(db)
+        with self._lock:
+            if self.version is None or version != self.version + changed:
+                self._reload(db, version)
+                return
+            if changed == 0:
+                return
+
+            removed_emails = []
+            upserted = {}
+            for email in removed:
+                if self._unindex(email) is not None:
+                    removed_emails.append(email)
+            for row in added:
+                self._index(dict(row))
+                upserted[row["email"]] = row
+            if status_all is not None:
+                updates = [{"email": email, "status": status_all} for email in list(self._by_email)]
+            for update in updates:
+                row = self._unindex(update["email"])
+                if row is None:
+                    continue
+                row = dict(row, email=update.get("new_email", row["email"]), status=update.get("status", row["status"]))
+                if row["email"] != update["email"]:
+                    removed_emails.append(update["email"])
+                    upserted.pop(update["email"], None)
+                self._index(row)
+                upserted[row["email"]] = row
+
+            self._emit({"version": version, "removed": removed_emails, "upserted": list(upserted.values())})
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+
+    def rows(self, db, status=None):
+        """
+        Return the cached rows in insertion (id) order, optionally only those with the given status.
+        """
+        self.refresh(db)
+        with self._lock:
+            return self._rows(status)
+
+    def _rows(self, status=None):
+        if status not in self._sorted:
+            source = self._by_email if status is None else self._by_status.get(status, {})
+            self._sorted[status] = sorted(source.values(), key=lambda row: row["id"])
+        return self._sorted[status]
+
+    def get(self, db, email):
+        self.refresh(db)
+        with self._lock:
+            return self._by_email.get(email)
+
+    def snapshot(self):
+        with self._lock:
+            return self.version, self._rows()
+
+    def events_since(self, version):
+        """
+        Return the change events after `version`, or None when the history does not reach back
+        that far or the table was reloaded in between (the subscriber needs a new snapshot).
+        """
+        with self._lock:
+            if version == self.version:
+                return []
+            events = list(self._events)
+            for index, event in enumerate(events):
+                if event["since"] == version:
+                    pending = events[index:]
+                    if any(event.get("reload") for event in pending):
+                        return None
+                    return pending
+            return None
+
+    def wait_for_events(self, version, timeout):
+        with self._lock:
+            self._lock.wait_for(lambda: self.version != version, timeout)
+            return self.events_since(version)
+
+
+recipient_cache = RecipientCache()
+
+
+def format_sse(event, data, event_id=None):
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@app.route('/emails/stream', methods=['GET'])
+def stream_emails():
+    """
+    Server-Sent Events stream of changes to the email list.
+    The first message is a 'snapshot' with every email (or, when reconnecting with a
+    Last-Event-ID the server still has history for, just the missed changes); after that each
+    'change' message carries the version plus the 'removed' addresses and 'upserted' rows.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('version')
+    try:
+        last_version = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_version = None
+
+    def snapshot_message():
+        version, rows = recipient_cache.snapshot()
+        return version, format_sse('snapshot', {"version": version, "emails": rows}, version)
+
+    def generate():
+        db = get_outbox_connection()
+        try:
+            recipient_cache.refresh(db)
+            events = recipient_cache.events_since(last_version) if last_version is not None else None
+            if events is None:
+                version, message = snapshot_message()
+                yield message
+            else:
+                version = last_version
+                for event in events:
+                    version = event["version"]
+                    yield format_sse('change', event, version)
+
+            while True:
+                events = recipient_cache.wait_for_events(version, RECIPIENT_STREAM_KEEPALIVE)
+                if events is None:
+                    version, message = snapshot_message()
+                    yield message
+                elif not events:
+                    # Idle: pick up writes made outside this process, then keep the connection alive
+                    recipient_cache.refresh(db)
+                    yield ": keepalive\n\n"
+                else:
+                    for event in events:
+                        version = event["version"]
+                        yield format_sse('change', event, version)
+        finally:
+            db.close()
+            logger.debug("Email change stream closed.")
+
+    logger.info("Client subscribed to email changes.")
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/get-emails', methods=['GET'])
 def get_emails():
     """
-    Endpoint to retrieve all email addresses from the database.
+    Endpoint to retrieve all email addresses from the recipient cache.
     Returns all fields: id, email, status, date_added.
+    Accepts an optional 'status' query parameter to return only emails with that status.
     """
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('SELECT id, email, status, date_added FROM emails')
-        rows = cursor.fetchall()
-        emails = [{"id": row["id"], "email": row["email"], "status": row["status"], "date_added": row["date_added"]} for
-                  row in rows]
-        logger.info("Retrieved all emails from the database.")
+        emails = recipient_cache.rows(get_db(), status=request.args.get('status'))
+        logger.info("Retrieved all emails from the recipient cache.")
         return jsonify({"status": "success", "emails": emails}), 200
     except Exception as e:
         logger.exception("An error occurred while retrieving emails.")
@@ -959,11 +7235,10 @@ def add_email_route():
         logger.error("Invalid input data received for add-email.")
         return jsonify({"status": "error", "message": "Invalid input data. Required field: 'email'."}), 400
 
-    email = data['email'].strip()
-
-    # Validate the email format
-    if not is_valid_email(email):
-        logger.error(f"Invalid email format received: {email}")
+    # Validate the email format and store its canonical form
+    email = normalize_email(data['email'])
+    if email is None:
+        logger.error(f"Invalid email format received: {data['email']}")
         return jsonify({"status": "error", "message": "Invalid email format."}), 400
 
     # Insert the email into the database
@@ -974,6 +7249,8 @@ def add_email_route():
         # Explicitly set the 'status' to 'unsent' (optional since default is 'unsent')
         cursor.execute('INSERT INTO emails (email, status, date_added) VALUES (?, ?, ?)', (email, 'unsent', date_added))
         db.commit()
+        recipient_cache.apply(db, 1, added=[
+            {"id": cursor.lastrowid, "email": email, "status": 'unsent', "date_added": date_added}])
         logger.info(f"Email '{email}' added to the database with status 'unsent'.")
         return jsonify(
             {"status": "success", "message": f"Email '{email}' added successfully with status 'unsent'."}), 201
@@ -1009,27 +7286,29 @@ def add_emails():
         logger.error("The 'emails' list is empty.")
         return jsonify({"status": "error", "message": "The 'emails' list cannot be empty."}), 400
 
+    # Validate and canonicalize the whole list in one pass
+    valid_emails, invalid_emails = partition_emails(emails)
+    if invalid_emails:
+        logger.warning(f"Invalid email formats: {invalid_emails}")
+
     added_emails = []
     duplicate_emails = []
-    invalid_emails = []
+    added_rows = []
     current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     try:
         db = get_db()
         cursor = db.cursor()
 
-        for email in emails:
-            email = email.strip()
-            if not is_valid_email(email):
-                invalid_emails.append(email)
-                logger.warning(f"Invalid email format: {email}")
-                continue
+        for email in valid_emails:
             try:
                 cursor.execute(
                     'INSERT INTO emails (email, status, date_added) VALUES (?, ?, ?)',
                     (email, 'unsent', current_timestamp)
                 )
                 added_emails.append(email)
+                added_rows.append(
+                    {"id": cursor.lastrowid, "email": email, "status": 'unsent', "date_added": current_timestamp})
                 logger.info(f"Email '{email}' added to the database with status 'unsent'.")
             except sqlite3.IntegrityError:
                 duplicate_emails.append(email)
@@ -1037,14 +7316,14 @@ def add_emails():
                 continue
 
         db.commit()
+        recipient_cache.apply(db, len(added_rows), added=added_rows)
 
-        response = {
-            "status": "success",
-            "message": "Bulk email addition completed.",
-            "added_emails": added_emails,
-            "duplicate_emails": duplicate_emails,
-            "invalid_emails": invalid_emails
-        }
+        response = bulk_result(
+            {"status": "success", "message": "Bulk email addition completed."},
+            added_emails=added_emails,
+            duplicate_emails=duplicate_emails,
+            invalid_emails=invalid_emails
+        )
 
         return jsonify(response), 201
 
@@ -1059,20 +7338,23 @@ def delete_email(email):
     Endpoint to delete an email address from the database based on the email address.
     """
     logger.debug(f"Received delete-email request for email {email}.")
+    email = normalize_email(email) or email.strip()
     try:
         db = get_db()
         cursor = db.cursor()
 
-        # Check if the email exists
-        cursor.execute("SELECT id FROM emails WHERE email = ?", (email,))
-        result = cursor.fetchone()
-        if not result:
+        # Unknown addresses are answered from the cache without a write transaction
+        if recipient_cache.get(db, email) is None:
             logger.error(f"Email '{email}' not found.")
             return jsonify({"status": "error", "message": f"Email '{email}' not found."}), 404
 
-        # Delete the email
+        # Delete the email; the row count tells whether it still existed
         cursor.execute("DELETE FROM emails WHERE email = ?", (email,))
         db.commit()
+        recipient_cache.apply(db, cursor.rowcount, removed=[email])
+        if cursor.rowcount == 0:
+            logger.error(f"Email '{email}' not found.")
+            return jsonify({"status": "error", "message": f"Email '{email}' not found."}), 404
 
         logger.info(f"Email '{email}' deleted successfully.")
         return jsonify({"status": "success", "message": f"Email '{email}' deleted successfully."}), 200
@@ -1082,6 +7364,105 @@ def delete_email(email):
         return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
 
+# SQLite's default limit on host parameters per statement for older builds
+SQLITE_MAX_PARAMS = 999
+
+_sqlite_set_based = None
+
+
+def sqlite_supports_set_based(db):
+    """
+    Return True when SQLite has json_each, UPDATE ... FROM and RETURNING (3.35+), which lets
+    batch mutations run as a single statement over a JSON array parameter.
+    """
+    global _sqlite_set_based
+    if _sqlite_set_based is None:
+        try:
+            db.execute("SELECT value FROM json_each('[]')").fetchall()
+            _sqlite_set_based = sqlite3.sqlite_version_info >= (3, 35, 0)
+        except sqlite3.OperationalError:
+            _sqlite_set_based = False
+        logger.debug(f"SQLite {sqlite3.sqlite_version} set-based batch statements: {_sqlite_set_based}")
+    return _sqlite_set_based
+
+
+def _chunks(items, size=SQLITE_MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def batch_delete_emails(db, emails):
+    """
+    Delete the given emails and return the list of addresses that were actually deleted.
+    Runs as one DELETE ... RETURNING over a JSON array, or in parameter-limit-sized chunks
+    on older SQLite builds.
+    """
+    if sqlite_supports_set_based(db):
+        rows = db.execute(
+            "DELETE FROM emails WHERE email IN (SELECT value FROM json_each(?)) RETURNING email",
+            (json.dumps(emails),)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    deleted = []
+    for chunk in _chunks(emails):
+        placeholders = ', '.join(['?'] * len(chunk))
+        deleted += [row[0] for row in db.execute(f"SELECT email FROM emails WHERE email IN ({placeholders})", chunk)]
+        db.execute(f"DELETE FROM emails WHERE email IN ({placeholders})", chunk)
+    return deleted
+
+
+def batch_update_emails(db, updates):
+    """
+    Apply a list of updates ({'email': ..., 'new_email'?: ..., 'status'?: ...}) and return the
+    original addresses that were found and updated. Runs as one UPDATE ... FROM json_each
+    ... RETURNING, or as one executemany on older SQLite builds.
+    No new address may be another update's address or the target of a second rename
+    (see find_conflicting_renames); the two strategies would disagree on such chains.
+    Raises sqlite3.IntegrityError if a new address already exists.
+    """
+    if sqlite_supports_set_based(db):
+        rows = db.execute(
+            """
+            UPDATE emails
+               SET email = coalesce(json_extract(u.value, '$.new_email'), emails.email),
+                   status = coalesce(json_extract(u.value, '$.status'), emails.status)
+              FROM json_each(?) AS u
+             WHERE emails.email = json_extract(u.value, '$.email')
+            RETURNING email
+            """,
+            (json.dumps(updates),)
+        ).fetchall()
+        # RETURNING only sees the new row, so map final addresses back to the requested ones
+        originals = {update.get("new_email", update["email"]): update["email"] for update in updates}
+        return [originals.get(row[0], row[0]) for row in rows]
+
+    emails = [update["email"] for update in updates]
+    found = []
+    for chunk in _chunks(emails):
+        placeholders = ', '.join(['?'] * len(chunk))
+        found += [row[0] for row in db.execute(f"SELECT email FROM emails WHERE email IN ({placeholders})", chunk)]
+    db.executemany(
+        "UPDATE emails SET email = coalesce(?, email), status = coalesce(?, status) WHERE email = ?",
+        [(update.get("new_email"), update.get("status"), update["email"]) for update in updates]
+    )
+    return found
+
+
+def find_conflicting_renames(updates):
+    """
+    Return the new addresses in a batch of updates that cannot be applied in one statement:
+    renames onto an address another update changes (a -> b, b -> c), or several renames onto one address.
+    """
+    sources = {update["email"] for update in updates}
+    targets = {}
+    for update in updates:
+        new_email = update.get("new_email")
+        if new_email is not None and new_email != update["email"]:
+            targets[new_email] = targets.get(new_email, 0) + 1
+    return sorted(new_email for new_email, count in targets.items() if count > 1 or new_email in sources)
+
+
 @app.route('/delete-emails', methods=['POST'])
 def delete_emails():
     """
@@ -1106,39 +7487,34 @@ def delete_emails():
         logger.error("The 'emails' list is empty.")
         return jsonify({"status": "error", "message": "The 'emails' list cannot be empty."}), 400
 
-    # Normalize emails to lowercase to ensure consistency
-    emails = [email.strip().lower() for email in emails if is_valid_email(email.strip())]
+    # Normalize emails to their canonical form to match how they are stored
+    emails, invalid_emails = partition_emails(emails)
 
     if not emails:
         logger.error("No valid email addresses provided for deletion.")
         return jsonify({"status": "error", "message": "No valid email addresses provided for deletion."}), 400
 
+    # Remove duplicates while keeping the request order
+    emails = list(dict.fromkeys(emails))
+
     try:
         db = get_db()
-        cursor = db.cursor()
-
-        # Prepare placeholders for the SQL IN clause
-        placeholders = ', '.join(['?'] * len(emails))
-        query = f"DELETE FROM emails WHERE email IN ({placeholders})"
 
-        cursor.execute(query, tuple(emails))
+        # Delete in one statement; the deleted addresses come back from the same statement
+        deleted_emails = batch_delete_emails(db, emails)
         db.commit()
+        recipient_cache.apply(db, len(deleted_emails), removed=deleted_emails)
 
-        deleted_count = cursor.rowcount
+        deleted_count = len(deleted_emails)
+        deleted_set = set(deleted_emails)
+        not_found_emails = [email for email in emails if email not in deleted_set]
 
-        # Determine which emails were not found (i.e., not deleted)
-        # Fetch existing emails to compare
-        cursor.execute(f"SELECT email FROM emails WHERE email IN ({placeholders})", tuple(emails))
-        existing_emails = {row["email"] for row in cursor.fetchall()}
-        not_found_emails = list(set(emails) - existing_emails)
-
-        response = {
-            "status": "success",
-            "message": "Batch deletion completed.",
-            "deleted_count": deleted_count,
-            "deleted_emails": emails if not not_found_emails else list(existing_emails),
-            "not_found_emails": not_found_emails
-        }
+        response = bulk_result(
+            {"status": "success", "message": "Batch deletion completed."},
+            deleted_emails=deleted_emails,
+            not_found_emails=not_found_emails,
+            invalid_emails=invalid_emails
+        )
 
         logger.info(f"Batch deletion completed. Deleted {deleted_count} emails.")
         if not_found_emails:
@@ -1159,6 +7535,7 @@ def update_email(email):
     """
     data = request.get_json()
     logger.debug(f"Received update-email data for email '{email}': {data}")
+    email = normalize_email(email) or email.strip()
 
     if not data:
         logger.error("No data provided for update.")
@@ -1166,9 +7543,9 @@ def update_email(email):
 
     fields_to_update = {}
     if 'email' in data:
-        new_email = data['email'].strip()
-        if not is_valid_email(new_email):
-            logger.error(f"Invalid email format received for update: {new_email}")
+        new_email = normalize_email(data['email'])
+        if new_email is None:
+            logger.error(f"Invalid email format received for update: {data['email']}")
             return jsonify({"status": "error", "message": "Invalid email format."}), 400
         fields_to_update['email'] = new_email
 
@@ -1187,21 +7564,22 @@ def update_email(email):
         db = get_db()
         cursor = db.cursor()
 
-        # Check if the original email exists
-        cursor.execute("SELECT id FROM emails WHERE email = ?", (email,))
-        result = cursor.fetchone()
-        if not result:
-            logger.error(f"Email '{email}' not found.")
-            return jsonify({"status": "error", "message": f"Email '{email}' not found."}), 404
-
         # Prepare the SET part of the SQL statement
         set_clause = ', '.join([f"{key} = ?" for key in fields_to_update.keys()])
         values = list(fields_to_update.values())
         values.append(email)  # For the WHERE clause
 
+        # Update in one statement; the row count tells whether the original email exists
         sql = f"UPDATE emails SET {set_clause} WHERE email = ?"
         cursor.execute(sql, tuple(values))
         db.commit()
+        update = {"email": email, "status": fields_to_update.get('status')}
+        if 'email' in fields_to_update:
+            update["new_email"] = fields_to_update['email']
+        recipient_cache.apply(db, cursor.rowcount, updates=[{k: v for k, v in update.items() if v is not None}])
+        if cursor.rowcount == 0:
+            logger.error(f"Email '{email}' not found.")
+            return jsonify({"status": "error", "message": f"Email '{email}' not found."}), 404
 
         logger.info(f"Email '{email}' updated successfully.")
         return jsonify({"status": "success", "message": f"Email '{email}' updated successfully."}), 200
@@ -1214,6 +7592,93 @@ def update_email(email):
         return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
 
+@app.route('/update-emails', methods=['POST'])
+def update_emails():
+    """
+    Endpoint to update multiple email addresses in one statement.
+    Expects a JSON payload with either:
+    - 'updates': a list of {'email': ..., 'new_email'?: ..., 'status'?: ...}, or
+    - 'emails' and 'status': set the same status on every listed address.
+    """
+    data = request.get_json()
+    logger.debug(f"Received update-emails data: {data}")
+
+    if not data or ('updates' not in data and 'emails' not in data):
+        logger.error("Invalid input data received for update-emails.")
+        return jsonify({"status": "error", "message": "Invalid input data. Required field: 'updates' or 'emails'."}), 400
+
+    if 'updates' in data:
+        raw_updates = data['updates']
+    else:
+        if not isinstance(data['emails'], list) or 'status' not in data:
+            logger.error("Bulk status update requires an 'emails' list and a 'status'.")
+            return jsonify({"status": "error", "message": "Bulk status update requires 'emails' (list) and 'status'."}), 400
+        raw_updates = [{"email": email, "status": data['status']} for email in data['emails']]
+
+    if not isinstance(raw_updates, list) or not raw_updates:
+        logger.error("The 'updates' list is empty or not a list.")
+        return jsonify({"status": "error", "message": "The 'updates' field must be a non-empty list."}), 400
+
+    updates = {}
+    invalid_updates = []
+    for update in raw_updates:
+        if not isinstance(update, dict) or not isinstance(update.get('email'), str):
+            invalid_updates.append(update)
+            continue
+        normalized = {"email": normalize_email(update['email']) or update['email'].strip()}
+        if 'new_email' in update:
+            new_email = normalize_email(update['new_email'])
+            if new_email is None:
+                invalid_updates.append(update)
+                continue
+            normalized['new_email'] = new_email
+        if 'status' in update:
+            new_status = str(update['status']).strip().lower()
+            if new_status not in ['sent', 'unsent']:
+                invalid_updates.append(update)
+                continue
+            normalized['status'] = new_status
+        if len(normalized) == 1:
+            invalid_updates.append(update)
+            continue
+        updates[normalized['email']] = normalized  # The last update for an address wins
+
+    if not updates:
+        logger.error("No valid updates provided.")
+        return jsonify({"status": "error", "message": "No valid updates provided.", "invalid_updates": invalid_updates}), 400
+
+    conflicting = find_conflicting_renames(list(updates.values()))
+    if conflicting:
+        logger.error(f"Chained or duplicate renames received: {conflicting}")
+        return jsonify({"status": "error",
+                        "message": "Renames may not target an address that another update changes or renames to.",
+                        "conflicting_emails": conflicting}), 400
+
+    try:
+        db = get_db()
+        updated_emails = batch_update_emails(db, list(updates.values()))
+        db.commit()
+        recipient_cache.apply(db, len(updated_emails), updates=[updates[email] for email in updated_emails])
+
+        updated_set = set(updated_emails)
+        not_found_emails = [email for email in updates if email not in updated_set]
+        logger.info(f"Batch update completed. Updated {len(updated_emails)} emails.")
+        return jsonify(bulk_result(
+            {"status": "success", "message": "Batch update completed."},
+            updated_emails=updated_emails,
+            not_found_emails=not_found_emails,
+            invalid_updates=invalid_updates
+        )), 200
+
+    except sqlite3.IntegrityError:
+        get_db().rollback()
+        logger.warning("Batch update would create duplicate email addresses.")
+        return jsonify({"status": "error", "message": "One or more updated email addresses already exist in the database."}), 409
+    except Exception as e:
+        logger.exception("An error occurred while updating emails.")
+        return jsonify({"status": "error", "message": "An internal error occurred."}), 500
+
+
 @app.route('/images/<path:filename>', methods=['GET'])
 def serve_image(filename):
     """
@@ -1236,9 +7701,17 @@ def serve_image(filename):
         abort(404, description="Image not found")
 
 
+mark_startup("module_loaded")
+
+
 if __name__ == '__main__':
     # Initialize the database when the application starts
     init_db()
+    init_outbox()
+    mark_startup("database_ready")
+
+    # Clean up browsers left running by a previous run that did not shut down cleanly
+    threading.Thread(target=browser_governor.reap_orphans, name="browser-reaper", daemon=True).start()
 
     # Check if a port was passed as an argument
     if len(sys.argv) > 1:
@@ -1250,4 +7723,6 @@ if __name__ == '__main__':
     else:
         port = 5000  # Default port
 
+    mark_startup("serving")
+    logger.info(f"Startup profile (ms): {json.dumps(STARTUP_TIMINGS)}")
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,54 @@
+"""
+Email address validation and normalization shared by the backend's routes, the mail queue and
+the database migration, so an address is stored, looked up and signed under one canonical form.
+"""
+import re
+
+# Compiled once; bound methods skip the re module's pattern cache lookup on every call
+EMAIL_PATTERN = re.compile(r'^([\w\.-]+)@([\w\.-]+\.\w+)$')
+_match_email = EMAIL_PATTERN.match
+
+
+def is_valid_email(email):
+    """
+    Validate the email address using a regex pattern.
+    Returns True if valid, False otherwise.
+    """
+    return _match_email(email) is not None
+
+
+def normalize_email(email):
+    """
+    Return the canonical form of an email address, or None if it is not valid.
+    The canonical form is trimmed, has a case-folded local part and an IDNA (punycode),
+    lower-case domain, so the same mailbox is stored and looked up under one key everywhere.
+    """
+    if not isinstance(email, str):
+        return None
+    match = _match_email(email.strip())
+    if match is None:
+        return None
+    local, domain = match.groups()
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    return f"{local.casefold()}@{domain.lower()}"
+
+
+def partition_emails(emails):
+    """
+    Validate and normalize a list of addresses in one pass.
+    Returns (valid, invalid): the canonical forms of the valid addresses in input order
+    (duplicates kept, so callers can report them), and the invalid inputs as received.
+    """
+    valid = []
+    invalid = []
+    for email in emails:
+        canonical = normalize_email(email)
+        if canonical is None:
+            invalid.append(email)
+        else:
+            valid.append(canonical)
+    return valid, invalid
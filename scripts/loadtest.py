@@ -0,0 +1,536 @@
+"""
+Load-test harness for the backend API.
+
+Boots the Flask app from backend.py against a throwaway base directory, with a fake browser
+(no Chrome) and a fake SMTP server (no network), then drives a weighted mix of concurrent
+requests through a real HTTP server and reports throughput, p50/p95/p99 latency and error
+rates per endpoint.
+
+Usage:
+    python loadtest.py --duration 30 --concurrency 16 --mix get-emails=70,add-emails=20,process-sites=5,send-email=5
+    python loadtest.py --output results.json
+    python loadtest.py --baseline results.json  # Exits with status 1 on a regression
+"""
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Default traffic mix: endpoint scenario -> relative weight
+DEFAULT_MIX = {"get-emails": 70, "add-emails": 20, "process-sites": 5, "send-email": 5}
+
+# Relative increase of an endpoint's p95 latency (or absolute increase of its error rate)
+# over the baseline that counts as a regression
+DEFAULT_MAX_REGRESSION = 0.2
+
+
+def solid_png(width, height, rgb=(200, 200, 200)):
+    """Encode a single-color RGB PNG without PIL."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    row = b'\x00' + bytes(rgb) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height, 1))
+            + chunk(b'IEND', b''))
+
+
+class FakeElement:
+    """Element returned by FakeDriver lookups."""
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def find_element(self, by=None, value=None):
+        return FakeElement(self._driver)
+
+    def find_elements(self, by=None, value=None):
+        return [FakeElement(self._driver) for _ in range(3)]
+
+    def screenshot(self, path):
+        Path(path).write_bytes(self._driver.png(400, 300))
+        return True
+
+
+class FakeDriver:
+    """
+    Just enough of a Selenium WebDriver for the backend's capture steps. Navigation takes the
+    configured latency and fails at the configured rate; screenshots are solid PNGs.
+    """
+
+    _png_cache = {}
+    _png_lock = threading.Lock()
+
+    def __init__(self, window_size, latency, failure_rate, rng):
+        self.width, self.height = map(int, window_size.split('x'))
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.current_window_handle = 'fake-window'
+        self.window_handles = [self.current_window_handle]
+
+    def png(self, width, height):
+        key = (width, height)
+        with self._png_lock:
+            if key not in self._png_cache:
+                self._png_cache[key] = solid_png(width, height)
+            return self._png_cache[key]
+
+    def set_window_size(self, width, height):
+        self.width, self.height = width, height
+
+    def get(self, url):
+        time.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        if self.rng.random() < self.failure_rate:
+            raise RuntimeError(f"Simulated navigation failure for {url}")
+
+    def find_element(self, by=None, value=None):
+        return FakeElement(self)
+
+    def find_elements(self, by=None, value=None):
+        return [FakeElement(self) for _ in range(3)]
+
+    def execute_script(self, script, *args):
+        if 'devicePixelRatio' in script:
+            return 1
+        if 'getBoundingClientRect' in script:
+            return {"x": 0, "y": 0, "width": 400, "height": 40}
+        return None
+
+    def execute_cdp_cmd(self, command, params):
+        if command == 'Page.getLayoutMetrics':
+            return {"cssContentSize": {"width": self.width, "height": self.height}}
+        if command == 'Page.captureScreenshot':
+            clip = params.get('clip') or {"width": self.width, "height": self.height}
+            png = self.png(int(clip['width']), int(clip['height']))
+            return {"data": base64.b64encode(png).decode('ascii')}
+        return {}
+
+    def get_screenshot_as_png(self):
+        return self.png(self.width, self.height)
+
+    def get_log(self, kind):
+        return []
+
+    def quit(self):
+        pass
+
+
+class FakeSMTPSocket:
+    def __init__(self, stats):
+        self._stats = stats
+
+    def sendall(self, data):
+        self._stats.add('smtp_bytes', len(data))
+
+
+class FakeSMTP:
+    """
+    Stand-in for smtplib.SMTP_SSL covering the calls the backend makes. Every message is accepted
+    after the configured latency, except for the configured rate of temporary failures.
+    """
+
+    def __init__(self, latency, failure_rate, rng, stats):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.stats = stats
+        self.sock = FakeSMTPSocket(stats)
+        self._replies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def login(self, user, password):
+        return 235, b'Accepted'
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def mail(self, sender):
+        return 250, b'OK'
+
+    def rcpt(self, recipient):
+        return 250, b'OK'
+
+    def putcmd(self, command, args=''):
+        if command.lower() == 'data':
+            self._replies = [(354, b'Go ahead')]
+
+    def getreply(self):
+        if self._replies:
+            return self._replies.pop(0)
+        # Reply to the end of the message body
+        time.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        if self.rng.random() < self.failure_rate:
+            return 451, b'Simulated temporary failure'
+        self.stats.add('smtp_messages', 1)
+        return 250, b'Queued'
+
+    def rset(self):
+        return 250, b'OK'
+
+    def quit(self):
+        return 221, b'Bye'
+
+    def close(self):
+        pass
+
+
+class Counters:
+    """Thread-safe named counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, amount):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+
+def boot_backend(base_dir, args, stats):
+    """
+    Import backend.py with BASE_DIR pointed at base_dir and install the fake browser and SMTP backends.
+    Returns the imported module.
+    """
+    for name in ('template', 'images'):
+        source = REPO_DIR / name
+        if source.is_dir():
+            shutil.copytree(source, base_dir / name, dirs_exist_ok=True)
+    (base_dir / 'images').mkdir(exist_ok=True)
+
+    os.environ['WINGSTAR_BASE_DIR'] = str(base_dir)
+    os.environ.setdefault('WINGSTAR_UNSUBSCRIBE_SECRET', 'load-test')
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import backend
+
+    backend.logger.setLevel(args.log_level)
+    # The dev server logs every request through werkzeug's own logger, not the backend's
+    logging.getLogger('werkzeug').setLevel(args.log_level)
+    backend.init_db()
+    backend.init_outbox()
+
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+
+    class LockedRandom:
+        def uniform(self, a, b):
+            with rng_lock:
+                return rng.uniform(a, b)
+
+        def random(self):
+            with rng_lock:
+                return rng.random()
+
+    shared_rng = LockedRandom()
+
+    def create_driver(window_size="1920x1080", offline=False, performance_log=False):
+        backend.browser_governor.acquire()
+        driver = FakeDriver(window_size, args.browser_latency, args.browser_failure_rate, shared_rng)
+        backend.browser_governor.register(driver)
+        stats.add('browser_launches', 1)
+        return driver
+
+    backend.create_driver = create_driver
+    backend.playwright_engine.unavailable = "disabled by the load-test harness"
+    backend.open_smtp_connection = lambda: FakeSMTP(args.smtp_latency, args.smtp_failure_rate, shared_rng, stats)
+
+    # The report screenshot send-email attaches; process-sites overwrites it during the run
+    (base_dir / 'images' / 'full_page_screenshot.png').write_bytes(solid_png(1920, 1080))
+    return backend
+
+
+def start_server(app):
+    """Serve the app on an ephemeral localhost port in a background thread. Returns (server, port)."""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+    return server, server.server_port
+
+
+class Scenarios:
+    """Builds the request for each endpoint scenario: (method, path, JSON body or None)."""
+
+    def __init__(self, args):
+        self.args = args
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.known_emails = []
+
+    def _next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def _remember(self, emails):
+        with self._lock:
+            self.known_emails.extend(emails)
+            del self.known_emails[:-1000]
+
+    def _sample(self, count):
+        with self._lock:
+            return random.sample(self.known_emails, min(count, len(self.known_emails)))
+
+    def seed(self, send):
+        """Store the initial recipients, in batches through the API itself."""
+        for start in range(0, self.args.seed_emails, 500):
+            emails = [f"seed{index}@loadtest.example" for index in range(start, min(start + 500, self.args.seed_emails))]
+            status, _ = send('POST', '/add-emails', {"emails": emails})
+            if status >= 400:
+                raise RuntimeError(f"Seeding recipients failed with HTTP {status}.")
+            self._remember(emails)
+
+    def build(self, name):
+        return getattr(self, name.replace('-', '_'))()
+
+    def get_emails(self):
+        return 'GET', '/get-emails', None
+
+    def add_emails(self):
+        batch = self._next_id()
+        emails = [f"user{batch}.{index}@loadtest.example" for index in range(self.args.batch_size)]
+        self._remember(emails)
+        return 'POST', '/add-emails', {"emails": emails}
+
+    def update_emails(self):
+        return 'POST', '/update-emails', {"emails": self._sample(self.args.batch_size), "status": "unsent"}
+
+    def delete_emails(self):
+        return 'POST', '/delete-emails', {"emails": self._sample(self.args.batch_size)}
+
+    def process_sites(self):
+        return 'POST', '/process-sites', {
+            "data": [{"title": f"Box {index}", "percentage": random.randint(0, 100)} for index in range(1, 5)],
+            "comments": ["Load test"],
+            "timer": 0.01,
+            "sites": [{
+                "url": f"https://site{index}.loadtest.example/",
+                "full_page": True,
+                "full_screenshot_file": f"loadtest_site{index}.png",
+                "engine": "selenium",
+            } for index in range(self.args.sites_per_run)],
+        }
+
+    def send_email(self):
+        return 'POST', '/send-email', {
+            "email": "sender@loadtest.example",
+            "password": "load-test",
+            "receiver": self._sample(self.args.batch_size),
+            "batch_id": f"loadtest-{self._next_id()}",
+        }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    """Per-endpoint and overall statistics from (endpoint, status, latency_s) samples."""
+    groups = {}
+    for endpoint, status, latency in samples:
+        groups.setdefault(endpoint, []).append((status, latency))
+    groups["all"] = [(status, latency) for _, status, latency in samples]
+
+    results = {}
+    for endpoint, entries in groups.items():
+        latencies = sorted(latency * 1000 for _, latency in entries)
+        errors = sum(1 for status, _ in entries if status is None or status >= 400)
+        statuses = {}
+        for status, _ in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[endpoint] = {
+            "requests": len(entries),
+            "throughput_rps": round(len(entries) / elapsed, 2) if elapsed else None,
+            "error_rate": round(errors / len(entries), 4) if entries else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50), 2) if latencies else None,
+                "p95": round(percentile(latencies, 0.95), 2) if latencies else None,
+                "p99": round(percentile(latencies, 0.99), 2) if latencies else None,
+                "max": round(latencies[-1], 2) if latencies else None,
+            },
+            "statuses": statuses,
+        }
+    return results
+
+
+def run_load(port, scenarios, mix, args):
+    """Drive the mix with args.concurrency workers for args.duration seconds. Returns (samples, elapsed)."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    samples_lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def worker(worker_id):
+        rng = random.Random(args.seed + worker_id)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=args.timeout)
+        local = []
+        try:
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights)[0]
+                method, path, body = scenarios.build(name)
+                payload = json.dumps(body).encode('utf-8') if body is not None else None
+                headers = {"Content-Type": "application/json"} if payload is not None else {}
+                start = time.perf_counter()
+                status = None
+                try:
+                    connection.request(method, path, body=payload, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=args.timeout)
+                local.append((name, status, time.perf_counter() - start))
+        finally:
+            connection.close()
+            with samples_lock:
+                samples.extend(local)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='loadtest-client') as executor:
+        list(executor.map(worker, range(args.concurrency)))
+    return samples, time.monotonic() - started
+
+
+def compare(results, baseline, max_regression):
+    """Return a list of regression messages for endpoints present in both runs."""
+    regressions = []
+    for endpoint, current in results.items():
+        previous = baseline.get("results", {}).get(endpoint)
+        if not previous:
+            continue
+        old_p95, new_p95 = previous["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{endpoint}: p95 {old_p95} ms -> {new_p95} ms")
+        if current["error_rate"] > previous["error_rate"] + max_regression * 0.1:
+            regressions.append(f"{endpoint}: error rate {previous['error_rate']} -> {current['error_rate']}")
+    return regressions
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(Scenarios, name.replace('-', '_')) or name in ('seed', 'build'):
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}'.")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for '{name}': {weight}") from None
+    return mix
+
+
+def print_table(results):
+    print(f"{'endpoint':<16}{'requests':>10}{'rps':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, result in results.items():
+        latency = result["latency_ms"]
+        print(f"{endpoint:<16}{result['requests']:>10}{result['throughput_rps'] or 0:>10.1f}"
+              f"{result['error_rate']:>9.2%}{latency['p50'] or 0:>10.1f}{latency['p95'] or 0:>10.1f}"
+              f"{latency['p99'] or 0:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend API with fake browser and SMTP backends.")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load to generate.")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent client connections.")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Comma-separated scenario=weight pairs, e.g. get-emails=70,add-emails=30.")
+    parser.add_argument('--seed-emails', type=int, default=1000, help="Recipients stored before the run.")
+    parser.add_argument('--batch-size', type=int, default=20, help="Addresses per bulk or send request.")
+    parser.add_argument('--sites-per-run', type=int, default=3, help="Sites per process-sites request.")
+    parser.add_argument('--browser-latency', type=float, default=0.5, help="Mean fake page load time (s).")
+    parser.add_argument('--browser-failure-rate', type=float, default=0.0)
+    parser.add_argument('--smtp-latency', type=float, default=0.02, help="Mean fake SMTP delivery time (s).")
+    parser.add_argument('--smtp-failure-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120, help="Per-request client timeout (s).")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for traffic and fake backends.")
+    parser.add_argument('--output', type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument('--baseline', type=Path, help="Earlier JSON results to compare against.")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION)
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary base directory.")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    base_dir = Path(tempfile.mkdtemp(prefix='wingstar-loadtest-'))
+    stats = Counters()
+    try:
+        backend = boot_backend(base_dir, args, stats)
+        server, port = start_server(backend.app)
+        scenarios = Scenarios(args)
+
+        def send(method, path, body):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=args.timeout)
+            try:
+                connection.request(method, path, body=json.dumps(body).encode('utf-8'),
+                                   headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                return response.status, response.read()
+            finally:
+                connection.close()
+
+        scenarios.seed(send)
+        print(f"Running {args.duration:g} s of load with {args.concurrency} clients: {args.mix}")
+        samples, elapsed = run_load(port, scenarios, args.mix, args)
+        server.shutdown()
+
+        results = summarize(samples, elapsed)
+        report = {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+            "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+            "elapsed_s": round(elapsed, 2),
+            "results": results,
+            "backends": dict(stats.values),
+        }
+        print_table(results)
+
+        if args.output:
+            args.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+            print(f"Results written to {args.output}")
+
+        if args.baseline:
+            regressions = compare(results, json.loads(args.baseline.read_text(encoding='utf-8')),
+                                  args.max_regression)
+            for regression in regressions:
+                print(f"REGRESSION {regression}")
+            if regressions:
+                return 1
+        return 0
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
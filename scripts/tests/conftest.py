@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = SCRIPTS_DIR.parent
+
+# backend reads WINGSTAR_BASE_DIR at import, so point it at a scratch tree before any test imports it
+os.environ.setdefault('WINGSTAR_BASE_DIR', tempfile.mkdtemp(prefix='wingstar-tests-'))
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import backend  # noqa: E402
+
+
+@pytest.fixture
+def app_context():
+    """A fresh database and an application context for code that calls get_db()."""
+    db_path = backend.BASE_DIR / 'wing-master-db.db'
+    if db_path.exists():
+        db_path.unlink()
+    backend.init_db()
+    backend.recipient_cache.invalidate()
+    with backend.app.app_context():
+        yield backend.get_db()
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import backend
+
+
+class BlockingDriver:
+    """Stands in for a WebDriver whose page load hangs until the browser is quit."""
+
+    def __init__(self):
+        self.quit_event = threading.Event()
+
+    def get(self, url):
+        self.quit_event.wait(30)
+        raise RuntimeError("browser quit")
+
+
+def test_cancel_quits_the_browser_of_a_running_selenium_capture(monkeypatch):
+    driver = BlockingDriver()
+    closed = []
+
+    def close_driver(closing):
+        closed.append(closing)
+        closing.quit_event.set()
+
+    monkeypatch.setattr(backend, 'create_driver', lambda *args, **kwargs: driver)
+    monkeypatch.setattr(backend, 'close_driver', close_driver)
+    plan = backend.compile_site_plans([{
+        "url": "https://example.com", "full_page": True, "full_screenshot_file": "page.png",
+    }])[0]
+    cancel = backend.CaptureCancel()
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(
+        ok=backend.capture_with_selenium(plan, plan.url, False, 0, cancel=cancel)))
+    worker.start()
+    time.sleep(0.2)
+
+    started = time.monotonic()
+    cancel.cancel()
+    worker.join(5)
+    assert not worker.is_alive() and time.monotonic() - started < 2
+    assert result == {"ok": False}
+    assert closed == [driver]
+
+
+def test_cancel_before_the_browser_starts_still_closes_it(monkeypatch):
+    driver = BlockingDriver()
+    closed = []
+    monkeypatch.setattr(backend, 'create_driver', lambda *args, **kwargs: driver)
+    monkeypatch.setattr(backend, 'close_driver', closed.append)
+    plan = backend.compile_site_plans([{
+        "url": "https://example.com", "full_page": True, "full_screenshot_file": "page.png",
+    }])[0]
+    cancel = backend.CaptureCancel()
+    cancel.cancel()
+    assert backend.capture_with_selenium(plan, plan.url, False, 0, cancel=cancel) is False
+    assert closed == [driver]
@@ -0,0 +1,38 @@
+import sqlite3
+
+import backend
+from emails import normalize_email, partition_emails
+
+
+def test_normalize_email_casefolds_and_encodes_the_domain():
+    assert normalize_email('  Straße@Bücher.Example ') == 'strasse@xn--bcher-kva.example'
+    assert normalize_email('not-an-email') is None
+    assert partition_emails(['A@x.io', 'bad', 'a@X.io']) == (['a@x.io', 'a@x.io'], ['bad'])
+
+
+def test_migration_reports_collisions_and_keeps_their_rows(app_context):
+    db_path = backend.BASE_DIR / 'wing-master-db.db'
+    db = sqlite3.connect(db_path)
+    db.executemany("INSERT INTO emails (email, status, date_added) VALUES (?, ?, ?)", [
+        ('Pilot@Example.com', 'sent', '2024-01-01'),
+        ('pilot@example.com', 'unsent', '2024-02-01'),
+        ('Tower@Example.com', 'unsent', '2024-03-01'),
+    ])
+    db.execute("PRAGMA user_version = 2")
+    db.commit()
+    db.close()
+
+    backend.init_db()
+
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT email, status, date_added FROM emails ORDER BY id").fetchall()
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    db.close()
+    assert rows == [('Pilot@Example.com', 'sent', '2024-01-01'), ('pilot@example.com', 'unsent', '2024-02-01'),
+                    ('tower@example.com', 'unsent', '2024-03-01')]
+    assert version == 2
+
+
+def test_unsubscribe_token_matches_the_canonical_address():
+    assert backend.make_unsubscribe_token('Pilot@Bücher.Example') == \
+        backend.make_unsubscribe_token('pilot@xn--bcher-kva.example')
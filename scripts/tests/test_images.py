@@ -0,0 +1,23 @@
+import os
+
+from PIL import Image
+
+import backend
+
+
+def test_email_variant_fits_the_box_without_distorting():
+    assert backend._resolve_target_size((1920, 1080), backend.EMAIL_IMAGE_VARIANTS['email']) == (870, 489)
+    assert backend._resolve_target_size((1920, 3000), backend.EMAIL_IMAGE_VARIANTS['email']) == (314, 490)
+    assert backend._resolve_target_size((1920, 3000), backend.EMAIL_IMAGE_VARIANTS['mobile']) == (480, 750)
+
+
+def test_byte_budget_falls_through_to_webp(tmp_path, monkeypatch):
+    source = tmp_path / 'noise.png'
+    Image.frombytes('RGB', (870, 490), os.urandom(870 * 490 * 3)).save(source)
+    sizes = {fmt: len(backend._encode_image(Image.open(source), fmt)) for fmt in backend.EMAIL_IMAGE_FORMATS}
+    assert sizes['webp'] < sizes['jpeg'] < sizes['png']
+
+    monkeypatch.setattr(backend, 'IMAGE_CACHE_DIR', tmp_path / 'cache')
+    budget = (sizes['webp'] + sizes['jpeg']) // 2
+    variant = backend.get_image_variant(source, backend.EMAIL_IMAGE_VARIANTS['email'], max_bytes=budget)
+    assert variant.suffix == '.webp' and variant.stat().st_size <= budget
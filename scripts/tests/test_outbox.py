@@ -0,0 +1,148 @@
+import pytest
+from PIL import Image
+
+import backend
+
+SENDER = 'reports@example.com'
+RECIPIENTS = ['a@example.com', 'b@example.com', 'c@example.com']
+
+
+class FakeSMTP:
+    """Just enough of smtplib.SMTP_SSL for stream_message; replies to each message body with `reply`."""
+
+    def __init__(self, delivered, reply=(250, b'Queued')):
+        self.delivered = delivered
+        self.reply = reply
+        self.sock = self
+        self._recipient = None
+        self._replies = []
+
+    def login(self, user, password):
+        return 235, b'Accepted'
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return 250, b'OK'
+
+    def rcpt(self, recipient):
+        self._recipient = recipient
+        return 250, b'OK'
+
+    def putcmd(self, command, args=''):
+        self._replies = [(354, b'Go ahead')]
+
+    def getreply(self):
+        if self._replies:
+            return self._replies.pop(0)
+        if self.reply[0] == 250:
+            self.delivered.append(self._recipient)
+        return self.reply
+
+    def sendall(self, data):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def rset(self):
+        return 250, b'OK'
+
+    def quit(self):
+        return 221, b'Bye'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def outbox(app_context, tmp_path, monkeypatch):
+    """An outbox with one queued batch for RECIPIENTS, and a worker-less pool to drive by hand."""
+    attachment = tmp_path / 'report.png'
+    Image.new('RGB', (40, 20), 'white').save(attachment)
+    app_context.executemany("INSERT INTO emails (email, status, date_added) VALUES (?, 'unsent', '2024-01-01')",
+                            [(email,) for email in RECIPIENTS])
+    app_context.commit()
+    db = backend.get_outbox_connection()
+    backend.enqueue_outbox_messages(db, 'batch-1', [
+        (SENDER, email, {"attachment_path": str(attachment), "html": "<p>Report</p>"}) for email in RECIPIENTS
+    ])
+    # The pool's in-memory sent counts would otherwise outlive the database of an earlier test
+    monkeypatch.setattr(backend.OutboxWorkerPool, '_load_sent_times', staticmethod(lambda sender: []))
+    yield db
+    db.close()
+
+
+def drain(pool, db):
+    """Claim and deliver due messages the way a worker thread does, until none is left."""
+    connections, image_parts = {}, {}
+    while True:
+        row = pool._claim(db)
+        if row is None:
+            return
+        try:
+            pool._deliver(db, connections, image_parts, row)
+        finally:
+            pool._release(row["sender_email"])
+
+
+def states(db):
+    return {row["recipient_email"]: (row["state"], row["attempts"]) for row in db.execute(
+        "SELECT recipient_email, state, attempts FROM outbox WHERE batch_id = 'batch-1'")}
+
+
+def test_interrupted_send_resumes_after_restart(outbox, monkeypatch):
+    delivered = []
+    monkeypatch.setattr(backend, 'open_smtp_connection', lambda: FakeSMTP(delivered))
+
+    pool = backend.OutboxWorkerPool(1)
+    pool.set_credentials(SENDER, 'secret')
+    claimed = pool._claim(outbox)
+    assert states(outbox)[claimed["recipient_email"]] == ('sending', 0)
+
+    # The process dies with the message in flight; the next start requeues it
+    backend.init_outbox()
+    assert {state for state, _ in states(outbox).values()} == {'pending'}
+
+    restarted = backend.OutboxWorkerPool(1)
+    restarted.set_credentials(SENDER, 'secret')
+    drain(restarted, outbox)
+
+    assert sorted(delivered) == RECIPIENTS
+    assert states(outbox) == {email: ('sent', 1) for email in RECIPIENTS}
+    status = backend.batch_status(outbox, 'batch-1')
+    assert status["done"] and sorted(status["sent_emails"]) == RECIPIENTS
+    assert {row[0] for row in outbox.execute("SELECT status FROM emails")} == {'sent'}
+
+
+def test_temporary_failures_retry_until_dead_letter(outbox, monkeypatch):
+    delivered = []
+    monkeypatch.setattr(backend, 'open_smtp_connection', lambda: FakeSMTP(delivered, (451, b'Try later')))
+    monkeypatch.setattr(backend, 'outbox_retry_delay', lambda attempts: 0)
+
+    pool = backend.OutboxWorkerPool(1)
+    pool.set_credentials(SENDER, 'secret')
+    drain(pool, outbox)
+
+    assert delivered == []
+    assert states(outbox) == {email: ('dead', backend.OUTBOX_MAX_ATTEMPTS) for email in RECIPIENTS}
+    status = backend.batch_status(outbox, 'batch-1')
+    assert status["done"] and sorted(status["failed_emails"]) == RECIPIENTS
+
+    # Requeued dead letters start over and go out once the server recovers
+    response = backend.app.test_client().post('/outbox/retry', json={})
+    assert response.status_code == 200 and response.get_json()["requeued"] == len(RECIPIENTS)
+    monkeypatch.setattr(backend, 'open_smtp_connection', lambda: FakeSMTP(delivered))
+    drain(pool, outbox)
+    assert states(outbox) == {email: ('sent', 1) for email in RECIPIENTS}
+
+
+def test_permanent_failure_is_dead_lettered_at_once(outbox, monkeypatch):
+    monkeypatch.setattr(backend, 'open_smtp_connection', lambda: FakeSMTP([], (550, b'No such user')))
+
+    pool = backend.OutboxWorkerPool(1)
+    pool.set_credentials(SENDER, 'secret')
+    drain(pool, outbox)
+
+    assert states(outbox) == {email: ('dead', 1) for email in RECIPIENTS}
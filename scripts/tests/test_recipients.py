@@ -0,0 +1,102 @@
+import json
+import sqlite3
+
+import pytest
+
+import backend
+
+STORED = [
+    ('a@example.com', 'unsent'), ('b@example.com', 'sent'), ('c@example.com', 'unsent'),
+    ('d@example.com', 'sent'), ('e@example.com', 'unsent'),
+]
+UPDATES = [
+    {"email": 'a@example.com', "status": 'sent'},
+    {"email": 'b@example.com', "new_email": 'b2@example.com'},
+    {"email": 'c@example.com', "new_email": 'c2@example.com', "status": 'sent'},
+    {"email": 'd@example.com', "new_email": 'd@example.com', "status": 'unsent'},
+    {"email": 'missing@example.com', "status": 'sent'},
+]
+
+
+def emails_table():
+    db = sqlite3.connect(':memory:')
+    db.execute('''
+        CREATE TABLE emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'unsent',
+            date_added TEXT NOT NULL
+        )
+    ''')
+    db.executemany("INSERT INTO emails (email, status, date_added) VALUES (?, ?, '2024-01-01')", STORED)
+    return db
+
+
+def run_strategy(monkeypatch, set_based, updates):
+    monkeypatch.setattr(backend, '_sqlite_set_based', set_based)
+    db = emails_table()
+    found = backend.batch_update_emails(db, updates)
+    return sorted(found), db.execute("SELECT id, email, status FROM emails ORDER BY id").fetchall()
+
+
+def test_batch_update_strategies_agree(monkeypatch):
+    if not backend.sqlite_supports_set_based(emails_table()):
+        pytest.skip("this SQLite build has no UPDATE ... FROM json_each")
+    assert backend.find_conflicting_renames(UPDATES) == []
+    set_based = run_strategy(monkeypatch, True, UPDATES)
+    chunked = run_strategy(monkeypatch, False, UPDATES)
+    assert set_based == chunked
+    assert set_based[0] == ['a@example.com', 'b@example.com', 'c@example.com', 'd@example.com']
+
+
+def test_batch_update_strategies_both_reject_renames_onto_existing_addresses(monkeypatch):
+    updates = [{"email": 'a@example.com', "new_email": 'e@example.com'}]
+    for set_based in (True, False):
+        with pytest.raises(sqlite3.IntegrityError):
+            run_strategy(monkeypatch, set_based, updates)
+
+
+def read_events(response, count):
+    """Parse the next count SSE messages of a streamed response into (event, id, data) tuples."""
+    events = []
+    chunks = iter(response.response)
+    while len(events) < count:
+        chunk = next(chunks)
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith(':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in text.strip().splitlines())
+        events.append((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+
+def test_email_stream_resumes_from_last_event_id(app_context):
+    client = backend.app.test_client()
+    client.post('/add-emails', json={"emails": ['a@example.com', 'b@example.com', 'c@example.com']})
+
+    response = client.get('/emails/stream', buffered=False)
+    [(event, version, data)] = read_events(response, 1)
+    response.close()
+    assert event == 'snapshot' and data["version"] == version
+    assert [row["email"] for row in data["emails"]] == ['a@example.com', 'b@example.com', 'c@example.com']
+
+    # Changes made while the client is away
+    client.post('/update-emails', json={"emails": ['a@example.com'], "status": 'sent'})
+    client.post('/delete-emails', json={"emails": ['b@example.com']})
+
+    response = client.get('/emails/stream', headers={"Last-Event-ID": str(version)}, buffered=False)
+    events = read_events(response, 2)
+    response.close()
+    assert [event for event, _, _ in events] == ['change', 'change']
+    assert events[0][2]["since"] == version and events[1][2]["since"] == events[0][1]
+    assert [(row["email"], row["status"]) for row in events[0][2]["upserted"]] == [('a@example.com', 'sent')]
+    assert events[1][2]["removed"] == ['b@example.com']
+    assert events[1][1] == backend.recipient_cache.version
+
+    # A client too far behind for the history gets a fresh snapshot instead
+    response = client.get('/emails/stream', headers={"Last-Event-ID": str(version - 1000)}, buffered=False)
+    [(event, _, data)] = read_events(response, 1)
+    response.close()
+    assert event == 'snapshot'
+    assert [(row["email"], row["status"]) for row in data["emails"]] == [('a@example.com', 'sent'),
+                                                                          ('c@example.com', 'unsent')]
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backend
+
+
+def test_fetch_urls_bounds_concurrency_and_returns_bodies():
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= 1
+            body = self.path.encode()
+            self.send_response(404 if self.path == '/missing' else 200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        urls = [f"{base}/asset{index}" for index in range(12)] + [f"{base}/missing"]
+        fetched = asyncio.run(backend._fetch_urls(urls, 3))
+    finally:
+        server.shutdown()
+
+    assert fetched[f"{base}/asset5"] == (200, 'text/plain', b'/asset5')
+    assert fetched[f"{base}/missing"][0] == 404
+    assert len(fetched) == 13
+    assert state["peak"] <= 3
@@ -0,0 +1,44 @@
+from conftest import REPO_DIR
+
+import backend
+
+WIDGET_PAGES = ('summary.html', 'multi-location.html', 'upcoming-days.html')
+
+
+def test_shipped_widget_pages_render_from_fixtures():
+    provider = backend.FixtureForecastProvider(REPO_DIR / 'fixtures' / 'forecast')
+    for page in WIDGET_PAGES:
+        spec = backend.parse_widget_embed(REPO_DIR / 'html' / page)
+        assert spec is not None, page
+        assert all(map(provider.accepts, spec.locations)), page
+        image = backend.render_widget(spec, 800, provider=provider)
+        assert image.mode == 'RGB' and image.width == 800 and image.height > 200, page
+
+
+def test_fixture_provider_refuses_unknown_locations(tmp_path):
+    provider = backend.FixtureForecastProvider(tmp_path)
+    assert not provider.accepts('112589')
+    try:
+        provider.fetch_location('112589', 'imperial')
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("a missing fixture must not produce a forecast")
+
+
+def test_tomorrow_provider_accepts_mapped_widget_locations():
+    provider = backend.TomorrowForecastProvider('key', locations=backend.load_widget_locations(
+        REPO_DIR / 'html' / 'widget-locations.json'))
+    assert provider.accepts('112589')
+    assert not provider.accepts('2610798')
+    assert provider.accepts('42.36,-71.01')
+
+
+def test_widget_plans_stay_in_the_browser_without_a_provider(monkeypatch):
+    monkeypatch.setattr(backend, 'get_forecast_provider', lambda: None)
+    plans = backend.compile_site_plans([{
+        "url": str(REPO_DIR / 'html' / 'summary.html'), "div_selector": "div.tomorrow",
+        "full_screenshot_file": "summary_full.png", "window_size": "800x800",
+        "crop_percentages": [[0, 0, 1, 1]], "output_files": ["summary-cropped.png"],
+    }])
+    assert backend.use_widget_renderer(plans) == plans